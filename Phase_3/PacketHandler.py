@@ -1,6 +1,8 @@
 # This file contains the Packet class which handles packing functions
 import struct
 
+import checksum as cksum
+
 class Packet():
   def __init__(self, seq_num=-1, data=b''):
     self.seq_num = seq_num
@@ -26,28 +28,14 @@ class Packet():
     self.csum = int.from_bytes(packed[(len(packed)-2):len(packed)], byteorder='big', signed=False)
 
   def carry_around_add(self, a, b):
-    c = a + b
-    # print(bin(c>>16))
-    return (c & 0xffff) + (c >> 16)
+    return cksum.carry_around_add(a, b)
 
   def checksum(self, seq, msg):
-    csum = 0
-    if isinstance(msg, str):
-      msg = msg.encode()
-    if isinstance(msg, (bytearray, bytes)):
-      msg = int.from_bytes(msg, byteorder='big', signed=False)
-
     # add sequence number first
-    csum = self.carry_around_add(csum, seq)
-
-    #for _ in range(0, msg.bit_length()//16 + 1, 1):
-    while msg != 0:
-      next_bits = msg & 0xffff
-      csum = self.carry_around_add(csum, next_bits)
-      #print(csum, ':', bin(csum))
-      msg = msg >> 16
-      # print(bin(msg))
-    return ~csum & 0xffff
+    csum = cksum.carry_around_add(0, seq)
+
+    # add data to csum
+    return cksum.internet_checksum(msg, csum)
 
 if __name__ == "__main__":
   #msg = b'\x00\x01\x00\x01\x00\x01\x00\x01\x00\x01\x00\x01\x00\x01\x00\x01\x00\x01'
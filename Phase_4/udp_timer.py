@@ -1,45 +1,176 @@
-from threading import Thread
-from time import time, sleep
-import sys
+from threading import Thread, Condition
+from time import monotonic as time
+import heapq
+import itertools
 
-class Timer(Thread):
+
+class TimerHandle():
+    """
+    One deadline kept by a TimerService, moved with TimerService.reschedule
+    and stopped with cancel()
+    """
+    __slots__ = ('deadline', 'callback', 'cancelled', 'version')
+
+    def __init__(self, deadline, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+        self.version = 0        # heap entries of older versions are stale
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerService(Thread):
+    """
+    Single thread serving the deadlines of every timer of every connection
+    (retransmission, connection timeouts, keepalives)
+
+    Deadlines are kept in a heap and the thread sleeps until the earliest
+    one, or until an earlier deadline is scheduled, instead of polling.
+    Pushing a deadline back, as every ACK does to the retransmission timer,
+    only updates the handle: its heap entry is moved when it comes up.
+    """
     def __init__(self):
-        Thread.__init__(self)
+        Thread.__init__(self, daemon=True)
+        self.__heap = []
+        self.__count = itertools.count()    # tie breaker for equal deadlines
+        self.__cond = Condition()
+        self.__kill = False
+
+    def __push(self, handle):
+        heapq.heappush(self.__heap, (handle.deadline, next(self.__count), handle.version, handle))
+        if self.__heap[0][3] is handle:
+            self.__cond.notify()    # new earliest deadline, wake the thread
+
+    def schedule(self, delay, callback):
+        """
+        Runs callback in the service thread once delay seconds have passed
+
+        Returns a TimerHandle to reschedule or cancel it
+        """
+        handle = TimerHandle(time() + delay, callback)
+        with self.__cond:
+            self.__push(handle)
+        return handle
+
+    def reschedule(self, handle, delay):
+        """ Moves a deadline to delay seconds from now, restarting it if it fired or was cancelled """
+        deadline = time() + delay
+        with self.__cond:
+            if handle.cancelled or deadline < handle.deadline:
+                handle.cancelled = False
+                handle.version += 1
+                handle.deadline = deadline
+                self.__push(handle)
+            else:
+                handle.deadline = deadline  # later, picked up when its entry comes up
+
+    def pending(self):
+        """ Number of heap entries, including stale ones not yet dropped """
+        return len(self.__heap)
+
+    def kill(self):
+        with self.__cond:
+            self.__kill = True
+            self.__cond.notify()
+
+    def run(self):
+        while True:
+            expired = []
+            with self.__cond:
+                while not self.__kill:
+                    if not self.__heap:
+                        self.__cond.wait()
+                        continue
+                    wait = self.__heap[0][0] - time()
+                    if wait <= 0:
+                        break
+                    self.__cond.wait(wait)
+                if self.__kill:
+                    return
+                now = time()
+                while self.__heap and self.__heap[0][0] <= now:
+                    key, count, version, handle = heapq.heappop(self.__heap)
+                    if handle.cancelled or version != handle.version:
+                        continue                # stale entry
+                    if handle.deadline > now:
+                        self.__push(handle)     # deadline was pushed back
+                        continue
+                    handle.cancelled = True     # fired, a reschedule starts it again
+                    expired.append(handle)
+
+            # callbacks run outside the lock so they can schedule again
+            for handle in expired:
+                handle.callback()
+
+
+service = None      # shared TimerService, started on first use
+
+def get_service():
+    global service
+    if service is None:
+        service = TimerService()
+        service.start()
+    return service
+
+
+class Timer():
+    """
+    Retransmission timer, get_exception() is True once the time limit has
+    passed since the last restart
+
+    Its deadline is kept by the shared TimerService, so a Timer has no
+    thread of its own. start(), kill() and join() are kept for callers
+    written against the old thread based Timer.
+    """
+    def __init__(self, timer_service=None):
+        self.__service = timer_service
         self.__time_limit = 0
+        self.__handle = None
         self.__stop = False
-        self.__kill = False
-        self.__exc = False
+        self.__exc = None
 
     def set_time(self, time_limit):
         self.__time_limit = time_limit
 
+    def __expire(self):
+        # ignore an expiry that raced with stop() or restart()
+        if not self.__stop and time() >= self.__handle.deadline:
+            self.__stop = True
+            self.__exc = True
+
+    def __schedule(self):
+        self.start_time = time()
+        if self.__handle is None:
+            if self.__service is None:
+                self.__service = get_service()
+            self.__handle = self.__service.schedule(self.__time_limit, self.__expire)
+        else:
+            self.__service.reschedule(self.__handle, self.__time_limit)
+
     def stop(self):
         self.__stop = True
-    
+        if self.__handle is not None:
+            self.__handle.cancel()
+
     def restart(self, time_limit=None):
         self.__stop = False
         if time_limit != None:
             self.__time_limit = time_limit
-        self.__exc = None
-        self.start_time = time()
+        self.__exc = False
+        self.__schedule()
 
     def get_exception(self):
         return self.__exc
-    
-    def kill(self):
-        self.__kill = True
-
-    def run(self):
-        self.start_time = time()
-        while not self.__kill:
-            if not self.__stop:
-                elapsed = time() - self.start_time
-                if elapsed >= self.__time_limit:
-                    self.__stop = True
-                    self.__exc = True
-            else:
-                pass    # timer stopped, do nothing
 
-            sleep(0.0001)   # needed to allow other threads to run
+    def start(self):
+        if not self.__stop:     # starts counting unless stopped first
+            self.__schedule()
 
+    def kill(self):
+        self.stop()
         print("Timer killed")
+
+    def join(self):
+        pass
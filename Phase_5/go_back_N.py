@@ -1,7 +1,6 @@
 #from udp_client import Client
 from udp_server import Server
 from udp_client import Client
-from udp_timer import Timer
 
 crpt_data = input("Input percentage of data corruption: ")
 crpt_ack = input("Input percentage of ack corruption: ")
@@ -1,15 +1,14 @@
 # This file implements the server process
 import socket
+import selectors
 import io
 import os
 import sys
-from time import sleep
 from time import time
 from threading import Thread
 from random import randint, seed
 
 from PacketHandler import Packet
-from udp_timer import Timer
 
 
 class Server(Thread):
@@ -64,6 +63,9 @@ class Server(Thread):
         """
         Sends the image packet by packet
 
+        Sleeps until an ACK arrives or the timer runs out, then takes every
+        queued ACK and sends every packet the window allows
+
         Parameters:
           filename - file to send
         """
@@ -72,15 +74,13 @@ class Server(Thread):
         read_data = b''         # byte string data read from file
         seq_num = 0             # init sequence number
         base = 0                # init base packet number
-        window = []             # init window as empty list
-        win_idx = 0             # index to item in window
-        last_sent = None
-        my_timer = Timer()      # Timer thread
-        my_timer.set_time(0.1)    # set timer to 100 ms
-        my_timer.stop()         # so timer doesn't start counting
-        my_timer.start()        # start timer thread
+        window = []             # init window as empty list, packets base onwards
+        time_limit = 0.1        # set timer to 100 ms
+        deadline = None         # time the timer runs out, None while stopped
+        sel = selectors.DefaultSelector()
+        sel.register(self.server_socket, selectors.EVENT_READ)
 
-        self.server_socket.settimeout(0)    # don't block when waiting for ACKs
+        self.server_socket.settimeout(0)    # don't block when taking ACKs
 
         # open file to be sent
         print("Server: Sending image to client")
@@ -96,62 +96,66 @@ class Server(Thread):
 
             # send data until end of file reached
             while read_data or len(window) > 0:
-                if (self.crpt_data_rate > 0 or self.pkt_loss_rate > 0):
-                    self.gen_err_flag()
-
-                if my_timer.get_exception():
-                    self.resend_window(window)
-                    my_timer.restart()
-                win_idx = len(window) - 1
-                if seq_num < (base + self.N) and window[win_idx] != last_sent:
+                # Move to next data until the window is full
+                while len(window) < self.N and read_data:
+                    read_data = img.read(self.data_size)
+                    # pack
+                    send_pkt = Packet(seq_num=base + len(window), data=read_data)
+                    packed = send_pkt.pkt_pack()
+                    window.append(packed)   # add packet to window
+
+                # send every packet the window allows
+                while seq_num < (base + self.N) and seq_num - base < len(window):
+                    packed = window[seq_num - base]
+                    if (self.crpt_data_rate > 0 or self.pkt_loss_rate > 0):
+                        self.gen_err_flag()
                     # corrupt 1 byte of the sent packet
                     if self.crpt_data_rate > 0 and self.err_flag <= self.crpt_data_rate:
-                        crptpacked = b"".join([window[win_idx][0:1023], b"\x00"])
+                        crptpacked = b"".join([packed[0:1023], b"\x00"])
                         self.server_socket.sendto(crptpacked, self.client_addr)
                     elif self.pkt_loss_rate > 0 and self.err_flag <= self.pkt_loss_rate:
                         pass    # dont send anything
                     else:
-                        self.server_socket.sendto(window[win_idx], self.client_addr)
-                    last_sent = window[win_idx]
+                        self.server_socket.sendto(packed, self.client_addr)
                     if base == seq_num:
-                        my_timer.restart()  # start timer
+                        deadline = time() + time_limit  # start timer
                     seq_num += 1
 
-                # wait for ACK
-                if recv_data:
-                    recv_data = b''     # empty data buffer
-                try:
-                    recv_data = self.server_socket.recv(self.pkt_size)
-                except socket.error as e:
-                    if e == 10035:
-                        pass
+                # wait for ACK or timer
+                if deadline is None:
+                    events = sel.select()
+                else:
+                    events = sel.select(max(0, deadline - time()))
+
+                if not events:
+                    if deadline is not None and time() >= deadline:
+                        self.resend_window(window)
+                        deadline = time() + time_limit  # restart timer
+                    continue
+
+                # take every ACK queued
+                while True:
+                    try:
+                        recv_data = self.server_socket.recv(self.pkt_size)
+                    except socket.error:
+                        break   # no more ACKs
 
-                if recv_data:
                     recv_pkt.pkt_unpack(recv_data)
 
                     # Received NAK
                     if recv_pkt.csum != recv_pkt.checksum(recv_pkt.seq_num, recv_pkt.data):
                         pass
                     # ACK is OK
-                    else:
+                    elif recv_pkt.seq_num >= base:
+                        del window[:recv_pkt.seq_num + 1 - base]    # remove acked packets from window
                         base = recv_pkt.seq_num + 1     # increment base
-                        window.pop(0)                   # remove acked packet from window
                         if base == seq_num:
-                            my_timer.stop()
+                            deadline = None             # stop timer
                         else:
-                            my_timer.restart()
-                # Move to next data 
-                if len(window) < self.N and read_data:
-                    read_data = img.read(self.data_size)
-                    # pack
-                    send_pkt = Packet(seq_num=seq_num, data=read_data)
-                    packed = send_pkt.pkt_pack()
-                    window.append(packed)   # add packet to window
-                sleep(0.0001)
+                            deadline = time() + time_limit  # restart timer
 
         end = time()
-        my_timer.kill()
-        my_timer.join()
+        sel.close()
         self.server_socket.settimeout(5)    # reset timeout value
         print("Server: Time to send image:", end - start)
 
@@ -0,0 +1,28 @@
+# This file benchmarks the congestion control algorithms on an emulated high
+# bandwidth-delay product path (see emulated_path): a long transfer, light
+# random loss, and the time each algorithm takes to fill the pipe again
+from emulated_path import Path, run_transfer
+from congestion import ALGORITHMS
+
+delay = 0.040           # one way propagation delay in seconds
+rate = 12500            # packets per second through the bottleneck
+queue_limit = 250       # packets the bottleneck queue holds, a quarter of the BDP
+copies = 200            # times hello.jpg is repeated in the transfer
+
+
+def run(cc, loss, blob):
+    path = Path(rate, delay, queue_limit, loss, seed=1)
+    trace = []
+    sender = run_transfer(path, blob, trace, cc=cc)
+    windows = [row[3] for row in trace]
+    print("{0:<8}{1:>6}% loss  {2:7.2f} s  {3:6.1f} Mbit/s  mean window {4:6.0f}  {5:>5} resent".format(
+        cc, loss, path.now, len(blob) * 8 / path.now / 1e6, sum(windows) / len(windows), sender.resent))
+
+
+if __name__ == "__main__":
+    with open('hello.jpg', 'rb') as img:
+        blob = img.read() * copies
+    print("path: {0} packets/s, {1:.0f} ms RTT, {2} packet BDP".format(rate, 2000 * delay, int(rate * 2 * delay)))
+    for loss in (0, 0.01):
+        for cc in ALGORITHMS:
+            run(cc, loss, blob)
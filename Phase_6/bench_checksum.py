@@ -0,0 +1,39 @@
+# This file benchmarks the payload checksum for payload sizes from 0 to 64 KB
+from os import urandom
+from time import perf_counter
+
+from checksum import carry_around_add, internet_checksum
+
+sizes = [0, 64, 512, 1006, 4096, 16384, 65536]     # payload sizes in bytes
+
+
+def old_checksum(msg, csum=0):
+    """ Original checksum: shift one big integer 16 bits per iteration """
+    msg = int.from_bytes(msg, byteorder='big', signed=False)
+    while msg != 0:
+        next_bits = msg & 0xffff
+        csum = carry_around_add(csum, next_bits)
+        msg = msg >> 16
+    return ~csum & 0xffff
+
+
+def rate(func, msg, min_time=0.2):
+    """ Returns checksums/sec, repeating until at least min_time has passed """
+    n = 0
+    start = perf_counter()
+    elapsed = 0
+    while elapsed < min_time:
+        func(msg, 0x1234)
+        n += 1
+        elapsed = perf_counter() - start
+    return n / elapsed
+
+
+if __name__ == "__main__":
+    print("{0:>8}{1:>16}{2:>16}{3:>10}".format("bytes", "before/sec", "after/sec", "speedup"))
+    for size in sizes:
+        msg = urandom(size)
+        assert old_checksum(msg, 0x1234) == internet_checksum(msg, 0x1234)
+        before = rate(old_checksum, msg)
+        after = rate(internet_checksum, msg)
+        print("{0:>8}{1:>16,.0f}{2:>16,.0f}{3:>9.1f}x".format(size, before, after, after / before))
@@ -0,0 +1,50 @@
+# This file benchmarks aggregate download throughput of one Server against
+# the number of clients downloading from it at the same time, each client
+# runs in its own process so only the server shares its interpreter
+import io
+import os
+from contextlib import redirect_stdout
+from multiprocessing import Process
+from time import perf_counter, sleep
+
+from tcp_server import Server
+from tcp_client import Client
+
+
+def download(server_port, img_save_to):
+    with redirect_stdout(io.StringIO()):    # the client narrates every step
+        client = Client(0, 0, port=0, server_port=server_port)
+        client.img_save_to = img_save_to
+        client.run()
+
+
+def run(n_clients):
+    with redirect_stdout(io.StringIO()):
+        server = Server(0, 0, port=0, serve_forever=True)
+        server.start()
+    clients = [Process(target=download, args=(server.server_port, 'bench_client_{0}.jpg'.format(i)))
+               for i in range(n_clients)]
+
+    with redirect_stdout(io.StringIO()):
+        start = perf_counter()
+        for client in clients:
+            client.start()
+        while server.downloads < n_clients and server.is_alive():
+            sleep(0.001)
+        elapsed = perf_counter() - start
+
+        for client in clients:
+            client.join()
+        server.stop()
+        server.join()
+
+    for i in range(n_clients):
+        os.remove('bench_client_{0}.jpg'.format(i))
+    total = n_clients * os.path.getsize(server.img_to_send)
+    print("{0:>3} clients  {1:>3} downloads  {2:8.1f} Mbit/s aggregate".format(
+        n_clients, server.downloads, total * 8 / elapsed / 1e6))
+
+
+if __name__ == "__main__":
+    for n_clients in (1, 2, 4, 8, 16):
+        run(n_clients)
@@ -0,0 +1,58 @@
+# This file benchmarks the packet codec in packets/sec for full size payloads
+import struct
+from os import urandom
+from time import perf_counter
+
+from PacketHandler import Packet, HEADER_LEN
+
+pkt_size = 1024                         # packet size
+data_size = pkt_size - HEADER_LEN       # 1006 byte payload
+n_pkts = 20000                          # packets per run
+
+
+def old_pack(pkt):
+    """ Original codec: new format string and one argument per payload byte """
+    fmt = '!HHLLBBHH' + 'B'*len(pkt.data)
+    return struct.pack(fmt, pkt.src, pkt.dst, pkt.seq_num, pkt.ack_num,
+                       pkt.head_len, pkt.ctrl_bits, pkt.rwin, pkt.csum, *pkt.data)
+
+
+def old_unpack(pkt, packed):
+    """ Original codec: one int.from_bytes per header field """
+    pkt.src = int.from_bytes(packed[0:2], byteorder='big', signed=False)
+    pkt.dst = int.from_bytes(packed[2:4], byteorder='big', signed=False)
+    pkt.seq_num = int.from_bytes(packed[4:8], byteorder='big', signed=False)
+    pkt.ack_num = int.from_bytes(packed[8:12], byteorder='big', signed=False)
+    pkt.head_len = int.from_bytes(packed[12:13], byteorder='big', signed=False)
+    pkt.ctrl_bits = int.from_bytes(packed[13:14], byteorder='big', signed=False)
+    pkt.rwin = int.from_bytes(packed[14:16], byteorder='big', signed=False)
+    pkt.csum = int.from_bytes(packed[16:18], byteorder='big', signed=False)
+    pkt.data = packed[18:len(packed)]
+
+
+def rate(func):
+    start = perf_counter()
+    for _ in range(n_pkts):
+        func()
+    return n_pkts / (perf_counter() - start)
+
+
+if __name__ == "__main__":
+    pkt = Packet(20001, 20002, 1006, 0, urandom(data_size), 0x00)
+    packed = pkt.pkt_pack()
+    buf = bytearray(pkt_size)   # reused send buffer
+    recv_pkt = Packet()
+
+    assert old_pack(pkt) == packed
+    pkt.pack_into(buf)
+    assert bytes(buf) == packed
+
+    results = [
+        ("pack   (before)", rate(lambda: old_pack(pkt))),
+        ("pack   (after, pkt_pack)", rate(pkt.pkt_pack)),
+        ("pack   (after, pack_into)", rate(lambda: pkt.pack_into(buf))),
+        ("unpack (before)", rate(lambda: old_unpack(recv_pkt, packed))),
+        ("unpack (after)", rate(lambda: recv_pkt.pkt_unpack(packed))),
+    ]
+    for name, pps in results:
+        print("{0:<28}{1:>14,.0f} packets/sec".format(name, pps))
@@ -0,0 +1,79 @@
+# This file benchmarks downloads to a slow receiver, one that takes a while to
+# write every segment like a slow disk: with the advertised window the server
+# never has more in flight than the client's socket can queue, without it the
+# socket overflows and the drops are retransmitted
+import io
+import os
+from contextlib import redirect_stdout
+from multiprocessing import Process
+from time import perf_counter, sleep
+
+import tcp_client
+from file_writer import SegmentWriter
+from tcp_server import Server
+from tcp_client import Client
+from transfer import RecvWindow
+
+write_delay = 0.0002    # seconds the receiver spends on every segment
+copies = 4              # times hello.jpg is repeated in the download
+img_to_send = 'bench_flow.jpg'
+img_save_to = 'bench_client_flow.jpg'
+
+
+class SlowWriter(SegmentWriter):
+    def write(self, offset, data):
+        deadline = perf_counter() + write_delay
+        SegmentWriter.write(self, offset, data)
+        while perf_counter() < deadline:
+            pass
+
+
+class OpenWindow(RecvWindow):
+    """ Advertises the largest window whatever the buffer holds, no flow control """
+    def rwin(self):
+        return 0xFFFF
+
+
+def download(server_port, flow_control):
+    tcp_client.SegmentWriter = SlowWriter
+    if not flow_control:
+        tcp_client.RecvWindow = OpenWindow
+    with redirect_stdout(io.StringIO()):    # the client narrates every step
+        client = Client(0, 0, port=0, server_port=server_port)
+        client.img_save_to = img_save_to
+        client.run()
+
+
+def run(flow_control):
+    with redirect_stdout(io.StringIO()):
+        server = Server(0, 0, port=0, serve_forever=True)
+        server.img_to_send = img_to_send
+        server.start()
+    client = Process(target=download, args=(server.server_port, flow_control))
+
+    with redirect_stdout(io.StringIO()):
+        start = perf_counter()
+        client.start()
+        while server.downloads < 1 and server.is_alive():
+            sleep(0.001)
+        elapsed = perf_counter() - start
+
+        client.join()
+        server.stop()
+        server.join()
+
+    os.remove(img_save_to)
+    print("{0:<14}{1:7.2f} s  {2:6.1f} Mbit/s goodput  {3:>6} retransmits".format(
+        "flow control" if flow_control else "open window", elapsed,
+        server.bytes_sent * 8 / elapsed / 1e6, server.retransmits))
+
+
+if __name__ == "__main__":
+    with open('hello.jpg', 'rb') as img, open(img_to_send, 'wb') as out:
+        out.write(img.read() * copies)
+    print("receiver: {0:.0f} us per segment".format(write_delay * 1e6))
+    try:
+        for flow_control in (False, True):
+            run(flow_control)
+    finally:
+        os.remove(img_to_send)
@@ -0,0 +1,47 @@
+# This file benchmarks loopback packets/sec with plain sendto/recv against the
+# UDP GSO/GRO fast path
+import socket
+from os import urandom
+from time import perf_counter
+
+from recv_ring import RecvRing
+from udp_gso import GSOSender
+
+pkt_size = 1024     # packet size
+batch = 63          # packets handed to the sender at once (one full GSO send)
+n_batches = 2000    # batches per run
+
+
+def run(name, gso):
+    sock_out = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    sock_in = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    sock_in.bind(('127.0.0.1', 0))
+    sock_in.settimeout(1)
+    sender = GSOSender(sock_out, gso)
+    ring = RecvRing(sock_in, pkt_size, gro=gso)
+    if gso and not (sender.enabled and ring.gro):
+        print("{0:<10} not supported by this kernel".format(name))
+        return
+
+    packets = [urandom(pkt_size) for _ in range(batch)]
+    dst = sock_in.getsockname()
+    received = 0
+    start = perf_counter()
+    for _ in range(n_batches):
+        sender.send(packets, dst)
+        for _ in range(batch):     # drain the batch
+            try:
+                ring.recv()
+                received += 1
+            except socket.timeout:
+                break
+    elapsed = perf_counter() - start
+    print("{0:<10}{1:>12,.0f} packets/sec  ({2} of {3} received)".format(
+        name, received / elapsed, received, batch*n_batches))
+    sock_out.close()
+    sock_in.close()
+
+
+if __name__ == "__main__":
+    run("sendto", False)
+    run("GSO/GRO", True)
@@ -0,0 +1,42 @@
+# This file benchmarks the loss recovery and window rules on an emulated
+# path (see emulated_path) with random loss, and writes the time-sequence
+# trace of every run to one CSV
+import csv
+
+from emulated_path import Path, run_transfer
+
+delay = 0.020           # one way propagation delay in seconds
+rate = 2000             # packets per second through the bottleneck
+queue_limit = 100       # packets the bottleneck queue holds
+copies = 8              # times hello.jpg is repeated in the transfer
+trace_file = 'time_sequence.csv'
+
+RUNS = (('old', dict(sack=False, cc='legacy')),
+        ('old+sack', dict(sack=True, cc='legacy')),
+        ('newreno', dict(sack=False, cc='reno')),
+        ('newreno+sack', dict(sack=True, cc='reno')))
+
+
+def run(name, loss, blob, rows, **window_args):
+    path = Path(rate, delay, queue_limit, loss, seed=loss)
+    trace = []
+    sender = run_transfer(path, blob, trace, **window_args)
+    rows.extend((name, loss) + row for row in trace)
+
+    print("{0:<14}{1:>3}% loss  {2:7.2f} s  {3:6.2f} Mbit/s  {4:>5} resent  {5:>3} timeouts".format(
+        name, loss, path.now, len(blob) * 8 / path.now / 1e6, sender.resent, sender.timeouts))
+
+
+if __name__ == "__main__":
+    with open('hello.jpg', 'rb') as img:
+        blob = img.read() * copies
+    print("path: {0} packets/s, {1:.0f} ms RTT, {2} packet queue".format(rate, 2000 * delay, queue_limit))
+    rows = []
+    for loss in (0, 1, 2, 5):
+        for name, window_args in RUNS:
+            run(name, loss, blob, rows, **window_args)
+    with open(trace_file, 'w', newline='') as trace_csv:
+        writer = csv.writer(trace_csv, delimiter=',')
+        writer.writerow(('run', 'loss', 'time', 'event', 'seq', 'window'))
+        writer.writerows(rows)
+    print("time-sequence traces written to", trace_file)
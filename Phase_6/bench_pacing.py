@@ -0,0 +1,87 @@
+# This file benchmarks paced against bursty uploads through a local
+# impairment proxy (see impair_proxy) with a rate capped, shallow queue
+# towards the server: bursts overflow the queue, paced packets fit through
+import io
+import os
+from contextlib import redirect_stdout
+from multiprocessing import Process, Queue, Event
+from time import perf_counter
+
+from PacketHandler import Packet
+from impair_proxy import ImpairProxy
+from tcp_server import Server
+from tcp_client import Client
+
+rate = 2000             # packets per second from the client to the server
+queue_limit = 32        # packets the proxy queues, less than the bandwidth-delay product
+delay = 0.010           # one way delay of the proxy in seconds
+copies = 16             # times hello.jpg is repeated in the upload
+img_to_send = 'bench_pacing.jpg'
+img_save_to = 'bench_server_pacing.jpg'
+
+
+def proxy(server_port, ports, stop, results):
+    proxy = ImpairProxy(server_port, up_rate=rate, queue_limit=queue_limit, delay=delay)
+    proxy.start()
+    ports.put(proxy.port)
+    stop.wait()
+    proxy.stop()
+    proxy.join()
+    results.put(proxy.stats())
+
+
+def upload(proxy_port, pacing, results):
+    with redirect_stdout(io.StringIO()):    # the client narrates every step
+        client = Client(0, 0, port=0, server_port=proxy_port)
+        client.est_connection()
+        request = Packet(src=client.client_port, dst=client.server_port, seq_num=0, ack_num=0,
+                         data="upload", ctrl_bits=0x00)
+        client.client_socket.sendto(request.pkt_pack(), client.server_addr)
+        client.client_socket.recv(client.pkt_size)
+
+        start = perf_counter()
+        client.send_img(img_to_send, pacing=pacing)
+        results.put(perf_counter() - start)
+
+        # the control packet ends the upload
+        request = Packet(src=client.client_port, dst=client.server_port, seq_num=0, ack_num=0,
+                         data="exit", ctrl_bits=0x01)
+        client.client_socket.sendto(request.pkt_pack(), client.server_addr)
+
+
+def run(pacing):
+    with redirect_stdout(io.StringIO()):
+        server = Server(0, 0, port=0, serve_forever=True)
+        server.img_save_to = img_save_to
+        server.start()
+    ports, stop, results = Queue(), Event(), Queue()
+    impair = Process(target=proxy, args=(server.server_port, ports, stop, results))
+    impair.start()
+    client = Process(target=upload, args=(ports.get(), pacing, results))
+
+    with redirect_stdout(io.StringIO()):
+        client.start()
+        elapsed = results.get()
+        client.join()
+        stop.set()
+        stats = results.get()['up']
+        impair.join()
+        server.stop()
+        server.join()
+
+    os.remove(img_save_to)
+    size = os.path.getsize(img_to_send)
+    print("{0:<8}{1:7.2f} s  {2:6.2f} Mbit/s goodput  {3:>5} packets  {4:>5} dropped  {5:5.1f}% loss".format(
+        "paced" if pacing else "bursty", elapsed, size * 8 / elapsed / 1e6,
+        stats['received'], stats['dropped'], 100 * stats['loss']))
+
+
+if __name__ == "__main__":
+    with open('hello.jpg', 'rb') as img, open(img_to_send, 'wb') as out:
+        out.write(img.read() * copies)
+    print("proxy: {0} packets/s, {1:.0f} ms RTT, {2} packet queue".format(rate, 2000 * delay, queue_limit))
+    try:
+        for pacing in (False, True):
+            run(pacing)
+    finally:
+        os.remove(img_to_send)
@@ -0,0 +1,52 @@
+# This file benchmarks memory allocated by the datagram receive path:
+# socket.recv (new bytes object per datagram) against the recv_into ring
+import socket
+import tracemalloc
+from os import urandom
+from time import perf_counter
+
+from recv_ring import RecvRing
+
+pkt_size = 1024     # packet size
+burst_size = 64     # datagrams queued and drained per burst (as recv_burst does)
+n_bursts = 200      # bursts per run
+report_every = 40   # bursts between samples
+
+
+def run(name, sock_out, sock_in, recv):
+    """
+    Sends bursts of datagrams over loopback and drains each burst with recv,
+    keeping the burst alive until it is processed, like recv_img does
+    """
+    packet = urandom(pkt_size)
+    dst = sock_in.getsockname()
+    samples = []
+    tracemalloc.start()
+    start = perf_counter()
+    for i in range(n_bursts):
+        for _ in range(burst_size):
+            sock_out.sendto(packet, dst)
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        burst = [recv() for _ in range(burst_size)]
+        peak = tracemalloc.get_traced_memory()[1]
+        del burst
+        if i % report_every == 0:
+            samples.append((peak - before) / burst_size)
+    elapsed = perf_counter() - start
+    tracemalloc.stop()
+    print("{0:<14} bytes allocated per datagram over the run: {1}  ({2:,.0f} datagrams/sec)".format(
+        name, " ".join("{0:6.0f}".format(s) for s in samples), n_bursts*burst_size / elapsed))
+
+
+if __name__ == "__main__":
+    sock_out = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    sock_in = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    sock_in.bind(('127.0.0.1', 0))
+
+    run("recv", sock_out, sock_in, lambda: sock_in.recv(pkt_size))
+    ring = RecvRing(sock_in, pkt_size)
+    run("recv_into ring", sock_out, sock_in, ring.recv)
+
+    sock_out.close()
+    sock_in.close()
@@ -0,0 +1,50 @@
+# This file benchmarks the latency of whole requests for small files: one
+# client connects, downloads the file and closes the connection, timed
+# from the SYN until the client has ACKed the FIN of the server
+import io
+import os
+from contextlib import redirect_stdout
+from statistics import median
+from time import perf_counter
+
+from tcp_server import Server
+from tcp_client import Client
+
+sizes = (1000, 10000, 100000)   # bytes of the files requested
+requests = 10                   # requests timed per size
+img_to_send = 'bench_requests.jpg'
+img_save_to = 'bench_client_requests.jpg'
+
+
+def run(size):
+    with open('hello.jpg', 'rb') as img, open(img_to_send, 'wb') as out:
+        data = img.read()
+        out.write((data * (size // len(data) + 1))[:size])
+    with redirect_stdout(io.StringIO()):
+        server = Server(0, 0, port=0, serve_forever=True)
+        server.img_to_send = img_to_send
+        server.start()
+
+    latencies = []
+    with redirect_stdout(io.StringIO()):    # the client narrates every step
+        for _ in range(requests):
+            client = Client(0, 0, port=0, server_port=server.server_port)
+            client.img_save_to = img_save_to
+            start = perf_counter()
+            client.start()
+            client.join()
+            latencies.append(perf_counter() - start)
+        server.stop()
+        server.join()
+
+    os.remove(img_save_to)
+    print("{0:>7} bytes  {1:8.1f} ms median  {2:8.1f} ms max  {3:>3} downloads".format(
+        size, median(latencies) * 1e3, max(latencies) * 1e3, server.downloads))
+
+
+if __name__ == "__main__":
+    try:
+        for size in sizes:
+            run(size)
+    finally:
+        os.remove(img_to_send)
@@ -0,0 +1,88 @@
+# This file compares the rtt samples of downloads timed when the server loop
+# reads each ACK against samples timed by the kernel when the ACK arrived
+# (SO_TIMESTAMPNS): with several clients the loop reads ACKs late, and that
+# delay ends up in the deviation and so in the retransmission timeout. Both
+# are taken from the same ACKs of one run, so the difference between them is
+# only how long each ACK waited to be read
+import io
+import os
+from contextlib import redirect_stdout
+from multiprocessing import Process
+from statistics import median, pstdev, quantiles
+from time import sleep
+
+import tcp_server
+from tcp_server import Server
+from tcp_client import Client
+from transfer import SendWindow
+
+n_clients = 4           # clients downloading at once
+copies = 1              # times hello.jpg is repeated in the download
+rounds = 3              # runs, each compares the two timings of its own ACKs
+img_to_send = 'bench_rtt_stamps.jpg'
+windows = []            # every sender of the running server
+
+
+class RecordedWindow(SendWindow):
+    """ Keeps hold of every sender, its samples are read once the downloads are done """
+    def __init__(self, *args, **kwargs):
+        SendWindow.__init__(self, *args, **kwargs)
+        windows.append(self)
+
+
+def download(server_port, img_save_to):
+    with redirect_stdout(io.StringIO()):    # the client narrates every step
+        client = Client(0, 0, port=0, server_port=server_port)
+        client.img_save_to = img_save_to
+        client.run()
+
+
+def describe(name, samples):
+    pct = quantiles(samples, n=100)
+    print("  {0:<7}{1:>6} samples  {2:6.3f} ms median  {3:6.3f} ms p90  {4:6.3f} ms p99  "
+          "{5:6.3f} ms stdev".format(name, len(samples), median(samples), pct[89], pct[98], pstdev(samples)))
+
+
+def run():
+    del windows[:]
+    with redirect_stdout(io.StringIO()):
+        server = Server(0, 0, port=0, serve_forever=True, kernel_stamps=True, export=False)
+        server.img_to_send = img_to_send
+        server.start()
+    clients = [Process(target=download, args=(server.server_port, 'bench_client_{0}.jpg'.format(i)))
+               for i in range(n_clients)]
+
+    with redirect_stdout(io.StringIO()):
+        for client in clients:
+            client.start()
+        while server.downloads < n_clients and server.is_alive():
+            sleep(0.001)
+        for client in clients:
+            client.join()
+        server.stop()
+        server.join()
+
+    for i in range(n_clients):
+        os.remove('bench_client_{0}.jpg'.format(i))
+    kernel = [rtt * 1e3 for window in windows for rtt in window.rtt_samples]
+    loop = [rtt * 1e3 for window in windows for rtt in window.read_samples]
+    if not server.ring.stamps:
+        print("  no kernel stamps on this system, both timings are the loop's")
+    describe("loop", loop)
+    describe("kernel", kernel)
+    waits = [read - arrived for read, arrived in zip(loop, kernel)]
+    print("  each ACK waited {0:6.3f} ms median, {1:6.3f} ms p99, {2:6.3f} ms at most before the loop read it".format(
+        median(waits), quantiles(waits, n=100)[98], max(waits)))
+
+
+if __name__ == "__main__":
+    tcp_server.SendWindow = RecordedWindow
+    with open('hello.jpg', 'rb') as img, open(img_to_send, 'wb') as out:
+        out.write(img.read() * copies)
+    print("{0} clients downloading at once".format(n_clients))
+    try:
+        for i in range(rounds):
+            print("run", i + 1)
+            run()
+    finally:
+        os.remove(img_to_send)
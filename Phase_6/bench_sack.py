@@ -0,0 +1,54 @@
+# This file benchmarks download goodput against data packet loss, with the
+# sender repairing every hole the SACK blocks show and with the old
+# cumulative ACK recovery that resends only base after 3 duplicate ACKs
+#
+# SACK keeps recovery from being the limit: every lost segment is resent
+# about once and without waiting for timeouts. At 20% loss goodput is still
+# far below the no loss rate, because the congestion window shrinks on
+# every loss event and the emulated random loss looks like congestion
+import io
+import os
+from contextlib import redirect_stdout
+from multiprocessing import Process
+from time import perf_counter, sleep
+
+from tcp_server import Server
+from tcp_client import Client
+
+img_save_to = 'bench_client_sack.jpg'
+
+
+def download(server_port):
+    with redirect_stdout(io.StringIO()):    # the client narrates every step
+        client = Client(0, 0, port=0, server_port=server_port)
+        client.img_save_to = img_save_to
+        client.run()
+
+
+def run(data_loss, sack):
+    with redirect_stdout(io.StringIO()):
+        server = Server(0, data_loss, port=0, serve_forever=True, sack=sack)
+        server.start()
+    client = Process(target=download, args=(server.server_port,))
+
+    with redirect_stdout(io.StringIO()):
+        start = perf_counter()
+        client.start()
+        while server.downloads < 1 and server.is_alive():
+            sleep(0.001)
+        elapsed = perf_counter() - start
+
+        client.join()
+        server.stop()
+        server.join()
+
+    os.remove(img_save_to)
+    print("{0:>3}% loss  {1:<10}{2:8.1f} Mbit/s goodput  {3:>5} retransmits".format(
+        data_loss, "SACK" if sack else "cumulative", server.bytes_sent * 8 / elapsed / 1e6,
+        server.retransmits))
+
+
+if __name__ == "__main__":
+    for data_loss in (0, 5, 10, 20):
+        run(data_loss, False)
+        run(data_loss, True)
@@ -0,0 +1,48 @@
+# This file benchmarks transfers to a receiver that stalls every so often on
+# an emulated path (see emulated_path): a stall longer than the
+# retransmission timeout expires the timer though nothing was lost, and the
+# window falls back to slow start unless the sender finds the timeout
+# spurious, by the timestamps echo (Eifel) or the duplicates the receiver
+# reports (DSACK), and undoes it
+import emulated_path
+from emulated_path import Path, run_transfer
+from transfer import SendWindow
+
+delay = 0.020           # one way propagation delay in seconds
+rate = 2000             # packets per second through the bottleneck
+queue_limit = 100       # packets the bottleneck queue holds
+stall_every = 1         # seconds between stalls of the receiver
+copies = 4              # times hello.jpg is repeated in the transfer
+
+
+class NoUndo(SendWindow):
+    """ Keeps the window a timeout shrank, spurious or not """
+    def undo(self):
+        pass
+
+
+RUNS = (('no undo', NoUndo, True),
+        ('dsack', SendWindow, False),
+        ('eifel', SendWindow, True))
+
+
+def run(name, window, timestamps, stall, blob):
+    emulated_path.SendWindow = window
+    path = Path(rate, delay, queue_limit, stall=stall, stall_every=stall_every)
+    sender = run_transfer(path, blob, timestamps=timestamps)
+    print("{0:>4.0f} ms stall  {1:<9}{2:7.2f} s  {3:6.2f} Mbit/s  {4:>3} timeouts  {5:>3} undone  "
+          "{6:>4} resent  {7:>4} dsacks".format(stall * 1e3, name, path.now, len(blob) * 8 / path.now / 1e6,
+                                                sender.timeouts, sender.spurious, sender.resent, sender.dsacks))
+
+
+if __name__ == "__main__":
+    with open('hello.jpg', 'rb') as img:
+        blob = img.read() * copies
+    print("path: {0} packets/s, {1:.0f} ms RTT, {2} packet queue, a stall every {3} s".format(
+        rate, 2000 * delay, queue_limit, stall_every))
+    try:
+        for stall in (0, 0.05, 0.1, 0.2):
+            for name, window, timestamps in RUNS:
+                run(name, window, timestamps, stall, blob)
+    finally:
+        emulated_path.SendWindow = SendWindow
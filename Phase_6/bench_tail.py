@@ -0,0 +1,37 @@
+# This file benchmarks the completion time of short transfers on an emulated
+# path (see emulated_path) with random loss: a hole at the tail of a small
+# window has too few segments above it for duplicate ACKs or SACK to show it,
+# without RACK and tail loss probes it waits for the retransmission timeout
+from statistics import median, quantiles
+
+from emulated_path import Path, run_transfer
+
+delay = 0.020           # one way propagation delay in seconds
+rate = 2000             # packets per second through the bottleneck
+queue_limit = 100       # packets the bottleneck queue holds
+sizes = (10000, 50000)  # bytes of the transfers
+transfers = 500         # transfers timed per size and loss, each with its own loss pattern
+
+
+def run(size, loss, rack, blob):
+    times = []
+    timeouts = 0
+    for seed in range(transfers):
+        path = Path(rate, delay, queue_limit, loss, seed=seed)
+        sender = run_transfer(path, blob[:size], rack=rack)
+        times.append(path.now)
+        timeouts += sender.timeouts
+    pct = quantiles(times, n=100)
+    print("{0:>6} bytes {1:>3}% loss  {2:<8}{3:7.1f} ms median  {4:7.1f} ms p90  {5:7.1f} ms p99  "
+          "{6:>5} timeouts".format(size, loss, "rack" if rack else "sack", median(times) * 1e3,
+                                   pct[89] * 1e3, pct[98] * 1e3, timeouts))
+
+
+if __name__ == "__main__":
+    with open('hello.jpg', 'rb') as img:
+        blob = img.read()
+    print("path: {0} packets/s, {1:.0f} ms RTT, {2} packet queue".format(rate, 2000 * delay, queue_limit))
+    for size in sizes:
+        for loss in (1, 3, 5):
+            for rack in (False, True):
+                run(size, loss, rack, blob)
@@ -0,0 +1,61 @@
+# This file benchmarks aggregate download throughput against the number of
+# SO_REUSEPORT server workers, with the same set of clients each time
+import io
+import os
+from contextlib import redirect_stdout
+from multiprocessing import Process
+from time import perf_counter, sleep
+
+from tcp_workers import ServerPool
+from tcp_client import Client
+
+port = 20011            # port shared by the workers
+n_clients = 16          # clients downloading at once
+timeout = 60            # seconds the downloads of one run may take before it is given up
+
+
+def download(img_save_to):
+    with redirect_stdout(io.StringIO()):    # the client narrates every step
+        client = Client(0, 0, port=0, server_port=port)
+        client.img_save_to = img_save_to
+        client.run()
+
+
+def run(n_workers):
+    with redirect_stdout(io.StringIO()):
+        pool = ServerPool(n_workers, port=port)
+        pool.start()
+    clients = [Process(target=download, args=('bench_client_{0}.jpg'.format(i),))
+               for i in range(n_clients)]
+
+    start = perf_counter()
+    for client in clients:
+        client.start()
+    while pool.stats()['downloads'] < n_clients and perf_counter() - start < timeout:
+        sleep(0.001)
+    elapsed = perf_counter() - start
+
+    for client in clients:
+        client.join(max(0, start + timeout - perf_counter()))
+        if client.is_alive():
+            client.terminate()  # its download failed, the client is still waiting
+            client.join()
+    with redirect_stdout(io.StringIO()):
+        stats = pool.stop()
+    per_worker = [worker['connections'] for worker in pool.stats(per_worker=True)]
+
+    for i in range(n_clients):
+        if os.path.exists('bench_client_{0}.jpg'.format(i)):
+            os.remove('bench_client_{0}.jpg'.format(i))
+    if stats['downloads'] < n_clients:
+        print("{0:>2} workers  FAILED: {1} of {2} downloads done after {3} s".format(
+            n_workers, stats['downloads'], n_clients, timeout))
+        return
+    print("{0:>2} workers  {1:8.1f} Mbit/s aggregate  {2:>4} retransmits  clients per worker {3}".format(
+        n_workers, stats['bytes_sent'] * 8 / elapsed / 1e6, stats['retransmits'], per_worker))
+
+
+if __name__ == "__main__":
+    print(os.cpu_count(), "cores")
+    for n_workers in (1, 2, 4, 8):
+        run(n_workers)
@@ -0,0 +1,86 @@
+# This file contains the Internet checksum (RFC 1071) used by PacketHandler
+"""
+The original checksum loop turned the payload into one big integer and shifted
+it 16 bits at a time, which is quadratic in the payload size. Here the payload
+is folded in bulk instead: because 2^16 = 1 (mod 0xffff), a big endian integer
+is congruent to the sum of its 16 bit words modulo 0xffff, so one modulo on the
+whole payload replaces the word by word end-around carry loop.
+
+The result is bit for bit the value the word by word loop produces, including
+its handling of odd length payloads (the first byte stands alone in the top
+word) and running sums wider than 16 bits after adding 32 bit header fields.
+"""
+
+
+def carry_around_add(a, b):
+    """ One's complement add with a single end-around carry """
+    c = a + b
+    return (c & 0xffff) + (c >> 16)
+
+
+def fold_words(csum, msg):
+    """
+    Adds the 16 bit words of msg to the running sum csum
+
+    Parameters:
+      csum - running sum, e.g. the packet header fields
+      msg  - payload (bytes-like or str)
+    """
+    if isinstance(msg, str):
+        msg = msg.encode()
+    value = int.from_bytes(msg, byteorder='big', signed=False)
+
+    # a 32 bit header field can leave the running sum wider than 16 bits,
+    # fold the lowest words one at a time until it fits
+    while csum > 0xffff and value != 0:
+        csum = carry_around_add(csum, value & 0xffff)
+        value = value >> 16
+
+    if value == 0:
+        return csum
+    # from here every add stays in [1, 0xffff], so fold the rest in one step
+    return (csum + value - 1) % 0xffff + 1
+
+
+def internet_checksum(msg, csum=0):
+    """
+    Returns the 16 bit checksum of msg
+
+    Parameters:
+      msg  - payload (bytes-like or str)
+      csum - running sum of anything covered before the payload
+    """
+    return ~fold_words(csum, msg) & 0xffff
+
+
+def update_checksum(csum, old, new):
+    """
+    Updates a checksum for one 16 bit quantity changing from old to new
+    without touching the rest of the packet (RFC 1624, eqn. 3)
+    """
+    csum = carry_around_add(~csum & 0xffff, ~old & 0xffff)
+    csum = carry_around_add(csum, new)
+    return ~csum & 0xffff
+
+
+def payload_sum(msg):
+    """
+    Payload only partial sum, computed once and reused by fold_partial()
+    """
+    if isinstance(msg, str):
+        msg = msg.encode()
+    value = int.from_bytes(msg, byteorder='big', signed=False)
+    if value == 0:
+        return 0
+    return (value - 1) % 0xffff + 1
+
+
+def fold_partial(csum, partial, msg):
+    """
+    Same as fold_words(csum, msg) using partial = payload_sum(msg)
+    """
+    if csum > 0xffff:
+        return fold_words(csum, msg)    # rare wide header sum, fold exactly
+    if partial == 0:
+        return csum
+    return (csum + partial - 1) % 0xffff + 1
@@ -0,0 +1,379 @@
+# This file contains the congestion control algorithms a SendWindow can use,
+# the window keeps the loss recovery and calls the algorithm for the window
+# size: N is the congestion window and ssthresh the slow start threshold,
+# both in packets
+from collections import deque
+from math import ceil
+
+INIT_SSTHRESH = 0xFFFF  # initial slow start threshold, in packets
+
+
+class DeliveryRate():
+    """
+    BBR style model of the path, built from the ACK stream
+
+    The bottleneck bandwidth is the highest delivery rate measured over the
+    last BW_ROUNDS round trips and min_rtt the lowest rtt of the last
+    MIN_RTT_WINDOW seconds. Until the bandwidth stops growing, or the rtt
+    shows a queue building, the pacing gain doubles the rate every round.
+    The queue startup built is drained, after that the gain cycles between
+    probing for more bandwidth and draining the queue the probe built, and
+    the packets in flight are held to CWND_GAIN times the bandwidth-delay
+    product
+    """
+    STARTUP_GAIN = 2.885                        # 2/ln 2
+    CYCLE = (1.25, 0.75, 1, 1, 1, 1, 1, 1)      # pacing gain of each min_rtt
+    CWND_GAIN = 1.25                            # bandwidth-delay products in flight
+    BW_ROUNDS = 10
+    MIN_RTT_WINDOW = 10
+    DELAY_EXIT = (0.004, 0.016)                 # bounds of the rtt rise that ends startup
+
+    def __init__(self):
+        self.delivered = 0          # packets delivered so far
+        self.delivered_time = 0     # when the last packet was delivered
+        self.first_sent_time = 0    # send time of the last packet delivered
+        self.round = 0              # round trips, counted by delivered packets
+        self.next_round = 0         # delivered count the next round starts at
+        self.bw_filter = deque()    # (round, bw) samples of the window, falling bw
+        self.btl_bw = 0             # bottleneck bandwidth in packets per second
+        self.min_rtt = None
+        self.min_rtt_stamp = 0      # when min_rtt was measured
+        self.full_bw = 0            # bandwidth the startup check compares against
+        self.full_bw_cnt = 0        # rounds without 25% more bandwidth
+        self.filled = False         # bandwidth stopped growing, startup is over
+        self.draining = False       # emptying the queue startup built
+        self.cycle = 0              # index in CYCLE
+        self.cycle_stamp = 0        # when the current gain began
+
+    @property
+    def pacing_gain(self):
+        if not self.filled:
+            return self.STARTUP_GAIN
+        if self.draining:
+            return 1 / self.STARTUP_GAIN
+        return self.CYCLE[self.cycle]
+
+    def bdp(self):
+        """ Packets the path holds without a queue, None until measured """
+        if not self.btl_bw or self.min_rtt is None:
+            return None
+        return self.btl_bw * self.min_rtt
+
+    def inflight_cap(self):
+        """ Most packets in flight once startup is over, None before """
+        bdp = self.bdp()
+        if not self.filled or bdp is None:
+            return None
+        return max(4, ceil(self.CWND_GAIN * bdp))
+
+    def end_startup(self, now):
+        self.filled = True
+        self.draining = True
+        self.cycle_stamp = now
+
+    def on_send(self, now, flight):
+        """
+        Returns the state of the model a packet is sent with
+
+        Parameters:
+          now    - current time
+          flight - packets already in flight
+        """
+        if flight == 0:     # starting from idle, the idle time is not delivery time
+            self.first_sent_time = now
+            self.delivered_time = now
+        if self.draining and self.bdp() is not None and flight <= self.bdp():
+            self.draining = False   # queue drained, start probing
+            self.cycle_stamp = now
+        return (self.delivered, self.delivered_time, self.first_sent_time, now)
+
+    def on_delivered(self, state, now):
+        """
+        A packet was acked or sacked, takes a delivery rate sample
+
+        Parameters:
+          state - what on_send returned for the packet
+          now   - current time
+        """
+        delivered, delivered_time, first_sent_time, sent_time = state
+        self.delivered += 1
+        self.delivered_time = now
+        self.first_sent_time = sent_time
+
+        if delivered >= self.next_round:    # sent after the round began
+            self.next_round = self.delivered
+            self.round += 1
+            if not self.filled:
+                if self.btl_bw >= self.full_bw * 1.25:
+                    self.full_bw = self.btl_bw
+                    self.full_bw_cnt = 0
+                else:
+                    self.full_bw_cnt += 1
+                    if self.full_bw_cnt >= 3:
+                        self.end_startup(now)
+        if self.filled and not self.draining and self.min_rtt is not None and now - self.cycle_stamp > self.min_rtt:
+            self.cycle = (self.cycle + 1) % len(self.CYCLE)
+            self.cycle_stamp = now
+
+        # the slower of sending and acking the packets delivered meanwhile
+        interval = max(sent_time - first_sent_time, now - delivered_time)
+        if interval <= 0:
+            return
+        bw = (self.delivered - delivered) / interval
+        while self.bw_filter and self.bw_filter[-1][1] <= bw:
+            self.bw_filter.pop()
+        self.bw_filter.append((self.round, bw))
+        while self.bw_filter[0][0] <= self.round - self.BW_ROUNDS:
+            self.bw_filter.popleft()
+        self.btl_bw = self.bw_filter[0][1]
+
+    def on_rtt(self, rtt, now):
+        """ Takes an rtt sample """
+        if not self.filled and self.btl_bw and self.min_rtt is not None:
+            low, high = self.DELAY_EXIT
+            if rtt > self.min_rtt + min(max(self.min_rtt / 8, low), high):
+                self.end_startup(now)   # a queue is building (HyStart)
+        if self.min_rtt is None or rtt <= self.min_rtt or now - self.min_rtt_stamp > self.MIN_RTT_WINDOW:
+            self.min_rtt = rtt
+            self.min_rtt_stamp = now
+
+
+class CongestionControl():
+    """
+    Base of the algorithms: Reno slow start and additive increase of one
+    packet per window of ACKs, no pacing
+
+    newreno - the window inflates during fast recovery and partial ACKs
+              resend the next hole, else every loss only shrinks the window
+    """
+    name = None
+    newreno = True
+
+    def __init__(self):
+        self.N = 1                      # set N to 1 for initial window size
+        self.ssthresh = INIT_SSTHRESH   # slow start threshold
+        self.min_rtt = None             # lowest rtt measured
+        self.ca_cnt = 0                 # ACKs towards the next increase in congestion avoidance
+
+    def on_ack(self, acked, now, rtt):
+        """
+        New data acked outside of loss recovery
+
+        Parameters:
+          acked - segments the ACK took out of the window
+          now   - current time
+          rtt   - rtt measured by the ACK, None for a resent segment
+        """
+        if rtt is not None and (self.min_rtt is None or rtt < self.min_rtt):
+            self.min_rtt = rtt
+        if self.N < self.ssthresh:
+            self.N += 1         # slow start
+        else:
+            self.avoid(acked, now, rtt)
+
+    def avoid(self, acked, now, rtt):
+        """ Congestion avoidance step for one ACK """
+        self.ca_cnt += 1
+        if self.ca_cnt >= self.N:
+            self.ca_cnt = 0
+            self.N += 1
+
+    def on_loss(self, flight, now):
+        """
+        Loss found by duplicate ACKs or SACK, called once per loss event
+
+        Parameters:
+          flight - packets sent and neither acked nor sacked
+          now    - current time
+        """
+        self.ssthresh = max(flight // 2, 2)
+        self.N = self.ssthresh
+        self.ca_cnt = 0
+
+    def on_rto(self, flight, now):
+        """ Retransmission timer expired: back to slow start """
+        self.ssthresh = max(flight // 2, 2)
+        self.N = 1
+
+    def on_undo(self, N, ssthresh):
+        """
+        The retransmission timeout was spurious, nothing was lost: back to
+        the window from before it
+
+        Parameters:
+          N        - window when the timer expired
+          ssthresh - slow start threshold when the timer expired
+        """
+        self.N = max(self.N, N)
+        self.ssthresh = max(self.ssthresh, ssthresh)
+
+    def pacing_rate(self, rate, srtt):
+        """
+        Packets per second a paced sender sends at
+
+        Parameters:
+          rate - DeliveryRate model of the path
+          srtt - smoothed rtt
+        """
+        if rate.btl_bw:
+            return rate.pacing_gain * rate.btl_bw
+        return 2 * self.N / srtt    # nothing delivered yet: twice the window per rtt
+
+
+class Legacy(CongestionControl):
+    """ The original rules: N grows by 1 per ACK and is halved on every loss """
+    name = 'legacy'
+    newreno = False
+
+    def on_ack(self, acked, now, rtt):
+        self.N += 1
+
+    def on_loss(self, flight, now):
+        self.N = ceil(self.N / 2)
+
+    def on_rto(self, flight, now):
+        self.N = ceil(self.N / 2)
+
+
+class Reno(CongestionControl):
+    """ Additive increase of one packet per window of ACKs, the rules of the base """
+    name = 'reno'
+
+
+class Cubic(CongestionControl):
+    """
+    CUBIC (RFC 8312): after a loss the window follows a cubic of the time
+    since the loss, back to the window the loss happened at and beyond, so
+    a high bandwidth-delay product path fills in seconds rather than one
+    packet per rtt
+    """
+    name = 'cubic'
+    C = 0.4             # scaling constant of the cubic, packets/s^3
+    beta = 0.7          # window kept after a loss
+
+    def __init__(self):
+        CongestionControl.__init__(self)
+        self.w_max = 0          # window before the last loss
+        self.epoch = None       # start of the current growth epoch, None after a loss
+        self.K = 0              # seconds the cubic takes to reach w_max
+        self.origin = 0         # window the cubic is centred on
+        self.w_est = 0          # window Reno would have, the floor of the cubic
+
+    def avoid(self, acked, now, rtt):
+        if self.epoch is None:
+            self.epoch = now
+            self.ca_cnt = 0
+            self.w_est = self.N
+            if self.N < self.w_max:
+                self.K = ((self.w_max - self.N) / self.C) ** (1 / 3)
+                self.origin = self.w_max
+            else:
+                self.K = 0
+                self.origin = self.N
+        t = now - self.epoch + (self.min_rtt or 0)
+        target = self.origin + self.C * (t - self.K) ** 3
+        if target > self.N:
+            cnt = self.N / (target - self.N)    # ACKs per increase of one packet
+        else:
+            cnt = 100 * self.N                  # hold near w_max
+
+        # never slower than Reno would be
+        self.w_est += 3 * (1 - self.beta) / (1 + self.beta) * acked / self.N
+        if self.w_est > self.N:
+            cnt = min(cnt, self.N / (self.w_est - self.N))
+
+        self.ca_cnt += 1
+        if self.ca_cnt >= cnt:
+            self.ca_cnt = 0
+            self.N += 1
+
+    def on_loss(self, flight, now):
+        self.epoch = None
+        if self.N < self.w_max:     # fast convergence: release bandwidth to newer flows
+            self.w_max = self.N * (1 + self.beta) / 2
+        else:
+            self.w_max = self.N
+        self.ssthresh = max(int(self.N * self.beta), 2)
+        self.N = self.ssthresh
+
+    def on_rto(self, flight, now):
+        self.epoch = None
+        self.w_max = self.N
+        self.ssthresh = max(int(self.N * self.beta), 2)
+        self.N = 1
+
+
+class Vegas(CongestionControl):
+    """
+    Vegas: once per rtt compares the expected rate N/min_rtt with the
+    actual rate N/rtt, rtt averaged over the last rtt, and keeps between
+    alpha and beta packets queued
+    """
+    name = 'vegas'
+    alpha = 2           # fewer packets queued: grow
+    beta = 4            # more packets queued: shrink
+    gamma = 1           # packets queued that end slow start
+
+    def __init__(self):
+        CongestionControl.__init__(self)
+        self.epoch_end = None   # end of the current rtt
+        self.rtt_sum = 0        # rtts measured in the current rtt
+        self.rtt_cnt = 0
+
+    def on_ack(self, acked, now, rtt):
+        if rtt is None:
+            return
+        if self.min_rtt is None or rtt < self.min_rtt:
+            self.min_rtt = rtt
+        self.rtt_sum += rtt
+        self.rtt_cnt += 1
+        if self.epoch_end is None:
+            self.epoch_end = now + rtt
+        if now < self.epoch_end:
+            if self.N < self.ssthresh:
+                self.N += 1         # slow start within the rtt
+            return
+
+        # queued packets: expected minus actual rate, times min_rtt
+        epoch_rtt = self.rtt_sum / self.rtt_cnt
+        diff = self.N * (1 - self.min_rtt / epoch_rtt) if epoch_rtt > 0 else 0
+        if self.N < self.ssthresh:
+            if diff > self.gamma:   # queue building, leave slow start
+                self.ssthresh = min(self.ssthresh, self.N)
+                self.N = max(self.N - int(diff), 2)
+            else:
+                self.N += 1
+        elif diff < self.alpha:
+            self.N += 1
+        elif diff > self.beta:
+            self.N = max(self.N - 1, 2)
+        self.epoch_end = now + epoch_rtt
+        self.rtt_sum = 0
+        self.rtt_cnt = 0
+
+    def on_loss(self, flight, now):
+        CongestionControl.on_loss(self, flight, now)
+        self.epoch_end = None
+        self.rtt_sum = 0
+        self.rtt_cnt = 0
+
+    def on_rto(self, flight, now):
+        CongestionControl.on_rto(self, flight, now)
+        self.epoch_end = None
+        self.rtt_sum = 0
+        self.rtt_cnt = 0
+
+
+ALGORITHMS = {cc.name: cc for cc in (Legacy, Reno, Cubic, Vegas)}
+
+
+def congestion_control(cc):
+    """
+    Returns a new instance of an algorithm
+
+    Parameters:
+      cc - name of the algorithm, or an instance which is returned as it is
+    """
+    if isinstance(cc, CongestionControl):
+        return cc
+    return ALGORITHMS[cc]()
@@ -0,0 +1,142 @@
+# This file emulates a network path in-process for the benchmarks: the
+# SendWindow and RecvWindow of one transfer exchange packets through a
+# bottleneck with a rate, a drop tail queue, propagation delay and random
+# loss, on a simulated clock
+import heapq
+import random
+
+from PacketHandler import PacketView, AckTemplate
+from file_cache import Segment
+from transfer import SendWindow, RecvWindow, WSCALE
+
+data_size = 1024 - 28   # Size of data in packet, with the timestamps option
+
+
+class BufferWriter():
+    """ Receives the transfer into memory so it can be compared """
+    def __init__(self, size):
+        self.buf = bytearray(size)
+
+    def preallocate(self, size):
+        pass    # sized for the whole transfer already
+
+    def write(self, offset, data):
+        self.buf[offset:offset + len(data)] = data
+
+
+class Path():
+    """
+    Bottleneck link from the sender to the receiver with a lossless return path
+
+    rate        - packets per second through the bottleneck
+    delay       - one way propagation delay in seconds
+    queue_limit - packets the bottleneck queue holds
+    loss        - percentage of packets dropped at random after the queue
+    seed        - seed of the loss pattern
+    stall       - seconds the receiver stalls for at the start of every
+                  stall_every seconds, like a host held up by the scheduler:
+                  the ACKs it sends meanwhile all leave when it resumes
+    stall_every - seconds between stalls, 0 for none
+    """
+    def __init__(self, rate, delay, queue_limit, loss=0, seed=0, stall=0, stall_every=0):
+        self.rate = rate
+        self.delay = delay
+        self.queue_limit = queue_limit
+        self.loss = loss
+        self.stall = stall
+        self.stall_every = stall_every
+        self.rand = random.Random(seed)
+        self.events = []        # heap of (time, order, callback, args)
+        self.order = 0
+        self.now = 0.0
+        self.busy_until = 0.0   # when the bottleneck has sent its queue
+
+    def at(self, when, callback, *args):
+        heapq.heappush(self.events, (when, self.order, callback, args))
+        self.order += 1
+
+    def send(self, packed, deliver):
+        if (self.busy_until - self.now) * self.rate >= self.queue_limit:
+            return      # queue full
+        self.busy_until = max(self.busy_until, self.now) + 1 / self.rate
+        if self.rand.random() * 100 < self.loss:
+            return
+        self.at(self.busy_until + self.delay, deliver, packed)
+
+    def ack_time(self):
+        """ When an ACK the receiver sends now reaches the sender """
+        sent = self.now
+        if self.stall_every:
+            into = self.now % self.stall_every
+            if into < self.stall:
+                sent += self.stall - into   # held until the stall ends
+        return sent + self.delay
+
+    def run(self, until):
+        while self.events and not until():
+            self.now, _, callback, args = heapq.heappop(self.events)
+            callback(*args)
+
+
+def run_transfer(path, blob, trace=None, timestamps=True, **window_args):
+    """
+    Sends blob over the path, returns the SendWindow once everything is acked
+
+    Parameters:
+      path        - Path to send over
+      blob        - bytes to send
+      trace       - list (time, event, seq, window) rows are added to, None for none
+      timestamps  - both sides send the timestamps option
+      window_args - keyword arguments of the SendWindow
+    """
+    segments = [Segment(off, memoryview(blob)[off:off + data_size])
+                for off in range(0, len(blob), data_size)]
+    # as negotiated in a handshake, which also timed the path
+    sender = SendWindow(segments, 20001, 20002, wscale=WSCALE, timestamps=timestamps, rtt=2 * path.delay,
+                        **window_args)
+    receiver = RecvWindow(BufferWriter(len(blob)), AckTemplate(20002, 20001, timestamps), wscale=WSCALE)
+    timer = [None]      # when the expiry is scheduled
+
+    def transmit(packets, event):
+        for packed in packets:
+            if trace is not None:
+                trace.append((path.now, event, PacketView(packed).seq_num, sender.N))
+            path.send(packed, deliver)
+
+    def pump():
+        transmit(sender.new_packets(path.now), 'send')
+        wakeup = sender.wakeup()
+        if wakeup is not None and (timer[0] is None or wakeup < timer[0]):
+            timer[0] = wakeup
+            path.at(wakeup, expire, wakeup)
+
+    def expire(when):
+        if timer[0] != when:
+            return      # superseded by an earlier expiry
+        timer[0] = None
+        wakeup = sender.wakeup()
+        if wakeup is None:
+            return
+        if path.now < wakeup:       # wakeup was pushed back
+            timer[0] = wakeup
+            path.at(wakeup, expire, wakeup)
+            return
+        if sender.deadline is not None and path.now >= sender.deadline:
+            transmit(sender.on_timeout(path.now), 'timeout')
+        pump()          # paced packets that are due
+
+    def deliver(packed):
+        receiver.receive(PacketView(packed), path.now)
+        path.at(path.ack_time(), on_ack, bytes(receiver.ack_pack()))
+
+    def on_ack(packed):
+        pkt = PacketView(packed)
+        if trace is not None:
+            trace.append((path.now, 'ack', pkt.ack_num, sender.N))
+        transmit(sender.on_ack(pkt.ack_num, path.now, pkt.sack_blocks(), pkt.rwin, pkt.timestamps()), 'resend')
+        pump()
+
+    pump()
+    path.run(sender.done)
+    assert receiver.complete() and receiver.writer.buf == blob
+    return sender
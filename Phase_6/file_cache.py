@@ -0,0 +1,144 @@
+# This file contains the sources of data segments for the senders: the server
+# side cache of pre-split files, memory mapped files and plain chunked reads
+import os
+import mmap
+from collections import OrderedDict
+
+import checksum as cksum
+from PacketHandler import pack_segment
+
+
+class Segment():
+    """
+    One data segment of a file with its payload sum computed
+
+    seq_num - byte offset of the segment in the file
+    length  - bytes of data in the segment
+    data    - the segment's data, e.g. a memoryview slice of the file contents
+    partial - payload only checksum sum
+    """
+    __slots__ = ('seq_num', 'length', 'data', 'partial')
+
+    def __init__(self, seq_num, data):
+        self.seq_num = seq_num
+        self.length = len(data)
+        self.data = data
+        self.partial = cksum.payload_sum(data)
+
+    def pack(self, src, dst, options=b''):
+        """ Stamps the connection ports and options into a packet for this segment """
+        return pack_segment(src, dst, self.seq_num, self.data, self.partial, options)
+
+
+class MappedSegment():
+    """
+    One data segment of a memory mapped file, only its offset and length are
+    kept and the packet is built from a slice of the mapping when (re)sent
+    """
+    __slots__ = ('mapping', 'seq_num', 'length')
+
+    def __init__(self, mapping, seq_num, length):
+        self.mapping = mapping
+        self.seq_num = seq_num
+        self.length = length
+
+    def pack(self, src, dst, options=b''):
+        """ Stamps the connection ports and options into a packet for this segment """
+        with memoryview(self.mapping) as view:
+            with view[self.seq_num:self.seq_num + self.length] as data:
+                return pack_segment(src, dst, self.seq_num, data, cksum.payload_sum(data), options)
+
+
+class MappedFile():
+    """
+    File memory mapped for sending, iterating over it gives its segments
+    """
+    def __init__(self, filename, data_size):
+        self.data_size = data_size
+        self.mapping = None
+        with open(filename, 'rb') as f:
+            self.size = os.fstat(f.fileno()).st_size
+            if self.size > 0:     # an empty file can't be mapped
+                self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __iter__(self):
+        if self.mapping is None:
+            yield Segment(0, b'')
+            return
+        for seq in range(0, self.size, self.data_size):
+            yield MappedSegment(self.mapping, seq, min(self.data_size, self.size - seq))
+
+    def close(self):
+        if self.mapping is not None:
+            self.mapping.close()
+
+
+def read_segments(filename, data_size):
+    """
+    Reads a file one segment at a time
+    """
+    with open(filename, 'rb') as f:
+        seq = 0
+        data = f.read(data_size)
+        yield Segment(seq, data)
+        while data:
+            seq += len(data)
+            data = f.read(data_size)
+            if data:
+                yield Segment(seq, data)
+
+
+class FileCache():
+    """
+    LRU cache of files split into segments with their payload sums computed
+
+    Entries are keyed by path and checked against the file's size and mtime,
+    so a file changed on disk is split again on its next request
+    """
+    def __init__(self, data_size, max_bytes=64*1024*1024):
+        """
+        Parameters:
+          data_size - payload bytes per segment
+          max_bytes - total file bytes the cache may hold
+        """
+        self.data_size = data_size
+        self.max_bytes = max_bytes
+        self.cached_bytes = 0
+        self.entries = OrderedDict()    # path -> (size, mtime, segments)
+        self.hits = 0
+        self.misses = 0
+
+    def split(self, filename):
+        """ Reads a file and splits it into segments """
+        with open(filename, 'rb') as f:
+            contents = memoryview(f.read())
+        segments = [Segment(seq, contents[seq:seq + self.data_size])
+                    for seq in range(0, len(contents), self.data_size)]
+        if not segments:
+            segments.append(Segment(0, contents))   # empty file is one empty segment
+        return segments
+
+    def get(self, filename):
+        """
+        Returns the segments of a file, from the cache if it is unchanged
+        """
+        stat = os.stat(filename)
+        entry = self.entries.get(filename)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            self.hits += 1
+            self.entries.move_to_end(filename)
+            return entry[2]
+
+        self.misses += 1
+        segments = self.split(filename)
+        if entry:
+            self.cached_bytes -= entry[0]
+            del self.entries[filename]
+        if stat.st_size <= self.max_bytes:
+            self.entries[filename] = (stat.st_size, stat.st_mtime_ns, segments)
+            self.cached_bytes += stat.st_size
+            # evict least recently used files until back under budget
+            while self.cached_bytes > self.max_bytes:
+                size, mtime, old = self.entries.popitem(last=False)[1]
+                self.cached_bytes -= size
+        return segments
@@ -0,0 +1,34 @@
+# This file contains the receiver side writer that places segments straight into the output file
+import os
+
+
+class SegmentWriter():
+    """
+    Writes each received segment at its byte offset in the output file, so
+    nothing has to be held in memory or concatenated once the transfer ends
+    """
+    def __init__(self, filename):
+        """
+        Parameters:
+          filename - file location to save data
+        """
+        self.file = open(filename, 'wb+')
+        self.fd = self.file.fileno()
+
+    def preallocate(self, size):
+        """ Reserves the whole file once its total size is known, from the FIN-marked last segment """
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(self.fd, 0, size)
+        else:
+            self.file.truncate(size)
+
+    def write(self, offset, data):
+        """ Writes data at offset, the seq number of its segment """
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self.fd, data, offset)
+        else:   # no pwrite on Windows
+            self.file.seek(offset)
+            self.file.write(data)
+
+    def close(self):
+        self.file.close()
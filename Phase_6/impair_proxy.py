@@ -0,0 +1,153 @@
+# This file is a local impairment proxy: clients send to the proxy instead of
+# the server, and each direction passes a bottleneck with an optional rate
+# cap, a drop tail queue and a propagation delay before it is forwarded
+import heapq
+import selectors
+import socket
+from threading import Thread, Lock
+from time import time
+
+
+class Bottleneck():
+    """
+    One direction of the proxy
+
+    rate        - packets per second, None for no cap
+    queue_limit - packets queued before arrivals are dropped
+    delay       - one way propagation delay in seconds
+    """
+    def __init__(self, rate, queue_limit, delay):
+        self.rate = rate
+        self.queue_limit = queue_limit
+        self.delay = delay
+        self.busy_until = 0     # when the queued packets have been sent
+        self.received = 0       # packets arrived
+        self.dropped = 0        # packets dropped by the full queue
+
+    def due(self, now):
+        """ Returns when an arriving packet comes out, None if it is dropped """
+        self.received += 1
+        if self.rate is None:
+            return now + self.delay
+        if (self.busy_until - now) * self.rate >= self.queue_limit:
+            self.dropped += 1
+            return None
+        self.busy_until = max(self.busy_until, now) + 1 / self.rate
+        return self.busy_until + self.delay
+
+    def stats(self):
+        return {'received': self.received, 'dropped': self.dropped,
+                'loss': self.dropped / self.received if self.received else 0}
+
+
+class ImpairProxy(Thread):
+    def __init__(self, server_port, port=0, up_rate=None, down_rate=None, queue_limit=16, delay=0.005):
+        """
+        Initializes the proxy, one client at a time
+
+        Parameters:
+          server_port - port of the server packets are forwarded to
+          port        - port clients send to, 0 for an ephemeral port
+          up_rate     - packets per second from the client to the server, None for no cap
+          down_rate   - packets per second from the server to the client, None for no cap
+          queue_limit - packets each capped direction queues
+          delay       - one way propagation delay in seconds
+        """
+        Thread.__init__(self)
+        host_ip = '127.0.0.1'
+        self.server_addr = (host_ip, server_port)
+        self.client_addr = None     # learnt from the first packet
+        self.up = Bottleneck(up_rate, queue_limit, delay)
+        self.down = Bottleneck(down_rate, queue_limit, delay)
+        self.pending = []           # heap of (due, order, socket, packet, address)
+        self.order = 0
+        self.stopped = False
+
+        # clients talk to client_socket, the server to server_socket
+        self.client_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        self.client_socket.bind((host_ip, port))
+        self.port = self.client_socket.getsockname()[1]
+        self.server_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        self.server_socket.bind((host_ip, 0))
+        for sock in (self.client_socket, self.server_socket):
+            sock.setblocking(False)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4*1024*1024)
+        self.wake_recv, self.wake_send = socket.socketpair()
+        self.wake_lock = Lock()     # held to write to the pair and to close it
+
+    def stop(self):
+        with self.wake_lock:
+            self.stopped = True
+            if self.wake_send is not None:  # None once the loop has closed the pair
+                self.wake_send.send(b'\x00')
+
+    def stats(self):
+        """ Counters of each direction """
+        return {'up': self.up.stats(), 'down': self.down.stats()}
+
+    def forward(self, sock, bottleneck, out_sock, now):
+        """ Takes every packet queued on sock into the bottleneck """
+        while True:
+            try:
+                packed, from_addr = sock.recvfrom(2048)
+            except BlockingIOError:
+                return
+            if sock is self.client_socket:
+                self.client_addr = from_addr
+                addr = self.server_addr
+            else:
+                addr = self.client_addr
+            due = bottleneck.due(now)
+            if due is not None and addr is not None:
+                heapq.heappush(self.pending, (due, self.order, out_sock, packed, addr))
+                self.order += 1
+
+    def run(self):
+        sel = selectors.DefaultSelector()
+        sel.register(self.client_socket, selectors.EVENT_READ)
+        sel.register(self.server_socket, selectors.EVENT_READ)
+        sel.register(self.wake_recv, selectors.EVENT_READ)
+
+        while not self.stopped:
+            timeout = max(0, self.pending[0][0] - time()) if self.pending else None
+            for key, _ in sel.select(timeout):
+                now = time()
+                if key.fileobj is self.client_socket:
+                    self.forward(self.client_socket, self.up, self.server_socket, now)
+                elif key.fileobj is self.server_socket:
+                    self.forward(self.server_socket, self.down, self.client_socket, now)
+
+            now = time()
+            while self.pending and self.pending[0][0] <= now:
+                _, _, out_sock, packed, addr = heapq.heappop(self.pending)
+                try:
+                    out_sock.sendto(packed, addr)
+                except BlockingIOError:
+                    pass    # send buffer full, same as a lost packet
+
+        sel.close()
+        self.client_socket.close()
+        self.server_socket.close()
+        with self.wake_lock:
+            self.wake_recv.close()
+            self.wake_send.close()
+            self.wake_send = None
+
+
+if __name__ == "__main__":
+    server_port = input("Input server port: ")
+    up_rate = input("Input packets per second towards the server (empty for no cap): ")
+    down_rate = input("Input packets per second towards the client (empty for no cap): ")
+
+    proxy = ImpairProxy(int(server_port), port=20003,
+                        up_rate=int(up_rate) if up_rate else None,
+                        down_rate=int(down_rate) if down_rate else None)
+    proxy.start()
+    print("Proxy listening on port", proxy.port)
+    try:
+        input("Forwarding, press Enter to stop\n")
+    except KeyboardInterrupt:
+        pass
+    proxy.stop()
+    proxy.join()
+    print(proxy.stats())
@@ -0,0 +1,135 @@
+# This file contains the receive ring that datagrams are read into without allocating
+import socket
+import struct
+from collections import deque
+
+from udp_gso import GRO_BUF_SIZE, enable_gro, gro_segment_size
+
+GRO_SLOTS = 72      # more than the 64 packet bursts drained at once, larger bursts are cut to it
+PACKET_TRUESIZE = 2304  # bytes of SO_RCVBUF, as getsockopt reports it, one queued 1 KB datagram takes on Linux
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)  # Linux 2.6.22+, also the type of its control message
+TIMESPEC = struct.Struct('@ql')     # struct timespec: seconds, nanoseconds
+
+
+def tune_rcvbuf(sock, packets):
+    """
+    Grows SO_RCVBUF until packets datagrams can wait in it, it is never shrunk
+
+    Returns how many datagrams it holds, fewer than asked when
+    net.core.rmem_max caps it
+    """
+    size = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    if size < packets * PACKET_TRUESIZE:
+        try:
+            # the kernel doubles the size asked for, for its bookkeeping
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, packets * PACKET_TRUESIZE // 2)
+        except OSError:
+            pass
+        size = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    return size // PACKET_TRUESIZE
+
+
+def enable_stamps(sock):
+    """ Turns on SO_TIMESTAMPNS for the socket, returns False if not supported """
+    if not hasattr(sock, 'recvmsg_into'):
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    except OSError:
+        return False
+    return True
+
+
+def kernel_stamp(ancdata):
+    """ Time the kernel received a datagram, in seconds like time(), None if it isn't stamped """
+    for level, cmsg_type, data in ancdata:
+        if level == socket.SOL_SOCKET and cmsg_type == SO_TIMESTAMPNS and len(data) >= TIMESPEC.size:
+            sec, nsec = TIMESPEC.unpack_from(data)
+            return sec + nsec * 1e-9
+    return None
+
+
+class RecvRing():
+    """
+    Preallocated ring of fixed size slots, each datagram is received straight
+    into the next slot with recv_into
+
+    A returned view stays valid until n_slots more slots have been filled,
+    by then its packet has been consumed and the slot is reused: a burst of
+    views parsed together holds at most n_slots of them
+
+    With GRO the slots are large enough for a coalesced receive, which is
+    split back into its datagrams
+
+    With kernel stamps the time each datagram reached the socket is taken
+    from its SO_TIMESTAMPNS control message, so it doesn't carry the delay
+    before the process got round to reading it
+    """
+    def __init__(self, sock, slot_size, n_slots=256, gro=False, stamps=False):
+        """
+        Parameters:
+          sock      - socket to receive from
+          slot_size - largest datagram accepted (packet size)
+          n_slots   - number of slots in the ring
+          gro       - receive coalesced datagrams if the kernel supports it
+          stamps    - have the kernel stamp every datagram when it arrives
+        """
+        self.sock = sock
+        self.gro = gro and enable_gro(sock)
+        self.stamps = stamps and enable_stamps(sock)
+        self.stamp = None       # kernel arrival time of the datagram last returned, None without stamps
+        self.ancbufsize = 0     # control messages are only read when one of them is on
+        if self.gro:
+            slot_size = GRO_BUF_SIZE
+            n_slots = GRO_SLOTS
+            self.ancbufsize += socket.CMSG_SPACE(4)
+        if self.stamps:
+            self.ancbufsize += socket.CMSG_SPACE(TIMESPEC.size)
+        self.n_slots = n_slots      # most views valid at once
+        self.pending = deque()      # datagrams split from the last receive
+        self.buf = bytearray(slot_size * n_slots)
+        view = memoryview(self.buf)
+        self.slots = [view[i*slot_size:(i+1)*slot_size] for i in range(n_slots)]
+        self.next = 0
+
+    def recv(self):
+        """
+        Receives one datagram into the next slot
+
+        Returns a memoryview of the datagram, raises like socket.recv
+        """
+        if self.ancbufsize:
+            return self.recvfrom_msg()[0]
+        slot = self.slots[self.next]
+        n_bytes = self.sock.recv_into(slot)
+        self.next = (self.next + 1) % len(self.slots)
+        return slot[:n_bytes]
+
+    def recvfrom(self):
+        """
+        Receives one datagram into the next slot
+
+        Returns (memoryview of the datagram, address it came from), raises like socket.recvfrom
+        """
+        if self.ancbufsize:
+            return self.recvfrom_msg()
+        slot = self.slots[self.next]
+        n_bytes, addr = self.sock.recvfrom_into(slot)
+        self.next = (self.next + 1) % len(self.slots)
+        return slot[:n_bytes], addr
+
+    def recvfrom_msg(self):
+        """ recvfrom with the control messages of GRO and kernel stamps """
+        if self.pending:
+            return self.pending.popleft()     # split datagrams share the stamp of their receive
+        slot = self.slots[self.next]
+        n_bytes, ancdata, flags, addr = self.sock.recvmsg_into([slot], self.ancbufsize)
+        self.next = (self.next + 1) % len(self.slots)
+        if self.stamps:
+            self.stamp = kernel_stamp(ancdata)
+        seg_size = gro_segment_size(ancdata, n_bytes)
+        if seg_size >= n_bytes:
+            return slot[:n_bytes], addr
+        for offset in range(seg_size, n_bytes, seg_size):
+            self.pending.append((slot[offset:min(offset + seg_size, n_bytes)], addr))
+        return slot[:seg_size], addr
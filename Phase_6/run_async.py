@@ -0,0 +1,30 @@
+import asyncio
+from time import time
+
+from tcp_async import start_server, open_client
+
+crpt_data = input("Input percentage of data corruption: ")
+crpt_ack = input("Input percentage of ack corruption: ")
+data_loss = input("Input percentage of data packet loss: ")
+ack_loss = input("Input percentage of ACK packet loss: ")
+n_clients = input("Input number of clients: ")
+
+
+async def run_client(i):
+    transport, client = await open_client(crpt_ack=int(crpt_ack), ack_loss=int(ack_loss))
+    if await client.connect():
+        await client.download('client_img.jpg' if i == 0 else 'client_img_{0}.jpg'.format(i))
+    await client.close()
+
+
+async def main():
+    # Runs process, every client downloads the image over the one server socket
+    transport, server = await start_server(crpt_data=int(crpt_data), data_loss=int(data_loss))
+    start = time()
+    await asyncio.gather(*(run_client(i) for i in range(int(n_clients))))
+    print("Downloads:", server.downloads, "in", time() - start, "seconds")
+    server.close()
+
+asyncio.run(main())
+
+print("Finished transmission, closing...")
@@ -1,6 +1,5 @@
 from tcp_server import Server
 from tcp_client import Client
-from tcp_timer import Timer
 
 crpt_data = input("Input percentage of data corruption: ")
 crpt_ack = input("Input percentage of ack corruption: ")
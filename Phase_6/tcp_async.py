@@ -0,0 +1,631 @@
+# This file implements the server and client on asyncio, every connection is driven
+# by datagram events and loop.call_at timers instead of a thread polling its socket
+import asyncio
+import os
+import socket
+from abc import ABCMeta, abstractmethod
+from functools import partial
+from random import randint
+
+from PacketHandler import Packet, PacketView, AckTemplate, verify, wscale_option, ts_option
+from file_cache import FileCache, MappedFile, read_segments
+from file_writer import SegmentWriter
+from recv_ring import tune_rcvbuf
+from transfer import SendWindow, RecvWindow, WSCALE, ts_clock
+from congestion import ALGORITHMS
+
+pkt_size = 1024                         # packet size
+header_size = 28                        # bytes of header data, with the timestamps option
+data_size = pkt_size - header_size      # Size of data in packet
+rcvbuf = 4*1024*1024                    # receive buffer asked for, capped by net.core.rmem_max
+
+
+def impaired(packed, crpt_rate, loss_rate, crpt_byte):
+    """
+    Emulates a lossy link for one packet
+
+    Parameters:
+      packed    - packet to send
+      crpt_rate - corruption rate in percent
+      loss_rate - loss rate in percent
+      crpt_byte - byte written over the end of a corrupted packet
+
+    Returns the packet to send, None if it is lost
+    """
+    if crpt_rate > 0 or loss_rate > 0:
+        err_flag = randint(1, 100)
+        if loss_rate > 0 and err_flag <= loss_rate:
+            return None
+        if crpt_rate > 0 and err_flag <= crpt_rate:
+            return b"".join([packed[0:1023], crpt_byte])
+    return packed
+
+
+class AsyncSender():
+    """
+    Runs a SendWindow from ACK events, the retransmission timer is a loop.call_at handle
+
+    An ACK pushing the deadline back leaves the handle alone, it is moved when it
+    comes up, so there is at most one timer per connection in the loop.
+
+    Each event sends at most max_burst new packets, so the window is clocked out
+    by the ACKs instead of overflowing the receive buffer in one burst.
+    """
+    def __init__(self, loop, window, transmit, max_burst=2):
+        """
+        Parameters:
+          loop      - event loop of the connection
+          window    - SendWindow of the transfer
+          transmit  - transmit(packed, new) sends one packet, new is False for resends
+          max_burst - most new packets sent per event
+        """
+        self.loop = loop
+        self.window = window
+        self.transmit = transmit
+        self.max_burst = max_burst
+        self.timer = None
+        self.start = loop.time()
+        self.done = loop.create_future()    # set to the transfer time once everything is acked
+
+    def pump(self):
+        """ Sends every new segment the window has room for """
+        for packed in self.window.new_packets(self.loop.time(), self.max_burst):
+            self.transmit(packed, True)
+        self.arm()
+
+    def arm(self):
+        deadline = self.window.deadline
+        if deadline is None:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        elif self.timer is None or deadline < self.timer.when():
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = self.loop.call_at(deadline, self.expire)
+
+    def expire(self):
+        self.timer = None
+        deadline = self.window.deadline
+        if deadline is None:
+            return
+        now = self.loop.time()
+        if now < deadline:          # deadline was pushed back
+            self.timer = self.loop.call_at(deadline, self.expire)
+            return
+        for packed in self.window.on_timeout(now):
+            self.transmit(packed, False)
+        self.pump()
+
+    def on_ack(self, pkt):
+        """ Processes a good ACK """
+        for packed in self.window.on_ack(pkt.ack_num, self.loop.time(), pkt.sack_blocks(), pkt.rwin, pkt.timestamps()):
+            self.transmit(packed, False)
+        if self.window.done():
+            self.close()
+            if not self.done.done():
+                self.done.set_result(self.loop.time() - self.start)
+        else:
+            self.pump()
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+
+class AsyncReceiver():
+    """
+    Runs a RecvWindow, the transfer ends once every byte up to the FIN is in,
+    or fails once no data has arrived for idle_timeout seconds
+
+    Packets arriving after the end are still ACKed, in case the last ACK was lost
+    """
+    def __init__(self, loop, window, transmit, idle_timeout):
+        """
+        Parameters:
+          loop         - event loop of the connection
+          window       - RecvWindow of the transfer
+          transmit     - transmit(packed) sends one ACK
+          idle_timeout - seconds without data that abort the transfer
+        """
+        self.loop = loop
+        self.window = window
+        self.transmit = transmit
+        self.idle_timeout = idle_timeout
+        self.last = None            # arrival time of the last packet, None until data starts
+        self.timer = None
+        self.done = loop.create_future()    # set to the bytes received in order
+
+    def on_packet(self, pkt):
+        """
+        Places a received packet and ACKs it
+
+        Parameters:
+          pkt - PacketView of a good packet, None if its checksum failed
+        """
+        if pkt is not None:
+            self.window.receive(pkt, self.loop.time())
+        self.transmit(self.window.ack_pack())
+        if self.done.done():
+            return
+        if self.window.complete():
+            self.finish()
+            return
+
+        self.last = self.loop.time()
+        if self.timer is None:
+            self.timer = self.loop.call_at(self.last + self.idle_timeout, self.expire)
+
+    def expire(self):
+        deadline = self.last + self.idle_timeout
+        if self.loop.time() < deadline:     # data arrived since, wait again
+            self.timer = self.loop.call_at(deadline, self.expire)
+            return
+        self.timer = None
+        self.finish()
+
+    def finish(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.done.done():
+            self.window.writer.close()
+            self.done.set_result(self.window.exp_seq)
+
+
+class Endpoint(asyncio.DatagramProtocol, metaclass=ABCMeta):
+    """
+    Datagram protocol that drains its socket on every wakeup, the asyncio
+    transport alone reads one datagram per wakeup, too few for a socket
+    shared by many connections
+
+    Subclasses handle each datagram in handle(), one without it can't be
+    constructed
+    """
+    max_burst = 64      # most datagrams handled per wakeup
+
+    def __init__(self):
+        self.transport = None
+        self.loop = None
+        self.sock = None
+        self.port = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+        self.port = transport.get_extra_info('sockname')[1]
+
+    def datagram_received(self, data, addr):
+        self.handle(data, addr)
+        for _ in range(self.max_burst - 1):
+            try:
+                data, addr = self.sock.recvfrom(pkt_size)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as exc:
+                self.error_received(exc)
+                break
+            self.handle(data, addr)
+
+    @abstractmethod
+    def handle(self, data, addr):
+        """ Handles one datagram from addr """
+
+
+class ServerConnection():
+    """
+    State of one client of the AsyncServer
+
+    SYN_RCVD -> ESTABLISHED -> SENDING or RECEIVING -> ESTABLISHED ... -> FIN_WAIT -> closed
+    """
+    def __init__(self, server, addr, port):
+        self.server = server
+        self.addr = addr                # address of client (IP, Port)
+        self.port = port                # client port stamped into packets
+        self.state = 'SYN_RCVD'
+        self.sender = None
+        self.receiver = None            # AsyncReceiver of the last upload, kept to ACK its late segments
+        self.mapped = None
+        self.fin_timer = None           # drops the connection if the last ACK is lost
+        self.snd_wscale = 0             # window scale of the client, 0 unless both sides sent the option
+        self.rcv_wscale = 0             # window scale of the server's own window
+        self.timestamps = False         # both sides send the timestamps option
+        self.syn_acks = 0               # SYNACKs sent
+        self.syn_ack_sent = 0           # time the last SYNACK was sent
+        self.rtt = None                 # rtt measured in the handshake
+
+    def send(self, packed):
+        self.server.transport.sendto(packed, self.addr)
+
+    def reply(self, ack_num, ctrl_bits):
+        self.send(Packet(self.server.port, self.port, 0, ack_num, b'', ctrl_bits).pkt_pack())
+
+    def syn_ack(self, syn):
+        """ Answers a SYN, window scaling and timestamps are on if the client sent their options """
+        now = self.server.loop.time()
+        options = b''
+        shift = syn.wscale()
+        if shift is not None:
+            self.snd_wscale = shift
+            self.rcv_wscale = WSCALE
+            options += wscale_option(WSCALE)
+        ts = syn.timestamps()
+        if ts is not None:
+            self.timestamps = True
+            options += ts_option(ts_clock(now), ts[0])
+        self.syn_acks += 1
+        self.syn_ack_sent = now
+        self.send(Packet(self.server.port, self.port, 0, syn.ack_num + 1, b'', 0x12, options).pkt_pack())
+
+    def transmit_data(self, packed, new):
+        # only new data goes through the lossy link, like Server.send_img
+        if new:
+            packed = impaired(packed, self.server.crpt_data_rate, self.server.pkt_loss_rate, b"\x00")
+        if packed is not None:
+            self.send(packed)
+
+    def datagram(self, pkt, pkt_ok):
+        """
+        Handles one packet from the client
+
+        Parameters:
+          pkt    - PacketView of the packet
+          pkt_ok - False if its checksum failed
+        """
+        # a transfer that just ended may not have run its done callback yet
+        if self.state == 'SENDING' and self.sender.done.done():
+            self.download_done(self.sender.done)
+        elif self.state == 'RECEIVING' and self.receiver.done.done():
+            self.upload_done(self.receiver.done)
+        if self.state == 'RECEIVING':
+            self.receiver.on_packet(pkt if pkt_ok else None)
+            return
+        if not pkt_ok:
+            return
+        if self.state == 'SENDING':
+            if pkt.get_ack_bit():
+                self.sender.on_ack(pkt)
+                return
+            self.end_download()         # command, the client has moved on
+
+        if self.state == 'SYN_RCVD':
+            if pkt.get_syn_bit():
+                self.syn_ack(pkt)               # SYNACK was lost, send it again
+            elif pkt.get_ack_bit() and pkt.ack_num == 1:
+                self.state = 'ESTABLISHED'
+                if self.syn_acks == 1:          # the ACK of a SYNACK sent again can't be timed (Karn)
+                    self.rtt = self.server.loop.time() - self.syn_ack_sent
+                print("Server: Connection established", self.addr)
+        elif self.state == 'FIN_WAIT':
+            if pkt.get_ack_bit():
+                self.close()
+                print("Server: Connection closed", self.addr)
+            else:
+                self.command(pkt)       # exit again, ACK or FIN was lost
+        elif self.state == 'ESTABLISHED':
+            if not pkt.get_ack_bit():   # late ACKs of a finished download are dropped
+                self.command(pkt)
+
+    def command(self, pkt):
+        msg = bytes(pkt.data).decode(errors='replace')
+        cmd, _, cc = msg.partition(" ")
+        if self.receiver is not None and cmd not in ("download", "upload", "exit"):
+            self.receiver.on_packet(pkt)        # segment of the last upload, its ACK was lost
+            return
+        # ------------------ Send image to client ------------------
+        # "download <algorithm>" picks the congestion control of the download
+        if cmd == "download" and (not cc or cc in ALGORITHMS):
+            self.reply(pkt.ack_num + 1, 0x10)
+            self.start_download(self.server.img_to_send, cc or self.server.cc)
+
+        # ------------------ Get image from client ------------------
+        elif msg == "upload":
+            self.reply(pkt.ack_num + 1, 0x10)
+            self.state = 'RECEIVING'
+            window = RecvWindow(SegmentWriter(self.server.img_save_to),
+                                AckTemplate(self.server.port, self.port, self.timestamps),
+                                partial(tune_rcvbuf, self.server.sock), self.rcv_wscale)
+            self.receiver = AsyncReceiver(self.server.loop, window, self.send, 5)
+            self.receiver.done.add_done_callback(self.upload_done)
+
+        # ------------------ Close the connection ------------------
+        elif msg == "exit":
+            self.reply(pkt.ack_num + 1, 0x10)
+            self.reply(0, 0x01)         # send FIN packet
+            if self.fin_timer is None:
+                self.fin_timer = self.server.loop.call_later(self.server.fin_timeout, self.close)
+            self.state = 'FIN_WAIT'
+
+        # ------------------ Handle invalid request ------------------
+        else:
+            self.reply(0, 0x10)         # send NAK
+            print("Server: Received invalid request:", pkt)
+
+    def start_download(self, filename, cc):
+        if os.path.getsize(filename) > self.server.file_cache.max_bytes:
+            self.mapped = MappedFile(filename, data_size)
+            segments = self.mapped
+        else:
+            segments = self.server.file_cache.get(filename)
+        self.state = 'SENDING'
+        window = SendWindow(segments, self.server.port, self.port, cc=cc, wscale=self.snd_wscale,
+                            timestamps=self.timestamps, rtt=self.rtt)
+        self.sender = AsyncSender(self.server.loop, window, self.transmit_data)
+        self.sender.done.add_done_callback(self.download_done)
+        self.sender.pump()
+
+    def download_done(self, done):
+        if self.sender is None or done is not self.sender.done:
+            return
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        self.sender = None
+        self.state = 'ESTABLISHED'
+        self.server.downloads += 1
+        print("Server: Time to send image:", done.result(), self.addr)
+
+    def end_download(self):
+        self.sender.close()
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        self.sender = None
+        self.state = 'ESTABLISHED'
+
+    def upload_done(self, done):
+        if self.receiver is None or done is not self.receiver.done:
+            return
+        self.state = 'ESTABLISHED'
+        if self.receiver.window.complete():
+            print("Server: Received and saved image", self.addr)
+        else:
+            print("Server: Upload failed: timeout", self.addr)
+
+    def close(self):
+        if self.fin_timer is not None:
+            self.fin_timer.cancel()
+        if self.sender is not None:
+            self.sender.close()
+        if self.receiver is not None:
+            self.receiver.finish()
+        self.state = 'CLOSED'
+        self.server.conns.pop(self.addr, None)
+
+
+class AsyncServer(Endpoint):
+    """
+    Server serving every client from one socket, packets are demultiplexed by
+    client address to their ServerConnection
+    """
+    def __init__(self, crpt_data=0, data_loss=0, cache_size=64*1024*1024, fin_timeout=5, cc='reno'):
+        """
+        Initializes Server
+
+        Parameters:
+          crpt_data   - data packet corruption rate in percent
+          data_loss   - data packet loss rate in percent
+          cache_size  - bytes of files kept ready to send
+          fin_timeout - seconds a closing connection waits for the last ACK
+          cc          - congestion control of downloads that do not name one
+        """
+        self.crpt_data_rate = crpt_data         # packet corruption rate in percent
+        self.pkt_loss_rate = data_loss          # loss of data packet rate
+        # relative path of image to send
+        self.img_to_send = 'hello.jpg'
+        # filename to save received image
+        self.img_save_to = 'server_img.jpg'
+        # files already split into segments, shared by every download
+        self.file_cache = FileCache(data_size, cache_size)
+        self.fin_timeout = fin_timeout
+        self.cc = cc
+        self.conns = {}                         # client address -> ServerConnection
+        self.downloads = 0                      # completed downloads
+        Endpoint.__init__(self)
+
+    def connection_made(self, transport):
+        Endpoint.connection_made(self, transport)
+        print("Server bound to port", self.port)
+
+    def handle(self, data, addr):
+        pkt = PacketView(data)
+        pkt_ok = verify(data)
+        conn = self.conns.get(addr)
+        if conn is not None:
+            conn.datagram(pkt, pkt_ok)
+        elif pkt_ok and pkt.get_syn_bit():
+            conn = ServerConnection(self, addr, pkt.src)
+            self.conns[addr] = conn
+            conn.syn_ack(pkt)                   # ack bit = 1, syn bit = 1
+        elif pkt_ok:
+            # send NAK
+            self.transport.sendto(Packet(self.port, pkt.src, 0, 0, b'', 0x10).pkt_pack(), addr)
+
+    def close(self):
+        for conn in list(self.conns.values()):
+            conn.close()
+        self.transport.close()
+
+
+class AsyncClient(Endpoint):
+    """
+    Client on its own ephemeral port, commands are coroutines:
+
+      await client.connect()
+      await client.download(filename)
+      await client.upload(filename)
+      await client.close()
+    """
+    def __init__(self, crpt_ack=0, ack_loss=0, timeout=1, tries=3):
+        """
+        Initializes Client
+
+        Parameters:
+          crpt_ack - ACK corruption rate in percent
+          ack_loss - ACK loss rate in percent
+          timeout  - seconds to wait for a reply, and for data before a download is given up
+          tries    - times SYN and exit are sent before giving up
+        """
+        self.crpt_ack_rate = crpt_ack           # recived ACK corruption rate inpercent
+        self.ack_loss_rate = ack_loss           # loss of ack packet rate
+        self.timeout = timeout
+        self.tries = tries
+        self.replies = asyncio.Queue()          # control packets from the server
+        self.sender = None
+        self.receiver = None
+        self.server_port = None
+        self.snd_wscale = 0                     # window scale of the server, 0 unless both sides sent the option
+        self.rcv_wscale = 0                     # window scale of the client's own window
+        self.timestamps = False                 # both sides send the timestamps option
+        self.rtt = None                         # rtt measured in the handshake
+        Endpoint.__init__(self)
+
+    def connection_made(self, transport):
+        Endpoint.connection_made(self, transport)
+        self.server_port = transport.get_extra_info('peername')[1]
+
+    def handle(self, data, addr):
+        pkt = PacketView(data)
+        pkt_ok = verify(data)
+        # data has no control bits but the FIN of the last segment, replies carry no data
+        stream = not pkt_ok or pkt.ctrl_bits == 0 or len(pkt.data)
+        if self.receiver is not None and stream:
+            self.receiver.on_packet(pkt if pkt_ok else None)
+        elif not pkt_ok:
+            pass
+        elif self.sender is not None and pkt.get_ack_bit():
+            self.sender.on_ack(pkt)
+        elif not stream:        # late data of a finished download is dropped
+            self.replies.put_nowait(pkt)
+
+    def send(self, packed):
+        self.transport.sendto(packed)
+
+    def transmit_ack(self, packed):
+        packed = impaired(packed, self.crpt_ack_rate, self.ack_loss_rate, b"\x01")
+        if packed is not None:
+            self.send(packed)
+
+    def transmit_data(self, packed, new):
+        self.send(packed)
+
+    async def request(self, data, ctrl_bits=0x00, tries=1, options=b''):
+        """
+        Sends a control packet and returns the reply
+
+        Parameters:
+          data      - request
+          ctrl_bits - control bits of the request
+          tries     - times it is sent before asyncio.TimeoutError is raised
+          options   - options of the request
+        """
+        packed = Packet(self.port, self.server_port, 0, 0, data, ctrl_bits, options).pkt_pack()
+        for i in range(tries):
+            self.send(packed)
+            try:
+                return await asyncio.wait_for(self.replies.get(), self.timeout)
+            except asyncio.TimeoutError:
+                if i == tries - 1:
+                    raise
+
+    async def connect(self):
+        """ Three way handshake, returns True once the connection is established """
+        start = self.loop.time()
+        try:
+            syn_ack = await self.request(b'', 0x02, self.tries, wscale_option(WSCALE) + ts_option(ts_clock(start), 0))
+        except asyncio.TimeoutError:
+            print("Client: Connection failed: timeout")
+            return False
+        if syn_ack.get_ack_bit() and syn_ack.ack_num == 1:
+            rtt = self.loop.time() - start
+            if rtt < self.timeout:  # the first SYN was answered, a SYN sent again can't be timed (Karn)
+                self.rtt = rtt
+            shift = syn_ack.wscale()
+            if shift is not None:   # the server scales its window too
+                self.snd_wscale = shift
+                self.rcv_wscale = WSCALE
+            self.timestamps = syn_ack.timestamps() is not None
+            self.send(Packet(self.port, self.server_port, 0, 1, b'', 0x10).pkt_pack())
+            return True
+        print("Client: Connection failed: bad SYNACK")
+        return False
+
+    async def download(self, filename, cc=None):
+        """
+        Receives the server image into filename, returns the bytes received
+
+        Parameters:
+          filename - file to save the image to
+          cc       - congestion control the server sends with, its default if None
+        """
+        window = RecvWindow(SegmentWriter(filename), AckTemplate(self.port, self.server_port, self.timestamps),
+                            partial(tune_rcvbuf, self.sock), self.rcv_wscale)
+        # installed before the request, data can follow the reply immediately
+        self.receiver = AsyncReceiver(self.loop, window, self.transmit_ack, self.timeout)
+        try:
+            await self.request("download" if cc is None else "download " + cc)
+            return await self.receiver.done
+        finally:
+            self.receiver.finish()
+            self.receiver = None
+
+    async def upload(self, filename, cc='reno'):
+        """
+        Sends filename to the server, returns the time it took
+
+        Parameters:
+          filename - file to send
+          cc       - congestion control of the upload
+        """
+        await self.request("upload")
+        window = SendWindow(read_segments(filename, data_size), self.port, self.server_port, cc=cc,
+                            wscale=self.snd_wscale, timestamps=self.timestamps, rtt=self.rtt)
+        self.sender = AsyncSender(self.loop, window, self.transmit_data)
+        try:
+            self.sender.pump()
+            return await self.sender.done
+        finally:
+            self.sender.close()
+            self.sender = None
+
+    async def close(self):
+        """ Sends exit and answers the FIN of the server """
+        try:
+            fin = await self.request("exit", 0x01, self.tries)
+            while not fin.get_fin_bit():
+                fin = await asyncio.wait_for(self.replies.get(), self.timeout)
+            self.send(Packet(self.port, self.server_port, 0, 0, b'', 0x10).pkt_pack())
+        except asyncio.TimeoutError:
+            print("Client: Connection teardown failed")
+        self.transport.close()
+
+
+def bind_socket(host, port):
+    """ UDP socket bound to (host, port) with an enlarged receive buffer """
+    sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    except OSError:
+        pass
+    sock.bind((host, port))
+    return sock
+
+
+async def start_server(host='127.0.0.1', port=20001, **kwargs):
+    """ Binds an AsyncServer, returns (transport, server) """
+    loop = asyncio.get_running_loop()
+    sock = bind_socket(host, port)
+    transport, server = await loop.create_datagram_endpoint(lambda: AsyncServer(**kwargs), sock=sock)
+    server.sock = sock
+    return transport, server
+
+
+async def open_client(host='127.0.0.1', port=20001, **kwargs):
+    """ Binds an AsyncClient to an ephemeral port, returns (transport, client) """
+    loop = asyncio.get_running_loop()
+    sock = bind_socket(host, 0)
+    sock.connect((host, port))
+    transport, client = await loop.create_datagram_endpoint(lambda: AsyncClient(**kwargs), sock=sock)
+    client.sock = sock
+    return transport, client
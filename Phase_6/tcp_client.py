@@ -1,27 +1,45 @@
 # This file implements the client process
 import socket
+import selectors
 import io
 import os
 import sys
-from time import sleep
+from functools import partial
+from math import ceil
 from time import time
 from threading import Thread
 from random import randint, seed
-from math import ceil
 
-from PacketHandler import Packet
-from tcp_timer import Timer
+from PacketHandler import Packet, PacketView, AckTemplate, verify, verify_batch, wscale_option, parse_wscale, \
+    ts_option, parse_ts
+from file_writer import SegmentWriter
+from transfer import SendWindow, RecvWindow, RECV_BUFFER, WSCALE, ts_clock
+from recv_ring import RecvRing, tune_rcvbuf
+from udp_gso import GSOSender
+from file_cache import MappedFile, read_segments
 
 
 class Client(Thread):
-    def __init__(self, crpt_ack, ack_loss):
+    def __init__(self, crpt_ack, ack_loss, gso=False, port=20002, server_port=20001, cc=None,
+                 kernel_stamps=False):
         """
         Initializes Server Process
+
+        Parameters:
+          crpt_ack    - ACK corruption rate in percent
+          ack_loss    - ACK loss rate in percent
+          gso         - use Linux UDP GSO/GRO where the kernel supports it
+          port        - port to bind, 0 for an ephemeral port
+          server_port - port of the server
+          cc          - congestion control of uploads and asked of the server for
+                        downloads, None for the default of each side
+          kernel_stamps - time the ACKs of uploads by when the kernel received them
+                        (SO_TIMESTAMPNS) instead of when they were read
         """
         Thread.__init__(self)                   # initializes as thread
         host_ip = '127.0.0.1'
-        self.server_port = 20001
-        self.client_port = 20002
+        self.server_port = server_port
+        self.client_port = port
         # address of server (IP, Port)
         self.server_addr = (host_ip, self.server_port)
         # address of client (IP, Port)
@@ -30,13 +48,14 @@ class Client(Thread):
         self.crpt_ack_rate = crpt_ack           # recived ACK corruption rate inpercent
         self.ack_loss_rate = ack_loss           # loss of ack packet rate
         self.err_flag = 0
-
-        self.N = 1
-        self.est_rtt = 0.1  # initial estimated rtt (100ms)
-        self.dev_rtt = 0    # inital deviation in rtt for timeout
+        self.cc = cc
+        self.snd_wscale = 0     # window scale of the server, 0 unless both sides sent the option
+        self.rcv_wscale = 0     # window scale of the client's own window
+        self.timestamps = False # both sides send the timestamps option
+        self.rtt = None         # rtt measured in the handshake
 
         self.pkt_size = 1024                                # packet size
-        self.header_size = 18                                # bytes of header data
+        self.header_size = 28                                # bytes of header data, with the timestamps option
         self.data_size = self.pkt_size - self.header_size   # Size of data in packet
         # relative path of image to send
         self.img_to_send = 'hello.jpg'
@@ -51,9 +70,19 @@ class Client(Thread):
         # Recieving sockets timeout after 1 seconds
         self.client_socket.settimeout(1)
 
+        # room for the initial receive window, downloads grow it by autotuning
+        tune_rcvbuf(self.client_socket, ceil(RECV_BUFFER / self.data_size))
+
+        # data and ACKs are received into preallocated slots
+        self.ring = RecvRing(self.client_socket, self.pkt_size, gro=gso, stamps=kernel_stamps)
+        # several packets per send when GSO is on
+        self.gso = GSOSender(self.client_socket, gso)
+
         # bind to the socket
         try:
             self.client_socket.bind(self.client_addr)
+            self.client_addr = self.client_socket.getsockname()
+            self.client_port = self.client_addr[1]
             print("Client bound to port", self.client_port)
 
         except:
@@ -62,21 +91,15 @@ class Client(Thread):
     def gen_err_flag(self):
         self.err_flag = randint(1, 100)
 
-    def est_timeout(self, sample_rtt):
-        a = 0.125
-        B = 0.25
-        self.est_rtt = ((1-a)*self.est_rtt) + (a*sample_rtt)
-        self.dev_rtt = ((1-B)*self.dev_rtt) + (B*abs(sample_rtt - self.est_rtt))
-
-        return self.est_rtt + (4*self.dev_rtt)
-
     def est_connection(self):
+        start = time()
         my_syn = Packet(src=self.client_port,
                         dst=self.server_port,
                         seq_num=0,
                         ack_num=0,
                         data=b'',
-                        ctrl_bits=0x02)
+                        ctrl_bits=0x02,
+                        options=wscale_option(WSCALE) + ts_option(ts_clock(start), 0))
         packed = my_syn.pkt_pack()
         self.client_socket.sendto(packed, self.server_addr)
 
@@ -87,6 +110,12 @@ class Client(Thread):
 
             if syn_ack.get_ack_bit() and syn_ack.ack_num == 1:
                 self.conn_est = True
+                self.rtt = time() - start
+                shift = parse_wscale(syn_ack.options)
+                if shift is not None:   # the server scales its window too
+                    self.snd_wscale = shift
+                    self.rcv_wscale = WSCALE
+                self.timestamps = parse_ts(syn_ack.options) is not None
                 print("Client: Sending ACK for SYNACK")
                 my_syn = Packet(src=self.client_port,
                         dst=self.server_port,
@@ -101,186 +130,187 @@ class Client(Thread):
         except socket.timeout:
             print("Client: Connection failed: timeout")
 
-    def resend_lost(self, window, seq):
-        self.client_socket.sendto(window[seq], self.server_addr)
+    def end_connection(self, tries=3):
+        """
+        Sends exit and ACKs the FIN of the server, exit is sent again if the
+        FIN doesn't arrive within the socket timeout
+
+        Parameters:
+          tries - times exit is sent before giving up
+        """
+        request = Packet(src=self.client_port,
+                         dst=self.server_port,
+                         seq_num=0,
+                         ack_num=0,
+                         data="exit",
+                         ctrl_bits=0x01).pkt_pack()
+        for i in range(tries):
+            self.client_socket.sendto(request, self.server_addr)
+            try:
+                while True:
+                    recv_data = self.client_socket.recv(self.pkt_size)
+                    fin = PacketView(recv_data)
+                    # the reply and late segments of the download come first
+                    if verify(recv_data) and fin.get_fin_bit() and not len(fin.data):
+                        break
+            except socket.timeout:
+                continue
+            ack = Packet(src=self.client_port,
+                         dst=self.server_port,
+                         seq_num=0,
+                         ack_num=0,
+                         data=b'',
+                         ctrl_bits=0x10)
+            self.client_socket.sendto(ack.pkt_pack(), self.server_addr)
+            print("Client: Connection closed")
+            return True
+        print("Client: Connection teardown failed")
+        return False
+
+    def recv_burst(self, max_burst=64):
+        """
+        Waits for one packet, then drains any packets already queued on the socket
+
+        Parameters:
+          max_burst - most packets returned at once
+        """
+        max_burst = min(max_burst, self.ring.n_slots)  # more would refill slots still in the burst
+        burst = [self.ring.recv()]
+        timeout = self.client_socket.gettimeout()
+        self.client_socket.settimeout(0)      # don't block while draining
+        while len(burst) < max_burst:
+            try:
+                burst.append(self.ring.recv())
+            except BlockingIOError:
+                break
+        self.client_socket.settimeout(timeout)
+        return burst
 
-    def send_img(self, filename):
+    def send_img(self, filename, use_mmap=False, pacing=False):
         """
         Sends the image packet by packet
 
+        Sleeps until ACKs arrive, the retransmission timer runs out or the
+        next paced packet is due, then takes every queued ACK and sends every
+        segment the window allows
+
         Parameters:
           filename - file to send
+          use_mmap - memory map the file instead of reading it segment by segment
+          pacing   - space packets at the estimated bottleneck rate instead of
+                     sending them in bursts as ACKs open the window
         """
-        recv_data = b''         # bytes for data received
-        recv_pkt = Packet()     # init empty packet for received data
-        read_data = b''         # byte string data read from file
-        seq_num = 0             # init sequence number
-        base = 0                # init base packet number
-        window = {}             # init window as empty dict
-        dupl_cnt = 0       # count of duplicate acks
-        my_timer = Timer()      # Timer thread
-        my_timer.set_time(0.1)    # set timer to 100 ms
-        my_timer.stop()         # so timer doesn't start counting
-        my_timer.start()        # start timer thread
-        rtt_start = {}
-
-        self.client_socket.settimeout(0)    # don't block when waiting for ACKs
-
-        # open file to be sent
+        recv_pkt = PacketView() # view of received ACKs
+        sel = selectors.DefaultSelector()
+        sel.register(self.client_socket, selectors.EVENT_READ)
+
+        self.client_socket.settimeout(0)    # don't block when taking ACKs
+
         print("Client: Sending image to server")
         # start = time()
-        with open(filename, 'rb') as img:
-            read_data = img.read(self.data_size)
-            # pack
-            send_pkt = Packet(src=self.client_port,
-                              dst=self.server_port,
-                              seq_num=seq_num,
-                              ack_num=0,
-                              data=read_data,
-                              ctrl_bits=0x00)
-            next_pkt = send_pkt.pkt_pack()
-
-            # add first packet to window list
-            window[send_pkt.seq_num] = next_pkt
-
-            # send data until all data acked
-            while read_data or len(window) > 0:
-                # Move to next data 
-                if len(window) < self.N and read_data:
-                    read_data = img.read(self.data_size)
-                    # pack
-                    if read_data:
-                        send_pkt = Packet(src=self.client_port,
-                                          dst=self.server_port,
-                                          seq_num=seq_num,
-                                          ack_num=0,
-                                          data=read_data,
-                                          ctrl_bits=0x00)
-                        next_pkt = send_pkt.pkt_pack()
-                        window[send_pkt.seq_num] = next_pkt   # add packet to window
-                    else:   # no more data to be sent
-                        next_pkt = None
-
-                if next_pkt:
-                    self.client_socket.sendto(next_pkt, self.server_addr)
-                    next_pkt = None
-                    rtt_start[send_pkt.seq_num] = time()
-                    if base == seq_num:
-                        my_timer.restart()  # start timer
-                    seq_num += len(send_pkt.data)
-
-                if my_timer.get_exception():
-                    self.N = ceil(self.N / 2)
-                    self.resend_lost(window, base)
-                    rtt_start[base] = time()
-                    my_timer.restart()
-
-                # receive ACK
-                if recv_data:
-                    recv_data = b''     # empty data buffer
-                try:
-                    recv_data = self.client_socket.recv(self.pkt_size)
-                except socket.error as e:
-                    if e == 10035:
-                        pass
+        if use_mmap:
+            # window only holds offsets into the mapping, packets built on every send
+            mapped = MappedFile(filename, self.data_size)
+            segments = mapped
+        else:
+            mapped = None
+            segments = read_segments(filename, self.data_size)
+        sender = SendWindow(segments, self.client_port, self.server_port, cc=self.cc or 'reno', pacing=pacing,
+                            wscale=self.snd_wscale, timestamps=self.timestamps, rtt=self.rtt)
+        max_batch = self.gso.max_batch(self.pkt_size)    # 1 without GSO
+
+        # send data until all data acked
+        while not sender.done():
+            # Move to next data, with GSO up to max_batch packets go out together
+            while True:
+                new_pkts = sender.new_packets(time(), max_batch)
+                if not new_pkts:
+                    break
+                self.gso.send(new_pkts, self.server_addr)
+            if sender.done():
+                break
+
+            # wait for ACKs, the retransmission timer or the next paced packet
+            wakeup = sender.wakeup()
+            if wakeup is None:
+                events = sel.select()
+            else:
+                events = sel.select(max(0, wakeup - time()))
 
-                if recv_data:
-                    recv_pkt.pkt_unpack(recv_data)
+            if not events:
+                now = time()
+                if sender.deadline is not None and now >= sender.deadline:
+                    for packed in sender.on_timeout(now):
+                        self.client_socket.sendto(packed, self.server_addr)
+                continue
 
-                    if recv_pkt.csum != recv_pkt.checksum():
-                        pass
-                    # ACK is OK
-                    else:
-                        rtt_end = time()
-                        if recv_pkt.ack_num > base:
-                            dupl_cnt = 0                    # reset duplicate count
-                            prev_base = base
-                            base = recv_pkt.ack_num         # increment base
-                            for pkt in sorted(window.keys()):   # remove acked packets from window
-                                if pkt < base:
-                                    window.pop(pkt)
-                                else:
-                                    break
-                            if len(window) == 0:            # no unacked packets
-                                my_timer.stop()
-                            else:                           # unacked packets remaining
-                                my_timer.restart(self.est_timeout(rtt_end - rtt_start[prev_base]))
-                            self.N += 1
-                        elif recv_pkt.ack_num == base:
-                            dupl_cnt += 1
-                        # received 3 duplicate ACKs
-                        if dupl_cnt >= 3:
-                            dupl_cnt = 0
-                            self.N = ceil(self.N / 2)
-                            self.resend_lost(window, base)
-                            rtt_start[base] = time()
-                            my_timer.restart()
-
-                sleep(0.0001)
+            # take every ACK queued
+            while True:
+                try:
+                    recv_data = self.ring.recv()
+                except socket.error:
+                    break   # no more ACKs
+
+                recv_pkt.pkt_unpack(recv_data)
 
+                # Received NAK
+                if recv_pkt.csum != recv_pkt.checksum():
+                    pass
+                # ACK is OK, timed when it arrived if the kernel stamped it
+                else:
+                    read = time()
+                    for packed in sender.on_ack(recv_pkt.ack_num, self.ring.stamp or read, recv_pkt.sack_blocks(),
+                                                recv_pkt.rwin, recv_pkt.timestamps(), read):
+                        self.client_socket.sendto(packed, self.server_addr)
+
+        sel.close()
+        if mapped is not None:
+            mapped.close()
         # end = time()
-        my_timer.kill()
-        my_timer.join()
-        self.N = 1                          #reset window size
-        self.est_rtt = 0.1                  # reset estimated rtt
-        self.dev_rtt = 0                    # reset deviation
         self.client_socket.settimeout(1)    # reset timeout value
 
     def recv_img(self, filename):
         """
         Receive an image packet by packet
-        Saves image to specified file
+        Saves image to specified file, done as soon as every byte up to the
+        FIN of the server is in
 
         Parameters:
           filename - file location to save image
         """
         recv_data = b''             # packet of byte string data
-        save_data = b''             # data to be saved to file
         img_not_recvd = True        # flag to indicate if image data hasn't started yet
-        exp_seq = 0                 # expected sequence number initially 0
-        chunks = {}                 # init dictionary of received data chunks
-        pkt = Packet()
+        window = RecvWindow(SegmentWriter(filename),    # data is written to its offset as it arrives
+                            AckTemplate(self.client_port, self.server_port, self.timestamps),
+                            partial(tune_rcvbuf, self.client_socket), self.rcv_wscale)
+        pkt = PacketView()
 
         # get image data from server until all data received
-        while True:
+        while not window.complete():
             try:
-                if (self.crpt_ack_rate > 0 or self.ack_loss_rate > 0):
-                    self.gen_err_flag()
-
                 if img_not_recvd:
                     print("Client: Ready to receive image", flush=True)
 
-                recv_data = self.client_socket.recv(self.pkt_size)
+                burst = self.recv_burst()
+                good = verify_batch(burst)      # checksum the whole burst at once
 
-                pkt.pkt_unpack(recv_data)
-                if pkt.seq_num < exp_seq or pkt.csum != pkt.checksum():
-                    pass
-                elif pkt.seq_num > exp_seq:
-                    if pkt.seq_num not in chunks.keys():
-                        chunks[pkt.seq_num] = pkt.data
-                else:
-                    chunks[pkt.seq_num] = pkt.data
-                    # increment expected sequence to highest received data
-                    exp_seq += len(pkt.data)
-                    while exp_seq in chunks.keys():
-                        exp_seq += len(chunks[exp_seq])
-
-                ack = Packet(src=self.client_port,
-                             dst=self.server_port,
-                             seq_num=0,
-                             ack_num=exp_seq,
-                             data=b'',
-                             ctrl_bits=0x10)
-
-                ack_pack = ack.pkt_pack()
-
-                if (self.ack_loss_rate > 0 and self.err_flag <= self.ack_loss_rate):
-                    pass
-                elif (self.crpt_ack_rate > 0 and self.err_flag <= self.crpt_ack_rate):
-                    ack_pack = b"".join([ack_pack[0:1023], b"\x01"])
-                    self.client_socket.sendto(ack_pack, self.server_addr)
-                else:
-                    self.client_socket.sendto(ack_pack, self.server_addr)
+                for recv_data, pkt_ok in zip(burst, good):
+                    if (self.crpt_ack_rate > 0 or self.ack_loss_rate > 0):
+                        self.gen_err_flag()
+
+                    if pkt_ok:
+                        pkt.pkt_unpack(recv_data)
+                        window.receive(pkt, time())
+
+                    ack_pack = window.ack_pack()     # cumulative ACK with SACK blocks
+
+                    if (self.ack_loss_rate > 0 and self.err_flag <= self.ack_loss_rate):
+                        pass
+                    elif (self.crpt_ack_rate > 0 and self.err_flag <= self.crpt_ack_rate):
+                        ack_pack = b"".join([ack_pack[0:1023], b"\x01"])
+                        self.client_socket.sendto(ack_pack, self.server_addr)
+                    else:
+                        self.client_socket.sendto(ack_pack, self.server_addr)
 
                 if img_not_recvd:
                     img_not_recvd = False       # img data began streaming if it reaches this point
@@ -289,16 +319,15 @@ class Client(Thread):
                 # if image not recieved yet, keep waiting
                 if img_not_recvd:
                     pass
-                # image has been recieved
+                # the server has gone quiet
                 else:
                     break   # exit loop
 
-        for chunk in sorted(chunks.keys()):
-            save_data += chunks[chunk]
-        # write data into a file
-        with open(filename, 'wb+') as client_img:
-            client_img.write(save_data)
-        print("Client: Received and saved image", flush=True)
+        window.writer.close()
+        if window.complete():
+            print("Client: Received and saved image", flush=True)
+        else:
+            print("Client: Download failed: timeout", flush=True)
 
     def run(self):
         """
@@ -310,7 +339,7 @@ class Client(Thread):
 
         self.est_connection()
 
-        request = "download"
+        request = "download" if self.cc is None else "download " + self.cc
         req_pkt = Packet(src=self.client_port,
                          dst=self.server_port,
                          seq_num=0,
@@ -342,39 +371,9 @@ class Client(Thread):
         ack_data = self.client_socket.recv(self.pkt_size)
         ack.pkt_unpack(ack_data)
 
-        self.send_img(self.img_to_send)
-
-        sleep(5) """
+        self.send_img(self.img_to_send) """
 
-        ack = Packet()
-        ack_data = b''
-        request = "exit"
-        req_pkt = Packet(src=self.client_port,
-                             dst=self.server_port,
-                             seq_num=0,
-                             ack_num=0,
-                             data=request,
-                             ctrl_bits=0x01)
-        req_packed = req_pkt.pkt_pack()
-
-        self.client_socket.sendto(req_packed, self.server_addr)
-
-        ack_data = self.client_socket.recv(self.pkt_size)
-        ack.pkt_unpack(ack_data)
-        fin = Packet()
-        fin_data = self.client_socket.recv(self.pkt_size)
-        fin.pkt_unpack(fin_data)
-
-        ack = Packet(src=self.client_port,
-                     dst=self.server_port,
-                     seq_num=0,
-                     ack_num=0,
-                     data=b'',
-                     ctrl_bits=0x10)
-
-        ack_pack = ack.pkt_pack()
-        self.client_socket.sendto(ack_pack, self.server_addr)
-        print("Client: Connection closed")
+        self.end_connection()
 
         print("Client: Exiting...")
         # close socket when finished
@@ -1,41 +1,359 @@
 # This file implements the server process
 import socket
+import selectors
 import io
 import os
 import sys
-from time import sleep
+from functools import partial
 from time import time
-from threading import Thread
+from threading import Thread, Lock
 from random import randint, seed
-from math import ceil
 
-from PacketHandler import Packet
-from tcp_timer import Timer
+from PacketHandler import Packet, PacketView, AckTemplate, verify_batch, wscale_option, ts_option
+from file_writer import SegmentWriter
+from transfer import SendWindow, RecvWindow, WSCALE, ts_clock
+from recv_ring import RecvRing, tune_rcvbuf
+from udp_gso import GSOSender
+from file_cache import FileCache, MappedFile
+from congestion import ALGORITHMS
+from tcp_timer import DeadlineHeap
 import csv
 
+pkt_size = 1024                         # packet size
+header_size = 28                        # bytes of header data, with the timestamps option
+data_size = pkt_size - header_size      # Size of data in packet, the worker pool splits files by it too
+
+
+class Connection():
+    """
+    State of one client of the Server, found by the client address
+
+    SYN_RCVD -> ESTABLISHED -> SENDING or RECEIVING -> ESTABLISHED ... -> FIN_WAIT -> closed
+    """
+    def __init__(self, server, addr, port):
+        """
+        Parameters:
+          server - Server the client connected to
+          addr   - address of client (IP, Port)
+          port   - client port stamped into packets
+        """
+        self.server = server
+        self.addr = addr
+        self.port = port
+        self.state = 'SYN_RCVD'
+        self.sender = None      # SendWindow while SENDING
+        self.receiver = None    # RecvWindow of the last upload, kept to ACK its late segments
+        self.mapped = None
+        self.last_recv = None   # time of the last data received, None until data starts
+        self.last_seen = None   # time of the last packet from the client
+        self.fin_sent = None    # time the FIN was sent
+        self.start = 0
+        self.window_list = []
+        self.rtt_list = []
+        self.snd_wscale = 0     # window scale of the client, 0 unless both sides sent the option
+        self.rcv_wscale = 0     # window scale of the server's own window
+        self.timestamps = False # both sides send the timestamps option
+        self.syn_acks = 0       # SYNACKs sent
+        self.syn_ack_sent = 0   # time the last SYNACK was sent
+        self.rtt = None         # rtt measured in the handshake
+        self.timer = server.timers.schedule(None, self.expire)    # at deadline(), kept by rearm()
+
+    def send(self, packed):
+        try:
+            self.server.server_socket.sendto(packed, self.addr)
+        except BlockingIOError:
+            pass    # send buffer full, same as a lost packet
+
+    def reply(self, ack_num, ctrl_bits):
+        self.send(Packet(self.server.server_port, self.port, 0, ack_num, b'', ctrl_bits).pkt_pack())
+
+    def syn_ack(self, syn, now):
+        """ Answers a SYN, window scaling and timestamps are on if the client sent their options """
+        options = b''
+        shift = syn.wscale()
+        if shift is not None:
+            self.snd_wscale = shift
+            self.rcv_wscale = WSCALE
+            options += wscale_option(WSCALE)
+        ts = syn.timestamps()
+        if ts is not None:
+            self.timestamps = True
+            options += ts_option(ts_clock(now), ts[0])
+        self.syn_acks += 1
+        self.syn_ack_sent = now
+        self.last_seen = now
+        self.send(Packet(self.server.server_port, self.port, 0, syn.ack_num + 1, b'', 0x12, options).pkt_pack())
+
+    def deadline(self):
+        """ Next time the connection has to be serviced, None if only packets move it on """
+        if self.state == 'SENDING':
+            return self.sender.wakeup()
+        if self.state == 'RECEIVING' and self.last_recv is not None:
+            return self.last_recv + self.server.recv_timeout
+        if self.state == 'FIN_WAIT':
+            return self.fin_sent + self.server.recv_timeout
+        if self.state in ('SYN_RCVD', 'ESTABLISHED'):
+            return self.last_seen + self.server.idle_timeout
+        return None
+
+    def rearm(self):
+        """ Moves the timer to the deadline, after anything that may have changed it """
+        self.server.timers.reschedule(self.timer, self.deadline())
+
+    def expire(self, now):
+        """ Services the deadline once it has passed """
+        if self.state == 'SENDING':
+            if self.sender.deadline is not None and now >= self.sender.deadline:
+                for packed in self.sender.on_timeout(now):
+                    self.send(packed)
+            self.pump(now)      # paced packets that are due
+        elif self.state == 'RECEIVING':
+            self.end_upload()   # the client is gone
+        elif self.state == 'FIN_WAIT':
+            print("Server: Connection teardown failed", self.addr)
+            self.close()
+        elif self.state in ('SYN_RCVD', 'ESTABLISHED'):
+            print("Server: Connection timed out: idle", self.addr)
+            self.close()        # the client is gone without an exit
+        self.rearm()
+
+    def datagram(self, pkt, pkt_ok, now, arrived=None):
+        """
+        Handles one packet from the client
+
+        Parameters:
+          pkt     - PacketView of the packet
+          pkt_ok  - False if its checksum failed
+          now     - time it was received
+          arrived - time the kernel received it, None without kernel stamps
+        """
+        self.last_seen = now
+        if self.state == 'RECEIVING':
+            if pkt_ok:
+                self.receiver.receive(pkt, now)
+            self.send(self.receiver.ack_pack())
+            self.last_recv = now
+            if self.receiver.complete():
+                self.end_upload()       # every byte up to the FIN is in
+            return
+        if not pkt_ok:
+            return
+        if self.state == 'SENDING':
+            if pkt.get_ack_bit():
+                # timed by the kernel, the rtt sample leaves out how long the ACK waited to be read,
+                # the time it is read is kept alongside for comparison
+                read = time() if arrived is not None else None
+                for packed in self.sender.on_ack(pkt.ack_num, arrived or now, pkt.sack_blocks(), pkt.rwin,
+                                                 pkt.timestamps(), read):
+                    self.send(packed)
+                return
+            if self.sender.done():
+                self.pump(now)          # acked in this burst, not pumped yet
+            else:
+                self.end_download(now)  # command, the client has moved on
+
+        if self.state == 'SYN_RCVD':
+            if pkt.get_syn_bit():
+                self.syn_ack(pkt, now)          # SYNACK was lost, send it again
+            elif pkt.get_ack_bit() and pkt.ack_num == 1:
+                self.state = 'ESTABLISHED'
+                if self.syn_acks == 1:          # the ACK of a SYNACK sent again can't be timed (Karn)
+                    self.rtt = now - self.syn_ack_sent
+                print("Server: Connection established", self.addr)
+            else:
+                print("Server: Connection failed: bad SYNACK", self.addr)
+        elif self.state == 'FIN_WAIT':
+            if pkt.get_ack_bit():
+                print("Server: Connection closed", self.addr)
+                self.close()
+            else:
+                self.command(pkt, now)  # exit again, ACK or FIN was lost
+        elif self.state == 'ESTABLISHED':
+            if not pkt.get_ack_bit():   # late ACKs of a finished download are dropped
+                self.command(pkt, now)
+
+    def command(self, pkt, now):
+        msg = bytes(pkt.data).decode(errors='replace')
+        cmd, _, cc = msg.partition(" ")
+        if self.receiver is not None and cmd not in ("download", "upload", "exit"):
+            self.send(self.receiver.ack_pack())     # segment of the last upload, its ACK was lost
+            return
+        print("Server: Client request:", msg, self.addr, flush=True)
+        # ------------------ Send image to client ------------------
+        # "download <algorithm>" picks the congestion control of the download
+        if cmd == "download" and (not cc or cc in ALGORITHMS):
+            self.reply(pkt.ack_num + 1, 0x10)
+            self.start_download(self.server.img_to_send, now, cc or self.server.cc)
+
+        # ------------------ Get image from client ------------------
+        elif msg == "upload":
+            self.reply(pkt.ack_num + 1, 0x10)
+            print("Server: Ready to receive image", flush=True)
+            self.state = 'RECEIVING'
+            self.last_recv = None
+            self.receiver = RecvWindow(SegmentWriter(self.server.img_save_to),
+                                       AckTemplate(self.server.server_port, self.port, self.timestamps),
+                                       partial(tune_rcvbuf, self.server.server_socket), self.rcv_wscale)
+
+        # ------------------ Close the connection ------------------
+        elif msg == "exit":
+            self.reply(pkt.ack_num + 1, 0x10)
+            self.reply(0, 0x01)         # send FIN packet
+            if self.state != 'FIN_WAIT':
+                self.fin_sent = now
+                self.state = 'FIN_WAIT'
+
+        # ------------------ Handle invalid request ------------------
+        else:
+            self.reply(0, 0x10)         # send NAK
+            print("Server: Received invalid request:", pkt)
+
+    def start_download(self, filename, now, cc):
+        print("Server: Sending image to client", self.addr)
+        if self.server.use_mmap or os.path.getsize(filename) > self.server.file_cache.max_bytes:
+            # window only holds offsets into the mapping, packets built on every send
+            self.mapped = MappedFile(filename, self.server.data_size)
+            segments = self.mapped
+        else:
+            # file split into segments ahead of time, only ports and seq are stamped
+            segments = self.server.file_cache.get(filename)
+        self.state = 'SENDING'
+        self.sender = SendWindow(segments, self.server.server_port, self.port, self.server.sack, cc,
+                                 self.server.pacing, self.snd_wscale, self.timestamps, self.rtt)
+        self.start = now
+        self.window_list = []
+        self.rtt_list = []
+        self.pump(now)
+
+    def pump(self, now):
+        """ Sends every new segment the window allows, with GSO up to max_batch together """
+        if self.state != 'SENDING':
+            return
+        self.window_list.append(self.sender.N)
+        self.rtt_list.append(self.sender.sample_rtt)
+        while True:
+            new_pkts = self.sender.new_packets(now, self.server.max_batch)
+            if not new_pkts:
+                break
+            try:
+                self.server.gso.send([pkt for pkt in map(self.server.impair, new_pkts) if pkt is not None],
+                                     self.addr)
+            except BlockingIOError:
+                break   # send buffer full, the rest go out on the next wakeup
+        if self.sender.done():
+            self.server.downloads += 1
+            self.server.bytes_sent += self.sender.seq_num
+            self.server.retransmits += self.sender.resent
+            self.server.spurious_timeouts += self.sender.spurious
+            rtt_samples = self.sender.rtt_samples
+            read_samples = self.sender.read_samples
+            self.end_download(now)
+            print("Server: Time to send image:", now - self.start, self.addr)
+            if not self.server.export:
+                return
+
+            with open("window_size.csv", 'w+', newline='') as win_csv:
+                writer = csv.writer(win_csv, delimiter=',')
+                writer.writerow(self.window_list)
+
+            with open("rtt_times.csv", 'w+', newline='') as rtt_csv:
+                writer = csv.writer(rtt_csv, delimiter=',')
+                writer.writerow(self.rtt_list)
+
+            # every sample, timed by the kernel or the loop as the server was started with,
+            # then the same ACKs timed when the loop read them
+            with open("rtt_samples.csv", 'w+', newline='') as samples_csv:
+                writer = csv.writer(samples_csv, delimiter=',')
+                writer.writerow(rtt_samples)
+                writer.writerow(read_samples)
+
+    def end_download(self, now):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        self.sender = None
+        self.state = 'ESTABLISHED'
+
+    def end_upload(self):
+        self.receiver.writer.close()
+        self.state = 'ESTABLISHED'
+        if self.receiver.complete():
+            self.server.uploads += 1
+            print("Server: Received and saved image", self.addr, flush=True)
+        else:
+            print("Server: Upload failed: timeout", self.addr, flush=True)
+
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        if self.receiver is not None:
+            self.receiver.writer.close()
+            self.receiver = None
+        self.sender = None
+        self.state = 'CLOSED'
+        self.server.conns.pop(self.addr, None)
+
 
 class Server(Thread):
-    def __init__(self, crpt_data, data_loss):
+    def __init__(self, crpt_data, data_loss, cache_size=64*1024*1024, gso=False,
+                 port=20001, serve_forever=False, use_mmap=False, reuse_port=False, file_cache=None,
+                 sack=True, cc='reno', pacing=False, kernel_stamps=False, export=True):
         """
         Initializes Server Process
+
+        Parameters:
+          crpt_data     - data packet corruption rate in percent
+          data_loss     - data packet loss rate in percent
+          cache_size    - bytes of files kept ready to send
+          gso           - use Linux UDP GSO/GRO where the kernel supports it
+          port          - port to serve on
+          serve_forever - keep serving once every client has closed its connection
+          use_mmap      - memory map the file for every download instead of sending it
+                          from the cache, always done for files too large for the cache
+          reuse_port    - bind with SO_REUSEPORT, so several server processes share the port
+          file_cache    - FileCache to send from, shared with other servers
+          sack          - repair every hole the SACK blocks of the client show
+          cc            - congestion control of downloads that do not name one
+          pacing        - space the packets of downloads at the estimated bottleneck rate
+          kernel_stamps - time ACKs by when the kernel received them (SO_TIMESTAMPNS)
+                          instead of when the loop got round to them
+          export        - write the window sizes and rtts of every download to CSV files
+                          in the working directory, each download overwrites the last
         """
         Thread.__init__(self)                   # initializes as thread
         host_ip = '127.0.0.1'
-        self.server_port = 20001
+        self.server_port = port
         server_addr = (host_ip, self.server_port)   # address of server (IP, Port)
-        self.conn_est = False                       # no connection established initially
-
-        self.pkt_size = 1024                                # packet size
-        self.header_size = 18                               # bytes of header data
-        self.data_size = self.pkt_size - self.header_size   # Size of data in packet
+        self.conns = {}                             # client address -> Connection
+        self.timers = DeadlineHeap()                # deadline of every connection, earliest first
+        self.serve_forever = serve_forever
+        self.stopped = False
+        self.use_mmap = use_mmap
+        self.sack = sack
+        self.cc = cc
+        self.pacing = pacing
+        self.export = export
+        self.connections = 0                        # connections opened
+        self.downloads = 0                          # completed downloads
+        self.uploads = 0                            # completed uploads
+        self.bytes_sent = 0                         # bytes of completed downloads
+        self.retransmits = 0                        # packets sent again by completed downloads
+        self.spurious_timeouts = 0                  # timeouts of completed downloads found spurious and undone
+
+        self.pkt_size = pkt_size
+        self.header_size = header_size
+        self.data_size = data_size
+        self.recv_timeout = 5                               # seconds without data that abort an upload
+        self.idle_timeout = 30                              # seconds between commands before a client is dropped
         # relative path of image to send
         self.img_to_send = 'hello.jpg'
         # filename to save received image
         self.img_save_to = 'server_img.jpg'
-
-        self.N = 1          # set N to 1 for initial window size
-        self.est_rtt = 0.1  # initial estimated rtt (100ms)
-        self.dev_rtt = 0    # inital deviation in rtt for timeout
+        # files already split into segments, shared by every download
+        if file_cache is None:
+            file_cache = FileCache(self.data_size, cache_size)
+        self.file_cache = file_cache
 
         self.crpt_data_rate = crpt_data         # packet corruption rate in percent
         self.pkt_loss_rate = data_loss          # loss of data packet rate
@@ -47,12 +365,30 @@ class Server(Thread):
         self.server_socket = socket.socket(family=socket.AF_INET,
                                            type=socket.SOCK_DGRAM)
 
-        # Recieving sockets timeout after 5 seconds
-        self.server_socket.settimeout(5)
+        # don't block, the selector says when packets are waiting
+        self.server_socket.settimeout(0)
+
+        # shared by every client, capped by net.core.rmem_max, uploads grow it further
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4*1024*1024)
+
+        # data and ACKs are received into preallocated slots
+        self.ring = RecvRing(self.server_socket, self.pkt_size, gro=gso, stamps=kernel_stamps)
+        # several packets per send when GSO is on
+        self.gso = GSOSender(self.server_socket, gso)
+        self.max_batch = self.gso.max_batch(self.pkt_size)  # 1 without GSO
+
+        # stop() writes to this pair to wake the loop
+        self.wake_recv, self.wake_send = socket.socketpair()
+        self.wake_recv.setblocking(False)
+        self.wake_lock = Lock()     # held to write to the pair and to close it
 
         # bind to the socket
         try:
+            if reuse_port:
+                # the kernel hashes each client to one of the sockets on the port
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.server_socket.bind(server_addr)
+            self.server_port = self.server_socket.getsockname()[1]
             print("Server bound to port", self.server_port)
 
         except:
@@ -61,357 +397,149 @@ class Server(Thread):
     def gen_err_flag(self):
         self.err_flag = randint(1, 100)
 
-    def est_timeout(self, sample_rtt):
-        a = 0.125
-        B = 0.25
-        self.est_rtt = ((1-a)*self.est_rtt) + (a*sample_rtt)
-        self.dev_rtt = ((1-B)*self.dev_rtt) + (B*abs(sample_rtt - self.est_rtt))
-
-        return self.est_rtt + (4*self.dev_rtt)
-
-    def est_connection(self, syn_pkt: Packet):
-        self.client_port = syn_pkt.src
-        my_syn = Packet(self.server_port, self.client_port,
-                        0, syn_pkt.ack_num + 1,
-                        b'', 0x12)    # ack bit = 1, syn bit = 1
-        packed = my_syn.pkt_pack()
-        self.server_socket.sendto(packed, self.client_addr)
-
-        try:
-            syn_ack = Packet()
-            recv_data = self.server_socket.recv(self.pkt_size)
-            syn_ack.pkt_unpack(recv_data)
-
-            if syn_ack.get_ack_bit() and syn_ack.ack_num == 1:
-                self.conn_est = True
-                print("Server: Connection established")
-            else:
-                print("Server: Connection failed: bad SYNACK")
-        except socket.timeout:
-            print("Server: Connection failed: timeout")
-
-    def resend_lost(self, window, seq):
-        self.server_socket.sendto(window[seq], self.client_addr)
-
-    def send_img(self, filename):
+    def impair(self, packed):
         """
-        Sends the image packet by packet
+        Emulates data packet corruption and loss
 
-        Parameters:
-          filename - file to send
+        Returns the packet to send, None if it is lost
         """
-        recv_data = b''         # bytes for data received
-        recv_pkt = Packet()     # init empty packet for received data
-        read_data = b''         # byte string data read from file
-        seq_num = 0             # init sequence number
-        base = 0                # init base packet number
-        window = {}             # init window as empty dictionary
-        dupl_cnt = 0       # count of duplicate acks
-        my_timer = Timer()      # Timer thread
-        my_timer.set_time(0.1)    # set timer to 100 ms
-        my_timer.stop()         # so timer doesn't start counting
-        my_timer.start()        # start timer thread
-        rtt_start = {}
-        window_list = []
-        rtt_list = []
-        new_timeout = 0.1
-
-        self.server_socket.settimeout(0)    # don't block when waiting for ACKs
-
-        # open file to be sent
-        print("Server: Sending image to client")
-        start = time()
-        with open(filename, 'rb') as img:
-            read_data = img.read(self.data_size)
-            # pack
-            send_pkt = Packet(src=self.server_port,
-                              dst=self.client_port,
-                              seq_num=seq_num,
-                              ack_num=0,
-                              data=read_data,
-                              ctrl_bits=0x00)
-            next_pkt = send_pkt.pkt_pack()
-
-            # add first packet to window list
-            window[send_pkt.seq_num] = next_pkt
-
-            # send data until all data acked
-            while read_data or len(window) > 0:
-                if (self.crpt_data_rate > 0 or self.pkt_loss_rate > 0):
-                    self.gen_err_flag()
-
-                window_list.append(self.N)
-                rtt_list.append(new_timeout)
-                
-                # Move to next data 
-                if len(window) < self.N and read_data:
-                    read_data = img.read(self.data_size)
-                    # pack
-                    if read_data:
-                        send_pkt = Packet(src=self.server_port,
-                                          dst=self.client_port,
-                                          seq_num=seq_num,
-                                          ack_num=0,
-                                          data=read_data,
-                                          ctrl_bits=0x00)
-                        next_pkt = send_pkt.pkt_pack()
-                        window[send_pkt.seq_num] = next_pkt   # add packet to window
-                    else:   # no more data to be sent
-                        next_pkt = None
-
-                if next_pkt:
-                    if self.crpt_data_rate > 0 and self.err_flag <= self.crpt_data_rate:
-                        # corrupt 1 byte of the sent packet
-                        crptpacked = b"".join([next_pkt[0:1023], b"\x00"])
-                        self.server_socket.sendto(crptpacked, self.client_addr)
-                    elif self.pkt_loss_rate > 0 and self.err_flag <= self.pkt_loss_rate:
-                        pass    # dont send anything
-                    else:
-                        # send normally
-                        self.server_socket.sendto(next_pkt, self.client_addr)
-                    next_pkt = None
-                    rtt_start[send_pkt.seq_num] = time()
-                    if base == seq_num:
-                        my_timer.restart()  # start timer
-                    seq_num += len(send_pkt.data)
-
-                if my_timer.get_exception():
-                    self.N = ceil(self.N / 2)
-                    self.resend_lost(window, base)
-                    rtt_start[base] = time()
-                    my_timer.restart()
-
-
-                # receive ACK
-                if recv_data:
-                    recv_data = b''     # empty data buffer
-                try:
-                    recv_data = self.server_socket.recv(self.pkt_size)
-                except socket.error as e:
-                    if e == 10035:
-                        pass
-
-                if recv_data:
-                    recv_pkt.pkt_unpack(recv_data)
-
-                    # Received NAK
-                    if recv_pkt.csum != recv_pkt.checksum():
-                        pass
-                    # ACK is OK
-                    else:
-                        rtt_end = time()
-                        if recv_pkt.ack_num > base:
-                            dupl_cnt = 0                        # reset duplicate count
-                            prev_base = base
-                            base = recv_pkt.ack_num             # increment base
-                            for pkt in sorted(window.keys()):   # remove acked packets from window
-                                if pkt < base:
-                                    window.pop(pkt)
-                                else:
-                                    break
-                            if len(window) == 0:            # no unacked packets
-                                my_timer.stop()
-                            else:                           # unacked packets remaining
-                                new_timeout = rtt_end - rtt_start[prev_base]
-                                my_timer.restart(self.est_timeout(new_timeout))
-
-                            self.N += 1
-
-                        elif recv_pkt.ack_num == base:
-                            dupl_cnt += 1
-                        # received 3 duplicate ACKs
-                        if dupl_cnt >= 3:
-                            dupl_cnt = 0
-                            self.N = ceil(self.N / 2)
-                            self.resend_lost(window, base)
-                            rtt_start[base] = time()
-                            my_timer.restart()
-
-                sleep(0.0001)
-
-        end = time()
-        my_timer.kill()
-        my_timer.join()
-
-        with open("window_size.csv", 'w+', newline='') as win_csv:
-            writer = csv.writer(win_csv, delimiter=',')
-            writer.writerow(window_list)
-
-        with open("rtt_times.csv", 'w+', newline='') as rtt_csv:
-            writer = csv.writer(rtt_csv, delimiter=',')
-            writer.writerow(rtt_list)
-
-        self.N = 1                          #reset window size
-        self.est_rtt = 0.1                  # reset estimated rtt
-        self.dev_rtt = 0                    # reset deviation
-        self.server_socket.settimeout(5)    # reset timeout value
-        print("Server: Time to send image:", end - start)
-
-    def recv_img(self, filename):
+        if (self.crpt_data_rate > 0 or self.pkt_loss_rate > 0):
+            self.gen_err_flag()
+        if self.crpt_data_rate > 0 and self.err_flag <= self.crpt_data_rate:
+            # corrupt 1 byte of the sent packet
+            return b"".join([packed[0:1023], b"\x00"])
+        elif self.pkt_loss_rate > 0 and self.err_flag <= self.pkt_loss_rate:
+            return None     # dont send anything
+        return packed
+
+    def stop(self):
+        """ Stops the server from another thread """
+        with self.wake_lock:
+            self.stopped = True
+            if self.wake_send is not None:  # None once the loop has closed the pair
+                self.wake_send.send(b'\x00')
+
+    def stats(self):
+        """ Counters of the server, summed across servers sharing a port """
+        return {'connections': self.connections,
+                'downloads': self.downloads,
+                'uploads': self.uploads,
+                'bytes_sent': self.bytes_sent,
+                'retransmits': self.retransmits,
+                'spurious_timeouts': self.spurious_timeouts}
+
+    def recv_burst(self, max_burst=64):
         """
-        Receive an image packet by packet
-        Saves image to specified file
+        Takes the packets already queued on the socket
 
         Parameters:
-          filename - file location to save image
+          max_burst - most packets returned at once
+
+        Returns a list of (packet, client address, kernel arrival time or None)
         """
-        recv_data = b''             # packet of byte string data
-        save_data = b''             # data to be saved to file
-        img_not_recvd = True        # flag to indicate if image data hasn't started yet
-        exp_seq = 0                 # expected sequence number initially 0
-        chunks = {}                 # init dictionary of received data chunks
-        pkt = Packet()
-
-        # get image data from server until all data received
-        while True:
+        max_burst = min(max_burst, self.ring.n_slots)  # more would refill slots still in the burst
+        burst = []
+        while len(burst) < max_burst:
             try:
-                if img_not_recvd:
-                    print("Server: Ready to receive image", flush=True)
-
-                recv_data = self.server_socket.recv(self.pkt_size)
-
-                pkt.pkt_unpack(recv_data)
-                if pkt.seq_num < exp_seq or pkt.csum != pkt.checksum():
-                    pass
-                elif pkt.seq_num > exp_seq:
-                    if pkt.seq_num not in chunks.keys():
-                        chunks[pkt.seq_num] = pkt.data
-                else:
-                    chunks[pkt.seq_num] = pkt.data
-                    # increment expected sequence to highest received data
-                    exp_seq += len(pkt.data)
-                    while exp_seq in chunks.keys():
-                        exp_seq += len(chunks[exp_seq])
-
-                ack = Packet(src=self.server_port,
-                             dst=self.client_port,
-                             seq_num=0,
-                             ack_num=exp_seq,
-                             data=b'',
-                             ctrl_bits=0x10)
-
-                ack_pack = ack.pkt_pack()
-                self.server_socket.sendto(ack_pack, self.client_addr)
-
-                if img_not_recvd:
-                    img_not_recvd = False       # img data began streaming if it reaches this point
-
-            except socket.timeout:
-                # if image not recieved yet, keep waiting
-                if img_not_recvd:
-                    pass
-                # image has been recieved
-                else:
-                    break   # exit loop
-
-        for chunk in sorted(chunks.keys()):
-            save_data += chunks[chunk]
-        # write data into a file
-        with open(filename, 'wb+') as server_img:
-            server_img.write(save_data)
-        print("Server: Received and saved image", flush=True)
+                recv_data, client_addr = self.ring.recvfrom()
+            except socket.error:
+                break
+            burst.append((recv_data, client_addr, self.ring.stamp))
+        return burst
+
+    def handle(self, recv_data, client_addr, pkt_ok, now, arrived=None):
+        """ Passes a packet to the connection of its client, SYNs open new connections """
+        conn = self.conns.get(client_addr)
+        pkt = PacketView(recv_data)
+        if conn is not None:
+            conn.datagram(pkt, pkt_ok, now, arrived)
+            return conn
+        if not pkt_ok:
+            return None
+        if pkt.get_syn_bit():
+            print("Server: Client request: Pls let me connect", client_addr, flush=True)
+            print("Server: Establishing Connection...")
+            conn = Connection(self, client_addr, pkt.src)
+            self.conns[client_addr] = conn
+            self.connections += 1
+            conn.syn_ack(pkt, now)              # ack bit = 1, syn bit = 1
+            return conn
+
+        print("Server: Connection not established yet")
+        # send NAK
+        ack = Packet(self.server_port, pkt.src,
+                     0, 0,
+                     b'', 0x10)
+        try:
+            self.server_socket.sendto(ack.pkt_pack(), client_addr)
+        except BlockingIOError:
+            pass
+        return None
 
     def run(self):
         """
         Runs when Server process has started
+
+        Every client is served from the one socket: the loop sleeps until
+        packets arrive or the earliest connection deadline, hands each packet
+        to the connection of its address, then lets every connection that
+        moved send what its window allows
         """
         print("Server: Started")
+        print("Server: Ready", flush=True)
+        sel = selectors.DefaultSelector()
+        sel.register(self.server_socket, selectors.EVENT_READ)
+        sel.register(self.wake_recv, selectors.EVENT_READ)
         i = 0       # index of timeouts
+        served = False
 
         while True:
-            try:
-                print("Server: Ready", flush=True)
-                # get request and address from client
-                msg = b''           # set message to empty string
-                recv_data = b''     # set received data to empty string
-                msg_pkt = Packet()  # init empty packet
-                (recv_data, self.client_addr) = self.server_socket.recvfrom(self.pkt_size)
-                i = 0   # reset timeout index
-                msg_pkt.pkt_unpack(recv_data)
-
-                if msg_pkt.get_syn_bit():
-                    print("Server: Client request: Pls let me connect", flush=True)
-                else:
-                    msg = msg_pkt.data.decode()
-                    print("Server: Client request:", msg, flush=True)
+            deadline = self.timers.next_deadline()
+            if deadline is not None:
+                events = sel.select(max(0, deadline - time()))
+            else:
+                events = sel.select(5)
+            if self.stopped:
+                break
 
-            except socket.timeout:
+            now = time()
+            if events:
+                i = 0   # reset timeout index
+                touched = set()
+                while True:
+                    burst = self.recv_burst()
+                    if not burst:
+                        break
+                    good = verify_batch([recv_data for recv_data, client_addr, arrived in burst])
+                    for (recv_data, client_addr, arrived), pkt_ok in zip(burst, good):
+                        conn = self.handle(recv_data, client_addr, pkt_ok, now, arrived)
+                        if conn is not None:
+                            touched.add(conn)
+                for conn in touched:
+                    conn.pump(now)
+                    conn.rearm()
+            elif deadline is None:
                 i = i + 1
-                if(i < 6):
-                    pass
                 # if the server has waited through 6 timeouts (30 seconds), exit
-                else:
+                if i >= 6:
                     print("Server: I'm tired of waiting", flush=True)
                     break
-            if self.conn_est:
-                # if any message recieved, then service it
-                # ------------------ Send image to client ------------------
-                if msg == "download":
-                    ack = Packet(self.server_port, self.client_port,
-                                0, msg_pkt.ack_num + 1,
-                                b'', 0x10)
-                    ack_pack = ack.pkt_pack()
-                    self.server_socket.sendto(ack_pack, self.client_addr)
-
-                    # break
-                    self.send_img(self.img_to_send)
-
-                # ------------------ Get image from client ------------------
-                elif msg == "upload":
-                    ack = Packet(self.server_port, self.client_port,
-                                0, msg_pkt.ack_num + 1,
-                                b'', 0x10)
-                    ack_pack = ack.pkt_pack()
-                    self.server_socket.sendto(ack_pack, self.client_addr)
-
-                    self.recv_img(self.img_save_to)
-
-                # ------------------ Exit server process ------------------
-                elif msg == "exit":
-                    ack = Packet(self.server_port, self.client_port,
-                                0, msg_pkt.ack_num + 1,
-                                b'', 0x10)
-                    ack_pack = ack.pkt_pack()
-                    self.server_socket.sendto(ack_pack, self.client_addr)
-                    # send FIN packet
-                    fin = Packet(self.server_port, self.client_port, 0, 0, b'', 0x01)
-                    fin_pack = fin.pkt_pack()
-                    self.server_socket.sendto(fin_pack, self.client_addr)
-
-                    fin_ack = Packet()
-                    recv_data = self.server_socket.recv(self.pkt_size)
-                    fin_ack.pkt_unpack(recv_data)
-
-                    if fin_ack.get_ack_bit:
-                        print("Server: Connection closed")
-                        print("Server: Exiting...")
-                        break
-                    else:
-                        print("Server: Connection teardown failed")
-
-                # ------------------ Handle invalid request ------------------
-                else:
-                    # send NAK
-                    ack = Packet(self.server_port, self.client_port,
-                                0, 0,
-                                b'', 0x10)
-                    ack_pack = ack.pkt_pack()
-                    self.server_socket.sendto(ack_pack, self.client_addr)
-
-                    print("Server: Received invalid request:", msg_pkt)
-                    # break
-            elif msg_pkt.get_syn_bit and not self.conn_est:
-                print("Server: Establishing Connection...")
-                self.est_connection(msg_pkt)
-            else:
-                print("Server: Connection not established yet")
-                # send NAK
-                ack = Packet(self.server_port, self.client_port,
-                             0, 0,
-                             b'', 0x10)
-                ack_pack = ack.pkt_pack()
-                self.server_socket.sendto(ack_pack, self.client_addr)
 
+            for timer in self.timers.expired(now):
+                timer.callback(now)     # Connection.expire, only the connections that are due
+
+            if self.conns:
+                served = True
+            elif served and not self.serve_forever:
+                print("Server: Exiting...")
+                break
 
         # close socket when finished
+        for conn in list(self.conns.values()):
+            conn.close()
+        sel.close()
         self.server_socket.close()
+        with self.wake_lock:
+            self.wake_recv.close()
+            self.wake_send.close()
+            self.wake_send = None
@@ -1,43 +1,91 @@
-from threading import Thread
-from time import time, sleep
-import sys
+# This file contains the deadline heap an event loop sleeps on, in place of a
+# timer thread polling the clock for every transfer
+import heapq
+import itertools
 
-class Timer(Thread):
+
+class TimerHandle():
+    """
+    One deadline kept by a DeadlineHeap, moved with DeadlineHeap.reschedule
+    and stopped with cancel()
+    """
+    __slots__ = ('deadline', 'callback', 'cancelled', 'version')
+
+    def __init__(self, deadline, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+        self.version = 0        # heap entries of older versions are stale
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class DeadlineHeap():
+    """
+    Deadlines of every timer of every connection of an event loop
+    (retransmission and pacing, connection and idle timeouts) in one heap:
+    the loop sleeps until next_deadline() and services only the handles
+    expired() returns, instead of scanning every connection on every wakeup
+
+    Deadlines are absolute times of the loop's own clock. Pushing a
+    deadline back, as every ACK does to the retransmission timer, only
+    updates the handle: its heap entry is moved when it comes up, so there
+    is no heap churn.
+    """
     def __init__(self):
-        Thread.__init__(self)
-        self.__time_limit = 0
-        self.__stop = False
-        self.__kill = False
-        self.__exc = False
-
-    def set_time(self, time_limit):
-        self.__time_limit = time_limit
-
-    def stop(self):
-        self.__stop = True
-    
-    def restart(self, time_limit=None):
-        self.__stop = False
-        if time_limit != None:
-            self.__time_limit = time_limit
-        self.__exc = False
-        self.start_time = time()
-
-    def get_exception(self):
-        return self.__exc
-    
-    def kill(self):
-        self.__kill = True
-
-    def run(self):
-        self.start_time = time()
-        while not self.__kill:
-            if not self.__stop:
-                elapsed = time() - self.start_time
-                if elapsed >= self.__time_limit:
-                    self.__stop = True
-                    self.__exc = True
+        self.heap = []
+        self.count = itertools.count()      # tie breaker for equal deadlines
+
+    def schedule(self, deadline, callback):
+        """
+        Keeps a deadline for callback, None for one that is stopped until rescheduled
+
+        Returns a TimerHandle to reschedule or cancel it
+        """
+        handle = TimerHandle(deadline, callback)
+        if deadline is None:
+            handle.cancel()
+        else:
+            heapq.heappush(self.heap, (deadline, next(self.count), handle.version, handle))
+        return handle
+
+    def reschedule(self, handle, deadline):
+        """ Moves a deadline, restarting it if it fired or was cancelled, None stops it """
+        if deadline is None:
+            handle.cancel()
+        elif handle.cancelled or deadline < handle.deadline:
+            handle.cancelled = False
+            handle.version += 1
+            handle.deadline = deadline
+            heapq.heappush(self.heap, (deadline, next(self.count), handle.version, handle))
+        else:
+            handle.deadline = deadline  # later, picked up when its entry comes up
+
+    def next_deadline(self):
+        """ Earliest deadline, None if every handle is stopped """
+        heap = self.heap
+        while heap:
+            deadline, count, version, handle = heap[0]
+            if handle.cancelled or version != handle.version:
+                heapq.heappop(heap)             # stale entry
+            elif handle.deadline > deadline:
+                heapq.heapreplace(heap, (handle.deadline, next(self.count), version, handle))  # pushed back
             else:
-                pass    # timer stopped, do nothing
+                return deadline
+        return None
+
+    def expired(self, now):
+        """ Stops and returns every handle whose deadline has passed, earliest first """
+        due = []
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > now:
+                return due
+            handle = heapq.heappop(self.heap)[3]
+            handle.cancelled = True     # fired, a reschedule starts it again
+            due.append(handle)
 
-            sleep(0.0001)   # needed to allow other threads to run
+    def pending(self):
+        """ Number of heap entries, including stale ones not yet dropped """
+        return len(self.heap)
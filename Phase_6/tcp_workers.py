@@ -0,0 +1,118 @@
+# This file launches the server as several worker processes sharing one UDP port
+# with SO_REUSEPORT, the kernel hashes each client to one of the workers
+import multiprocessing
+
+from tcp_server import Server, data_size
+from file_cache import FileCache
+
+STATS_FIELDS = ('connections', 'downloads', 'uploads', 'bytes_sent', 'retransmits', 'spurious_timeouts')
+
+
+def serve(worker, server_args, file_cache, ready, stop, stats):
+    """
+    Runs one Server in a worker process until stop is set
+
+    Parameters:
+      worker      - index of the worker
+      server_args - keyword arguments of the Server
+      file_cache  - FileCache filled before the fork
+      ready       - queue the worker index is put on once the port is bound
+      stop        - event that stops the worker
+      stats       - shared array the counters of every worker are copied into
+    """
+    server = Server(**server_args, reuse_port=True, serve_forever=True, file_cache=file_cache)
+    server.start()
+    ready.put(worker)
+    offset = worker * len(STATS_FIELDS)
+    while True:
+        stopped = stop.wait(0.05)
+        counters = server.stats()
+        for i, field in enumerate(STATS_FIELDS):
+            stats[offset + i] = counters[field]
+        if stopped:
+            break
+    server.stop()
+    server.join()
+
+
+class ServerPool():
+    """
+    Server processes bound to one port with SO_REUSEPORT
+
+    The files to send are split into the cache before the workers are
+    forked, so every worker sends from the same copy-on-write pages and
+    none of them writes to the segment data
+    """
+    def __init__(self, n_workers, crpt_data=0, data_loss=0, port=20001,
+                 files=('hello.jpg',), cache_size=64*1024*1024, **kwargs):
+        """
+        Parameters:
+          n_workers  - number of server processes
+          crpt_data  - data packet corruption rate in percent
+          data_loss  - data packet loss rate in percent
+          port       - port every worker binds
+          files      - files put in the cache before forking
+          cache_size - bytes of files kept ready to send
+          kwargs     - other keyword arguments of the Server, export is off unless
+                       given: workers share the working directory and would
+                       overwrite each other's CSV files
+        """
+        ctx = multiprocessing.get_context('fork')
+        self.file_cache = FileCache(data_size, cache_size)
+        for filename in files:
+            self.file_cache.get(filename)
+
+        self.ready = ctx.Queue()
+        self.stop_event = ctx.Event()
+        self.counters = ctx.Array('q', n_workers * len(STATS_FIELDS), lock=False)
+        server_args = dict(crpt_data=crpt_data, data_loss=data_loss, port=port, export=False)
+        server_args.update(kwargs)
+        self.workers = [ctx.Process(target=serve,
+                                    args=(i, server_args, self.file_cache,
+                                          self.ready, self.stop_event, self.counters),
+                                    daemon=True)
+                        for i in range(n_workers)]
+
+    def start(self):
+        """ Forks the workers, returns once all of them are bound """
+        for worker in self.workers:
+            worker.start()
+        for _ in self.workers:
+            self.ready.get()
+
+    def stats(self, per_worker=False):
+        """
+        Counters summed across the workers, refreshed every 50 ms
+
+        Parameters:
+          per_worker - return a list with the counters of each worker instead
+        """
+        n = len(STATS_FIELDS)
+        workers = [dict(zip(STATS_FIELDS, self.counters[i*n:(i+1)*n])) for i in range(len(self.workers))]
+        if per_worker:
+            return workers
+        return {field: sum(worker[field] for worker in workers) for field in STATS_FIELDS}
+
+    def stop(self):
+        """ Stops every worker, returns the final counters """
+        self.stop_event.set()
+        for worker in self.workers:
+            worker.join()
+        return self.stats()
+
+
+if __name__ == "__main__":
+    crpt_data = input("Input percentage of data corruption: ")
+    data_loss = input("Input percentage of data packet loss: ")
+    n_workers = input("Input number of workers: ")
+
+    pool = ServerPool(int(n_workers), int(crpt_data), int(data_loss))
+    pool.start()
+    try:
+        input("Serving, press Enter to stop\n")
+    except KeyboardInterrupt:
+        pass
+    total = pool.stop()
+    for i, worker in enumerate(pool.stats(per_worker=True)):
+        print("Worker", i, worker)
+    print("Total", total)
@@ -0,0 +1,855 @@
+# This file contains the sliding window sender and receiver state, without any socket I/O:
+# the caller feeds them packets and timer expiries and sends the packets they hand back
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from math import ceil
+from PacketHandler import Packet, patch_header, ts_option, SACK_MAX_BLOCKS
+from congestion import congestion_control, DeliveryRate
+
+DUP_THRESH = 3      # segments sacked above a hole before it is taken as lost
+MIN_PTO = 0.002     # tail loss probe timeout never drops below this, in seconds
+INIT_TIMEOUT = 1    # retransmission timeout before an rtt is measured (RFC 6298), in seconds
+MIN_TIMEOUT = 0.01  # retransmission timeout never drops below this, in seconds
+MAX_TIMEOUT = 60    # retransmission timeout backs off up to this, in seconds
+TS_HZ = 1000000     # ticks per second of the timestamps option clock
+PACING_QUANTUM = 0.001  # paced packets owed for up to this long go out together, in seconds
+RECV_BUFFER = 64 * 1024             # reassembly buffer a receiver starts with, in bytes
+MAX_RECV_BUFFER = 16 * 1024 * 1024  # most the reassembly buffer is autotuned to, in bytes
+WSCALE = max(0, MAX_RECV_BUFFER.bit_length() - 16)  # window scale a receiver asks for in the handshake
+
+
+def ts_clock(now):
+    """ Timestamps option value of a time in seconds: microseconds modulo 2**32 """
+    return int(now * TS_HZ) & 0xFFFFFFFF
+
+
+def ts_after(a, b):
+    """ True if timestamp a is not older than b, across wraparound """
+    return (a - b) & 0xFFFFFFFF < 0x80000000
+
+
+class RangeSet():
+    """
+    Sorted, disjoint [start, end) byte ranges, touching ranges are merged
+    """
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+    def add(self, start, end):
+        """ Adds [start, end), returns the sub-ranges that were not in the set yet """
+        new = []
+        i = bisect_left(self.ends, start)       # first range reaching start
+        j = i
+        lo, hi, cur = start, end, start
+        while j < len(self.starts) and self.starts[j] <= end:
+            if self.starts[j] > cur:
+                new.append((cur, self.starts[j]))
+            cur = max(cur, self.ends[j])
+            lo = min(lo, self.starts[j])
+            hi = max(hi, self.ends[j])
+            j += 1
+        if cur < end:
+            new.append((cur, end))
+        self.starts[i:j] = [lo]
+        self.ends[i:j] = [hi]
+        return new
+
+    def find(self, seq):
+        """ Returns the range holding seq, None if there is none """
+        i = bisect_right(self.starts, seq) - 1
+        if i >= 0 and seq < self.ends[i]:
+            return self.starts[i], self.ends[i]
+        return None
+
+    def trim(self, below):
+        """ Drops everything below 'below' """
+        i = bisect_right(self.ends, below)
+        del self.starts[:i]
+        del self.ends[:i]
+        if self.starts and self.starts[0] < below:
+            self.starts[0] = below
+
+
+class SendWindow():
+    """
+    Sender side of one transfer, with NewReno fast recovery and the window
+    size set by a congestion control algorithm
+
+    segments - segments of the file to send (see file_cache)
+    src, dst - ports stamped into every packet
+    sack     - repair every hole the SACK blocks of the receiver show, else
+               only base is resent after 3 duplicate ACKs
+    rack     - with sack, take holes as lost by the time they were sent
+               and probe the tail of the window (RACK-TLP), else a hole
+               waits for DUP_THRESH segments sacked above it
+    cc       - congestion control algorithm, a name in congestion.ALGORITHMS
+               or an instance
+    pacing   - space new packets at the rate the algorithm sets from a
+               DeliveryRate model and hold the packets in flight to the
+               model, else send them as soon as the window opens
+    wscale   - window scale of the receiver from the handshake, 0 if either
+               side didn't send the option
+    timestamps - send the timestamps option, both sides sent it in the
+               handshake
+    rtt      - rtt measured in the handshake, None if there is none
+
+    The retransmission timeout follows RFC 6298: the first rtt sample sets
+    the smoothed rtt, later ones move it and its variation. With timestamps
+    every ACK that moves base is timed by the echo of the segment that
+    moved it, resent or not, and the gains are divided by the samples
+    expected per rtt (RFC 7323). Without them only segments sent once are
+    timed (Karn)
+
+    RACK (RFC 8985) takes a hole as lost once a segment sent after it was
+    delivered and the hole has been out for the rtt of that segment plus
+    a reordering window of a quarter of the lowest rtt, so a small window
+    or a lost retransmission needs no duplicate ACKs and no timeout. When
+    no ACK comes for two rtts the timer sends a tail loss probe instead of
+    expiring, and the ACK of the probe shows the holes at the tail. With
+    fewer than 4 segments out and none to add, fewer duplicate ACKs start
+    fast retransmit (early retransmit, RFC 5827)
+
+    A retransmission timeout that a late ACK, not a loss, set off is undone:
+    the window goes back to what it was when the timer expired once the
+    first ACK after it echoes a segment sent before the retransmission
+    (Eifel, RFC 3522), or once the receiver has reported every segment
+    resent since as a duplicate (DSACK, RFC 2883)
+
+    New data is sent up to the right edge of the window the receiver
+    advertises, when the window is closed with nothing in flight the timer
+    sends zero window probes instead
+
+    The last segment carries the FIN bit, so the receiver knows where the
+    data ends and the transfer is over once that segment is acked
+    """
+    def __init__(self, segments, src, dst, sack=True, cc='reno', pacing=False, wscale=0,
+                 timestamps=False, rtt=None, rack=True):
+        self.segments = iter(segments)
+        self.upcoming = next(self.segments, None)   # next segment, looked ahead to find the last
+        self.src = src
+        self.dst = dst
+        self.more_data = self.upcoming is not None  # False once every segment has been taken
+        self.fin_seq = None         # seq of the last segment, None until it is taken
+        self.window = OrderedDict() # unacked segments in seq order
+        self.rtt_start = {}         # send time of each unacked segment
+        self.xmit_at = {}           # time each undelivered segment was last sent, resent or not
+        self.seq_num = 0            # seq of the next new segment
+        self.base = 0               # first unacked seq
+        self.dupl_cnt = 0           # count of duplicate acks
+        self.cc = congestion_control(cc)
+        self.est_rtt = None         # smoothed rtt, None until the first sample
+        self.dev_rtt = 0            # deviation in rtt for timeout
+        self.timeout = INIT_TIMEOUT # retransmission timeout
+        self.sample_rtt = 0         # last rtt measured
+        self.rtt_samples = []       # every rtt measured from an ACK, for export
+        self.read_samples = []      # the same rtts timed when the ACK was read, apart from now with kernel stamps
+        self.resent = 0             # packets sent again
+        self.timeouts = 0           # retransmission timer expiries
+        self.spurious = 0           # timeouts found spurious and undone
+        self.dsacks = 0             # duplicate segments the receiver reported
+        self.prior = None           # (N, ssthresh) when the timer last expired, None once it can't be undone
+        self.rto_ts = None          # TSval of the retransmission, None once the ACK after it came
+        self.undo_retrans = {}      # seq -> copies resent since the timeout not yet reported as duplicates
+        self.deadline = None        # when the timer fires, None if stopped
+        self.timer = 'rto'          # what the timer is for: 'rto', 'tlp' or 'reorder'
+        self.sack = sack
+        self.newreno = self.cc.newreno
+        self.sacked = RangeSet()    # scoreboard: bytes above base the receiver holds
+        self.sacked_segs = set()    # seqs of the sacked segments still in window
+        self.rexmit = set()         # holes resent since the last timeout
+        self.recover = None         # seq_num when recovery began, None if not recovering
+        self.recovery = None        # 'fast', 'sack' or 'rto': how the recovery began
+        self.rack = rack and sack
+        self.rack_xmit = None       # send time of the last sent segment delivered, None before one
+        self.rack_end = 0           # end seq of that segment
+        self.rack_rtt = 0           # rtt of that segment
+        self.min_rtt = rtt          # lowest rtt measured, None until one is
+        self.fack = 0               # highest seq acked or sacked
+        self.reordering = False     # a segment sent once was delivered below fack
+        self.tlp_end = None         # seq_num when the tail loss probe was sent, None if none is out
+        self.tlp_retrans = False    # the probe resent a segment rather than a new one
+        self.tlp_ts = 0             # TSval of the probe
+        self.tlps = 0               # tail loss probes sent
+        self.mss = 0                # largest segment sent
+        self.rate = DeliveryRate() if pacing else None  # path model, None without pacing
+        self.tx_state = {}          # model state each undelivered packet was sent with
+        self.next_send = 0          # when the next paced packet may leave
+        self.wscale = wscale
+        self.rwin = None            # receive window in bytes, None until the first ACK
+        self.probes = 0             # zero window probes sent since the window last opened
+        self.rwin_limited = False   # the receive window, not N, held back the last send
+        self.timestamps = timestamps
+        self.ts_recent = 0          # TSval of the receiver, echoed in every segment
+        if rtt is not None:
+            self.sample_rtt = rtt
+            self.timeout = self.est_timeout(rtt)
+
+    @property
+    def N(self):
+        """ Congestion window in packets, kept by the algorithm """
+        return self.cc.N
+
+    @N.setter
+    def N(self, N):
+        self.cc.N = N
+
+    def done(self):
+        return not self.more_data and len(self.window) == 0
+
+    def flight(self):
+        """ Packets sent and neither acked nor sacked """
+        return len(self.window) - len(self.sacked_segs)
+
+    def rwin_open(self):
+        """ False if the next segment would pass the right edge of the receive window """
+        return self.rwin is None or self.seq_num + self.mss <= self.base + self.rwin
+
+    def room(self):
+        """ True if a new segment may be sent now, pacing aside """
+        return self.more_data and self.flight() < self.cwnd() and self.rwin_open()
+
+    def est_timeout(self, sample_rtt, samples=1):
+        """
+        Adds an rtt sample, returns the retransmission timeout
+
+        Parameters:
+          sample_rtt - rtt measured
+          samples    - samples expected per rtt
+        """
+        if self.est_rtt is None:
+            self.est_rtt = sample_rtt
+            self.dev_rtt = sample_rtt / 2
+        else:
+            a = 0.125 / samples
+            B = 0.25 / samples
+            self.dev_rtt = ((1-B)*self.dev_rtt) + (B*abs(sample_rtt - self.est_rtt))
+            self.est_rtt = ((1-a)*self.est_rtt) + (a*sample_rtt)
+
+        timeout = self.est_rtt + max(1 / TS_HZ, 4*self.dev_rtt)
+        return min(max(timeout, MIN_TIMEOUT), MAX_TIMEOUT)
+
+    def new_packets(self, now, limit=None):
+        """
+        Takes as many new segments as the window has room for
+
+        Parameters:
+          now   - current time
+          limit - most packets returned
+
+        Returns the packed packets to send
+        """
+        packets = []
+        if self.rate is not None:
+            self.next_send = max(self.next_send, now - PACING_QUANTUM)
+        cwnd = self.cwnd()
+        while self.flight() < cwnd and self.more_data and self.rwin_open():
+            if limit is not None and len(packets) >= limit:
+                break
+            if self.rate is not None and self.next_send > now:
+                break   # paced, the next one isn't due yet
+            packets.append(self.take(now))
+        self.rwin_limited = self.more_data and not self.rwin_open()
+        if self.rwin_limited and not self.window and self.deadline is None:
+            self.deadline = now + self.probe_timeout()  # persist timer
+        return packets
+
+    def take(self, now):
+        """ Adds the next new segment to the window, returns its packed packet """
+        send_pkt = self.upcoming
+        self.upcoming = next(self.segments, None)
+        if self.upcoming is None:   # no more data to be sent
+            self.more_data = False
+            self.fin_seq = send_pkt.seq_num
+        if self.rate is not None:
+            self.tx_state[send_pkt.seq_num] = self.rate.on_send(now, self.flight())
+            self.next_send += 1 / self.pacing_rate()
+        self.window[send_pkt.seq_num] = send_pkt
+        packed = self.pack(send_pkt, now)
+        self.rtt_start[send_pkt.seq_num] = now
+        self.xmit_at[send_pkt.seq_num] = now
+        self.mss = max(self.mss, send_pkt.length)
+        if self.base == self.seq_num:
+            self.arm(now)   # start timer
+        self.seq_num += send_pkt.length
+        return packed
+
+    def options(self, now):
+        """ Options of a segment sent now """
+        if self.timestamps:
+            return ts_option(ts_clock(now), self.ts_recent)
+        return b''
+
+    def pack(self, segment, now):
+        """ Packs a segment, the last one with the FIN bit set """
+        packed = segment.pack(self.src, self.dst, self.options(now))
+        if segment.seq_num == self.fin_seq:
+            packed = patch_header(bytearray(packed), ctrl_bits=0x01)
+        return packed
+
+    def resend(self, seq, now):
+        """ Returns the packet of an unacked segment and restarts the timer """
+        self.rtt_start.pop(seq, None)   # its ACK can't tell which copy arrived (Karn)
+        self.xmit_at[seq] = now
+        if self.prior is not None:
+            self.undo_retrans[seq] = self.undo_retrans.get(seq, 0) + 1
+        if self.rate is not None:
+            self.tx_state[seq] = self.rate.on_send(now, self.flight())
+        self.timer = 'rto'
+        self.deadline = now + self.timeout
+        self.resent += 1
+        return self.pack(self.window[seq], now)
+
+    def pacing_rate(self):
+        """ Packets per second new packets are paced at """
+        return self.cc.pacing_rate(self.rate, self.est_rtt or self.timeout)
+
+    def cwnd(self):
+        """ Packets that may be in flight: N, held to the path model when pacing """
+        if self.rate is not None:
+            cap = self.rate.inflight_cap()
+            if cap is not None:
+                return min(self.N, cap)
+        return self.N
+
+    def tlp_timeout(self):
+        """ Tail loss probe timeout: two smoothed rtts, no longer than the retransmission timeout """
+        return min(max(2 * self.est_rtt, MIN_PTO), self.timeout)
+
+    def arm(self, now):
+        """
+        Restarts the timer of the segments in flight: a tail loss probe if
+        none is out and there is no recovery going on, else the
+        retransmission timer
+        """
+        if self.rack and self.recover is None and self.tlp_end is None and self.est_rtt is not None:
+            self.timer = 'tlp'
+            self.deadline = now + self.tlp_timeout()
+        else:
+            self.timer = 'rto'
+            self.deadline = now + self.timeout
+
+    def probe_timeout(self):
+        """ Persist timer, backed off like the retransmission timer """
+        return min(self.timeout * 2 ** self.probes, MAX_TIMEOUT)
+
+    def probe(self, now):
+        """ Returns a zero window probe, the receiver ACKs it with its window """
+        self.probes += 1
+        self.deadline = now + self.probe_timeout()
+        return [Packet(self.src, self.dst, self.seq_num, 0, b'', 0x00, self.options(now)).pkt_pack()]
+
+    def wakeup(self):
+        """ Next time the sender has to act without an ACK, None if only an ACK moves it on """
+        if self.rate is not None and self.room():
+            if self.deadline is None:
+                return self.next_send
+            return min(self.deadline, self.next_send)
+        return self.deadline
+
+    def enter_recovery(self, recovery, now):
+        """ Shrinks the window once for a loss event """
+        self.recover = self.seq_num
+        self.recovery = recovery
+        self.tlp_end = None         # a probe out found this loss, no second shrink for it
+        self.prior = None           # a loss, the window is shrunk for good
+        self.cc.on_loss(self.flight(), now)
+
+    def on_timeout(self, now):
+        """
+        Timer expired: send the tail loss probe or resend the holes past the
+        reordering window, else shrink the window and resend base
+
+        Returns the packets to resend
+        """
+        if not self.window and self.more_data and not self.rwin_open():
+            return self.probe(now)  # persist timer
+        if self.base not in self.window:
+            self.deadline = None
+            return []
+        if self.timer == 'tlp':
+            return self.tail_probe(now)
+        if self.timer == 'reorder':
+            return self.detect_loss(now)
+        self.timeouts += 1
+        if self.prior is None or self.recovery != 'rto':  # not the same timeout backed off
+            self.prior = (self.N, self.cc.ssthresh)
+            self.rto_ts = ts_clock(now) if self.timestamps else None
+            self.undo_retrans = {}
+        self.timeout = min(self.timeout * 2, MAX_TIMEOUT)  # back off until an rtt is measured
+        if self.newreno:
+            self.recover = self.seq_num
+            self.recovery = 'rto'
+        self.tlp_end = None
+        self.cc.on_rto(self.flight(), now)
+        self.rexmit.clear()         # resent holes may be lost again
+        self.rexmit.add(self.base)
+        return [self.resend(self.base, now)]
+
+    def tail_probe(self, now):
+        """
+        Tail loss probe: sends the next new segment if the receive window
+        takes it, else resends the last one, so that its ACK shows the
+        holes at the tail, and starts the retransmission timer
+
+        Returns the packets to send
+        """
+        self.tlps += 1
+        if self.more_data and self.rwin_open():
+            packets = [self.take(now)]
+            self.tlp_retrans = False
+        else:
+            seq = next(reversed(self.window))
+            self.rexmit.add(seq)
+            packets = [self.resend(seq, now)]
+            self.tlp_retrans = True
+        self.tlp_end = self.seq_num
+        self.tlp_ts = ts_clock(now)
+        self.timer = 'rto'
+        self.deadline = now + self.timeout
+        return packets
+
+    def delivered(self, seq, now):
+        """ Moves RACK to a segment just acked or sacked if it was sent after the last one """
+        sent = self.xmit_at.pop(seq, None)
+        if sent is None:
+            return      # sacked before
+        end = seq + self.window[seq].length
+        if seq not in self.rtt_start:   # resent
+            if now - sent < (self.min_rtt or 0):
+                return  # too soon for the copy resent last, an earlier one was delivered
+        elif end < self.fack:
+            self.reordering = True
+        if self.rack_xmit is None or sent > self.rack_xmit or (sent == self.rack_xmit and end > self.rack_end):
+            self.rack_xmit = sent
+            self.rack_end = end
+            self.rack_rtt = now - sent
+
+    def holes(self, below):
+        """ Seqs of the segments below a seq that are neither acked nor sacked """
+        seq = self.base
+        for start, end in list(self.sacked) + [(below, below)]:
+            while seq < min(start, below) and seq in self.window:
+                yield seq
+                seq += self.window[seq].length
+            if seq >= below:
+                return
+            seq = max(seq, end)
+
+    def reo_wnd(self):
+        """
+        RACK reordering window: a quarter of the lowest rtt, none in recovery
+        or with DUP_THRESH segments sacked until reordering has been seen
+        """
+        if self.min_rtt is None:
+            return 0
+        if not self.reordering and (self.recover is not None or len(self.sacked_segs) >= DUP_THRESH):
+            return 0
+        return min(self.min_rtt / 4, self.est_rtt)
+
+    def detect_loss(self, now):
+        """
+        RACK: resends every hole sent before the last segment delivered that
+        has been out for the rtt of that segment and the reordering window,
+        and sets the reordering timer for the holes that haven't yet. A
+        resent hole is timed from when it was resent, so a lost retransmission
+        is sent again
+
+        Returns the packets to resend
+        """
+        packets = []
+        wait = None
+        if self.rack_xmit is not None:
+            reo_wnd = self.reo_wnd()
+            for seq in list(self.holes(self.rack_end)):
+                sent = self.xmit_at[seq]
+                if sent > self.rack_xmit:
+                    continue    # sent after the segment delivered, too soon to tell
+                left = sent + self.rack_rtt + reo_wnd - now
+                if left > 0:
+                    wait = left if wait is None else max(wait, left)
+                else:
+                    self.rexmit.add(seq)
+                    packets.append(self.resend(seq, now))
+        if packets and self.recover is None:    # shrink once per loss event
+            self.enter_recovery('sack', now)
+        if wait is not None:
+            self.timer = 'reorder'
+            self.deadline = now + wait
+        elif self.timer == 'reorder':
+            self.arm(now)
+        return packets
+
+    def dup_thresh(self):
+        """
+        Duplicate ACKs, or segments sacked above a hole, that show a loss:
+        DUP_THRESH, one less than the segments out when there are fewer
+        and no new one may be sent (early retransmit)
+        """
+        if len(self.window) <= DUP_THRESH and not self.room():
+            return max(len(self.window) - 1, 1)
+        return DUP_THRESH
+
+    def undo(self):
+        """ The last timeout was spurious: back to the window from before it, out of its recovery """
+        self.spurious += 1
+        self.cc.on_undo(*self.prior)
+        self.prior = None
+        self.rto_ts = None
+        self.undo_retrans.clear()
+        if self.recovery == 'rto':
+            self.recover = None     # new data goes out rather than the window sent again
+            self.recovery = None
+
+    def on_dsack(self, blocks, ack_num):
+        """
+        Takes the DSACK block off the SACK blocks of an ACK: a first block
+        below the cumulative ACK or inside the second block reports a
+        duplicate segment (RFC 2883)
+
+        Only a duplicate of a segment resent since the timeout counts towards
+        undoing it, one resent earlier by fast retransmit or a probe says
+        nothing about the timeout (RFC 3708)
+
+        Returns the blocks left
+        """
+        left, right = blocks[0]
+        if right > ack_num and not (len(blocks) > 1 and blocks[1][0] <= left and right <= blocks[1][1]):
+            return blocks
+        self.dsacks += 1
+        if self.prior is not None and self.undo_retrans:
+            for seq in [seq for seq in self.undo_retrans if left <= seq < right]:
+                self.undo_retrans[seq] -= 1
+                if self.undo_retrans[seq] == 0:
+                    del self.undo_retrans[seq]
+                    if not self.undo_retrans:   # every segment resent since the timeout arrived twice
+                        self.undo()
+                        break
+        return blocks[1:]
+
+    def on_sack(self, blocks, now):
+        """ Adds the SACK blocks of an ACK to the scoreboard """
+        for left, right in blocks:
+            if right <= self.base or left >= self.seq_num:
+                continue    # stale or bogus block
+            for seq, end in self.sacked.add(max(left, self.base), min(right, self.seq_num)):
+                while seq < end and seq in self.window:
+                    self.sacked_segs.add(seq)
+                    self.delivered(seq, now)
+                    if self.rate is not None and seq in self.tx_state:
+                        self.rate.on_delivered(self.tx_state.pop(seq), now)
+                    seq += self.window[seq].length
+
+    def repair(self, now):
+        """
+        Resends every hole with at least dup_thresh segments sacked above it,
+        each hole once until the next timeout
+
+        Returns the packets to resend
+        """
+        packets = []
+        above = 0
+        thresh = self.dup_thresh() * self.mss
+        ranges = list(self.sacked)
+        for i in range(len(ranges) - 1, -1, -1):
+            above += ranges[i][1] - ranges[i][0]
+            if above < thresh:
+                continue
+            seq = ranges[i - 1][1] if i > 0 else self.base
+            end = ranges[i][0]
+            while seq < end and seq in self.window:
+                if seq not in self.rexmit:
+                    self.rexmit.add(seq)
+                    packets.append(self.resend(seq, now))
+                seq += self.window[seq].length
+        if packets and self.recover is None:    # shrink once per loss event
+            self.enter_recovery('sack', now)
+        return packets
+
+    def on_ack(self, ack_num, now, blocks=None, rwin=None, ts=None, read=None):
+        """
+        Processes a good ACK
+
+        Parameters:
+          ack_num - cumulative ACK
+          now     - current time, or when the kernel received the ACK
+          blocks  - SACK blocks the ACK carried
+          rwin    - receive window field of the ACK, None to keep the last
+          ts      - (TSval, TSecr) of the ACK, None if it had no timestamps
+          read    - time the loop read the ACK when now is its kernel stamp,
+                    None if now is that time
+
+        Returns the packets to resend
+        """
+        packets = []
+        if ts is not None and self.timestamps:
+            self.ts_recent = ts[0]
+        else:
+            ts = None
+        if blocks:
+            blocks = self.on_dsack(blocks, ack_num)
+        if rwin is not None and ack_num >= self.base:     # older ACKs carry stale windows
+            self.rwin = rwin << self.wscale
+            if self.rwin_open():
+                self.probes = 0
+                if not self.window:
+                    self.deadline = None    # window opened, stop probing
+        if ack_num > self.base:
+            self.dupl_cnt = 0                       # reset duplicate count
+            flight = self.flight()
+            samples = max(1, flight)                # one ACK per segment in flight
+            if ts is not None and ts[1]:            # 0 is an ACK of a segment without timestamps
+                rtt = ((ts_clock(now) - ts[1]) & 0xFFFFFFFF) / TS_HZ
+            else:
+                sent_at = self.rtt_start.get(self.base)     # not kept for resent segments
+                rtt = now - sent_at if sent_at is not None else None
+            if self.rto_ts is not None:             # first ACK since the timeout
+                if ts is not None and ts[1] and not ts_after(ts[1], self.rto_ts):
+                    self.undo()                     # it answers a segment sent before the retransmission
+                self.rto_ts = None
+            self.base = ack_num                     # increment base
+            acked = 0
+            while self.window:                      # remove acked segments from window
+                seq = next(iter(self.window))
+                if seq >= self.base:
+                    break
+                self.delivered(seq, now)
+                self.window.popitem(last=False)
+                self.rtt_start.pop(seq, None)
+                self.sacked_segs.discard(seq)
+                self.rexmit.discard(seq)
+                if self.rate is not None and seq in self.tx_state:
+                    self.rate.on_delivered(self.tx_state.pop(seq), now)
+                acked += 1
+            self.sacked.trim(self.base)
+            if self.rate is not None and rtt is not None:
+                self.rate.on_rtt(rtt, now)
+            if rtt is not None:                     # a new sample also undoes the backoff
+                self.sample_rtt = rtt
+                self.rtt_samples.append(rtt)
+                self.read_samples.append(rtt if read is None else rtt + read - now)
+                self.timeout = self.est_timeout(self.sample_rtt, samples)
+                if self.min_rtt is None or rtt < self.min_rtt:
+                    self.min_rtt = rtt
+
+            # N only grows while it is what limits the sender (RFC 7661), else
+            # a receive window opening at once would let out one huge burst
+            if (self.recover is None or not self.newreno or self.recovery == 'rto') and not self.rwin_limited:
+                self.cc.on_ack(acked, now, rtt)
+            if self.recover is not None and self.base >= self.recover:
+                if self.newreno and self.recovery == 'fast':
+                    self.N = self.cc.ssthresh       # deflate the window
+                self.recover = None                 # loss event repaired
+                self.recovery = None
+            if self.tlp_end is not None and self.base >= self.tlp_end:
+                # the resent probe repaired a loss, unless the ACK echoes a segment sent before it
+                if self.tlp_retrans and (ts is None or not ts[1] or ts_after(ts[1], self.tlp_ts)):
+                    self.cc.on_loss(flight, now)
+                self.tlp_end = None
+            if len(self.window) == 0:               # no unacked packets
+                self.deadline = None
+            else:                                   # unacked packets remaining
+                self.arm(now)
+            if self.recover is not None and self.newreno:
+                # partial ACK: the next hole is lost too
+                if self.recovery == 'fast':
+                    self.N = max(self.N - acked + 1, 1)
+                if self.base in self.window and self.base not in self.rexmit:
+                    self.rexmit.add(self.base)
+                    packets.append(self.resend(self.base, now))
+        elif ack_num == self.base and self.window:
+            self.dupl_cnt += 1
+            if self.recovery == 'fast':
+                self.N += 1         # a packet has left the network
+
+        if self.sack and blocks:
+            self.on_sack(blocks, now)
+        if self.rack:
+            self.fack = max(self.fack, self.base, self.sacked.ends[-1] if self.sacked else 0)
+            return packets + self.detect_loss(now)
+        if self.sack and blocks:
+            return packets + self.repair(now)
+
+        # received enough duplicate ACKs
+        if self.dupl_cnt >= self.dup_thresh() and self.base in self.window:
+            if not self.newreno:
+                self.dupl_cnt = 0
+                self.cc.on_loss(self.flight(), now)
+                packets.append(self.resend(self.base, now))
+            elif self.recover is None:              # fast retransmit
+                self.enter_recovery('fast', now)
+                self.N = self.cc.ssthresh + 3
+                self.rexmit.add(self.base)
+                packets.append(self.resend(self.base, now))
+        return packets
+
+
+class RecvWindow():
+    """
+    Receiver side of one transfer
+
+    Data is accepted into a reassembly buffer of buffer bytes from exp_seq
+    on, every ACK advertises what is free of it. The buffer is autotuned
+    like Linux does (DRS): the receiver times how long one window of data
+    takes to arrive, an upper bound of the rtt, and grows the buffer to
+    twice the data delivered in order per rtt, more while that is still
+    growing, so the sender is never held back by a window smaller than the
+    bandwidth-delay product
+
+    The segment with the FIN bit set is the last one, the transfer is
+    complete once every byte up to its end is in order. Its end is the size
+    of the file, which the writer reserves as soon as it is known
+
+    writer - SegmentWriter the data is placed into, or anything with its
+             write and preallocate
+    ack    - AckTemplate of the connection
+    resize - resize(packets) grows the socket receive buffer and returns how
+             many packets it holds, None if there is no socket to tune
+    wscale - window scale from the handshake, 0 if either side didn't send
+             the option
+
+    With timestamps every ACK echoes the TSval of the last segment that
+    reached exp_seq, so the sender times the segment that moved base
+
+    A segment received twice is reported once, as the first SACK block of
+    the next ACK (DSACK, RFC 2883), so the sender learns it resent it for
+    nothing
+    """
+    def __init__(self, writer, ack, resize=None, wscale=0):
+        self.writer = writer
+        self.ack = ack
+        self.exp_seq = 0        # expected sequence number initially 0
+        self.chunks = RangeSet()    # data received ahead of exp_seq
+        self.latest = None      # seq of the last chunk received ahead of exp_seq
+        self.dup = None         # (start, end) of a segment received twice, None once reported
+        self.fin = None         # seq the data ends at, None until the FIN arrives
+        self.ts_recent = None   # TSval echoed in ACKs, None until a segment has one
+        self.ts_val = 0         # TSval of the ACKs, time of the last segment
+        self.resize = resize
+        self.wscale = wscale
+        self.max_buffer = min(MAX_RECV_BUFFER, 0xFFFF << wscale)
+        self.buffer = min(RECV_BUFFER, self.max_buffer)    # reassembly buffer in bytes
+        self.held = 0           # bytes held ahead of exp_seq
+        self.edge = 0           # right edge of the window advertised, it never moves left
+        self.mss = 0            # largest segment received
+        self.overruns = 0       # packets dropped past the end of the buffer
+        self.rtt = None         # time a window of data takes to arrive
+        self.rtt_seq = None     # exp_seq the current rtt measurement ends at
+        self.rtt_time = 0       # when the current rtt measurement began
+        self.space = 0          # most bytes delivered in one rtt
+        self.space_seq = 0      # exp_seq when the current rtt of delivery began
+        self.space_time = None  # when the current rtt of delivery began
+
+    def receive(self, pkt, now):
+        """
+        Places the data of a good packet
+
+        Parameters:
+          pkt - PacketView of the packet
+          now - time it was received
+        """
+        seq_num = pkt.seq_num
+        data = pkt.data
+        self.mss = max(self.mss, len(data))
+        if pkt.get_fin_bit() and self.fin is None:
+            self.fin = seq_num + len(data)
+            if self.fin:
+                self.writer.preallocate(self.fin)   # the holes below it are filled in place
+        if self.ack.timestamps:
+            ts = pkt.timestamps()
+            # only segments reaching exp_seq are echoed, not ones above a hole (RFC 7323)
+            if ts is not None and seq_num <= self.exp_seq and \
+                    (self.ts_recent is None or ts_after(ts[0], self.ts_recent)):
+                self.ts_recent = ts[0]
+            self.ts_val = ts_clock(now)
+        if seq_num < self.exp_seq:
+            if data:
+                self.dup = (seq_num, min(seq_num + len(data), self.exp_seq))
+        elif seq_num + len(data) > self.exp_seq + self.buffer:
+            self.overruns += 1  # past the window, the sender ignored it
+        elif seq_num > self.exp_seq:
+            if self.chunks.find(seq_num) is None:
+                self.writer.write(seq_num, data)
+                for start, end in self.chunks.add(seq_num, seq_num + len(data)):
+                    self.held += end - start
+                self.latest = seq_num
+            else:
+                self.dup = (seq_num, seq_num + len(data))
+        else:
+            self.writer.write(seq_num, data)
+            # increment expected sequence to highest received data
+            self.exp_seq += len(data)
+            if self.chunks and self.chunks.starts[0] == self.exp_seq:
+                self.held -= self.chunks.ends[0] - self.chunks.starts[0]
+                self.exp_seq = self.chunks.ends[0]
+            self.chunks.trim(self.exp_seq)
+            self.autotune(now)
+
+    def complete(self):
+        """ True once every byte up to the FIN is in order """
+        return self.fin is not None and self.exp_seq >= self.fin
+
+    def autotune(self, now):
+        """ Measures the rtt and grows the buffer once per rtt, as data is delivered in order """
+        if self.rtt_seq is None or self.exp_seq >= self.rtt_seq:
+            if self.rtt_seq is not None:
+                sample = now - self.rtt_time    # rtt or longer, the smallest is closest
+                self.rtt = sample if self.rtt is None else min(self.rtt, sample)
+            self.rtt_seq = self.exp_seq + self.buffer
+            self.rtt_time = now
+        if self.space_time is None:
+            self.space_time = now
+            self.space_seq = self.exp_seq
+        if self.rtt is None or now - self.space_time < self.rtt:
+            return
+
+        copied = self.exp_seq - self.space_seq
+        self.space_seq = self.exp_seq
+        self.space_time = now
+        if copied <= self.space:
+            return
+        want = 2 * copied + 16 * self.mss      # an rtt of slack for loss recovery
+        if self.space:
+            want += want * (copied - self.space) // self.space  # and for the sender still speeding up
+        self.space = copied
+        want = min(want, self.max_buffer)
+        if want <= self.buffer:
+            return
+        if self.resize is not None:
+            want = min(want, self.resize(ceil(want / self.mss)) * self.mss)
+        self.buffer = max(self.buffer, want)
+
+    def rwin(self):
+        """ Receive window field: the free buffer, never moving the right edge left """
+        self.edge = max(self.edge, self.exp_seq + self.buffer - self.held)
+        return min((self.edge - self.exp_seq) >> self.wscale, 0xFFFF)
+
+    def sack_blocks(self):
+        """ Chunks held ahead of exp_seq, the one with the latest segment first, after a duplicate """
+        blocks = []
+        latest = self.chunks.find(self.latest) if self.latest is not None else None
+        if self.dup is not None:
+            blocks.append(self.dup)
+            latest = self.chunks.find(self.dup[0]) or latest    # the chunk holding it comes next
+        if latest is not None:
+            blocks.append(latest)
+        for block in self.chunks:
+            if len(blocks) >= SACK_MAX_BLOCKS:
+                break
+            if block != latest:
+                blocks.append(block)
+        return blocks
+
+    def ack_pack(self):
+        """ ACK for everything received in order so far, with SACK blocks for the rest """
+        blocks = self.sack_blocks()
+        self.dup = None
+        return self.ack.pack(self.exp_seq, self.rwin(), blocks, (self.ts_val, self.ts_recent or 0))
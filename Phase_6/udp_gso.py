@@ -0,0 +1,106 @@
+# This file contains the Linux UDP segmentation offload (GSO) and receive offload (GRO) fast path
+"""
+GSO: one sendmsg carries several equal sized packets (the last may be shorter)
+and the kernel splits them into separate datagrams, so the per-datagram
+syscall cost is paid once per group.
+
+GRO: the kernel may hand several datagrams of one flow to a single recvmsg,
+with the size of each in a UDP_GRO control message, and they are split again
+before the protocol sees them.
+
+Both fall back to plain sendto/recv when the kernel or platform lacks support.
+"""
+import socket
+import struct
+
+SOL_UDP = getattr(socket, 'SOL_UDP', 17)
+UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)   # Linux 4.18+
+UDP_GRO = getattr(socket, 'UDP_GRO', 104)           # Linux 5.0+
+
+GSO_MAX_SEGMENTS = 64       # most segments the kernel accepts in one send
+UDP_MAX_PAYLOAD = 65507     # most bytes in one (IPv4) send
+GRO_BUF_SIZE = 65535        # largest coalesced receive
+
+GSO_SIZE = struct.Struct('=H')
+GRO_SIZE = struct.Struct('=i')
+
+
+def gso_supported(sock):
+    """ Returns True if the socket can send with UDP_SEGMENT """
+    if not hasattr(sock, 'sendmsg'):
+        return False
+    try:
+        sock.setsockopt(SOL_UDP, UDP_SEGMENT, 0)    # 0 leaves plain sends unchanged
+    except OSError:
+        return False
+    return True
+
+
+def enable_gro(sock):
+    """ Turns on UDP_GRO for the socket, returns False if not supported """
+    if not hasattr(sock, 'recvmsg_into'):
+        return False
+    try:
+        sock.setsockopt(SOL_UDP, UDP_GRO, 1)
+    except OSError:
+        return False
+    return True
+
+
+def gro_segment_size(ancdata, n_bytes):
+    """ Size of each datagram in a coalesced receive, n_bytes if not coalesced """
+    for level, cmsg_type, data in ancdata:
+        if level == SOL_UDP and cmsg_type == UDP_GRO:
+            if len(data) == GSO_SIZE.size:
+                return GSO_SIZE.unpack(data)[0]
+            return GRO_SIZE.unpack_from(data)[0]
+    return n_bytes
+
+
+class GSOSender():
+    """
+    Sends lists of packets, several per syscall when UDP_SEGMENT is available
+    """
+    def __init__(self, sock, enabled=True):
+        self.sock = sock
+        self.enabled = enabled and gso_supported(sock)
+
+    def max_batch(self, pkt_size):
+        """ Most packets of pkt_size one send can carry """
+        if not self.enabled:
+            return 1
+        return max(1, min(GSO_MAX_SEGMENTS, UDP_MAX_PAYLOAD // pkt_size))
+
+    def send(self, packets, addr):
+        """
+        Sends every packet in the list to addr
+        """
+        i = 0
+        while i < len(packets):
+            if not self.enabled or i == len(packets) - 1:
+                self.sock.sendto(packets[i], addr)
+                i += 1
+                continue
+
+            # group packets of the same size, only the last one may be shorter
+            seg_size = len(packets[i])
+            end = i + 1
+            limit = i + self.max_batch(seg_size)
+            while end < len(packets) and end < limit and len(packets[end]) == seg_size:
+                end += 1
+            if end < len(packets) and end < limit and len(packets[end]) < seg_size:
+                end += 1
+
+            if end - i == 1:
+                self.sock.sendto(packets[i], addr)
+            else:
+                try:
+                    self.sock.sendmsg(packets[i:end],
+                                      [(SOL_UDP, UDP_SEGMENT, GSO_SIZE.pack(seg_size))], 0, addr)
+                except BlockingIOError:
+                    raise       # send buffer full, same as a plain sendto
+                except OSError:
+                    # e.g. no checksum offload on the route, use plain sends from now on
+                    self.enabled = False
+                    continue
+            i = end